@@ -68,6 +68,7 @@ def main():
         return
 
     localDaqFile = open(localDaqFilename, 'rb')
+    localDaqReader = DduEventReader(localDaqFile)
     events = []
     smallest_size = 99999
     smallest_size_idx = -1
@@ -75,7 +76,9 @@ def main():
     largest_size_idx = -1
     events_read = 0
     if localDaqEventNum is not None:
-        events.append(dduReadEventRaw(localDaqFile, localDaqEventNum))
+        # jump straight to the requested event using the sidecar event index instead of scanning the file
+        seekToL1Id(localDaqReader, loadSidecarL1IdLookup(localDaqFilename), localDaqEventNum)
+        events.append(localDaqReader.readEvent(localDaqEventNum).tolist())
         events_read = 1
         print("read event #%d, size = %d bytes" % (localDaqEventNum, len(events[0]) * 8))
         localDaqEventNum = None
@@ -83,7 +86,7 @@ def main():
     size = 1
     words_read = 0
     while size > 0 and ((events_read < localDaqNumOfEvents) or localDaqNumOfEvents is None):
-        event = dduReadEventRaw(localDaqFile, localDaqEventNum)
+        event = localDaqReader.readEvent(localDaqEventNum).tolist()
         size = len(event)
         words_read += size
         events.append(event)
@@ -0,0 +1,40 @@
+from utils import *
+from data_processing_utils import *
+import sys
+import os
+
+# converts a CTP7 text dump (written by csc_daq.py) to a binary file in the local DAQ raw layout, so that it can be read at binary speed by all the local DAQ tools
+# (they also accept the text dumps directly, but then the whole dump is parsed every time it's opened)
+
+def main():
+
+    textFilename = ""
+    rawFilename = ""
+
+    if len(sys.argv) < 2:
+        print('Usage: ctp7_dump_to_raw.py <ctp7_text_dump_file> [output_raw_file]')
+        print('the default output filename is the input filename with the extension replaced by .raw')
+        return
+    else:
+        textFilename = sys.argv[1]
+
+    if len(sys.argv) > 2:
+        rawFilename = sys.argv[2]
+    else:
+        rawFilename = os.path.splitext(textFilename)[0] + ".raw"
+
+    if not isCtp7Dump(textFilename):
+        printRed("%s doesn't look like a CTP7 text dump (it should start with a ======================== Event line)" % textFilename)
+        return
+
+    if os.path.abspath(rawFilename) == os.path.abspath(textFilename):
+        printRed("The output file would overwrite the input file, please provide a different output filename")
+        return
+
+    heading('Converting CTP7 text dump to local DAQ raw format')
+
+    numEvents = convertCtp7Dump(textFilename, rawFilename)
+    printCyan("Wrote %d events (%d bytes) to %s" % (numEvents, os.path.getsize(rawFilename), rawFilename))
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,15 @@ import sys
 import os
 import struct
 import numpy as np
+import json
+import csv
+import itertools
+import contextlib
+import multiprocessing
 from time import *
 from random import randint
-import tkinter
+import matplotlib
+matplotlib.use("Agg") # the plots are only written to files, so no display is needed
 import matplotlib.pyplot as plt
 
 PRESCALE = 1
@@ -44,16 +50,39 @@ CFEB_DATA_SIZE = 12800
 DAQ_HEADER_SIZE_BITS = 384
 DAQ_TRAILER_SIZE_BITS = 384
 
+RING_BUFFER_CAPACITY = 64 # initial number of events in the ring buffers of RingBuffer and RingDaq, the capacity is doubled when one is full
+
+EVENT_DRIVEN_WINDOW_BX = 1000000 # the per BX statistics are filled in windows of this many BXs in the event driven mode, so no array is as long as the whole second
+
+# the per BX buffer usage and data rates are not kept, they go into StreamStats (in chunks of STATS_CHUNK_BX in the per BX model), so the memory doesn't grow with the simulated time
+STATS_CHUNK_BX = 100000
+STATS_DOWNSAMPLE_BX = 1000 # the plots show the min and max of each block of this many BXs (doubled whenever there would be more than STATS_MAX_POINTS blocks)
+STATS_MAX_POINTS = 20000
+STATS_BUF_BIN_BITS = 1000 # bin width of the buffer usage histogram (the data rate histograms have one bin per bit/BX)
+STATS_QUANTILES = [0.5, 0.9, 0.99, 0.999]
+
+SWEEP_JOB_MEMORY_MB = 1024 # memory needed by one sweep worker for a configuration without prescale (about 700MB peak), used to limit the default number of jobs
+
+# the parameters that can be changed per configuration in the sweep mode (see applyConfig), L1A_RATE and the data rates are given before prescaling
+SWEEP_PARAMETERS = ["PRESCALE", "L1A_RATE", "OUTPUT_BANDWDIDTH_BPBX", "BANDWIDTH_BPBX", "INPUT_LATENCY_BX", "seed"]
+DEFAULT_CONFIG = {"PRESCALE": PRESCALE, "L1A_RATE": L1A_RATE * PRESCALE, "OUTPUT_BANDWDIDTH_BPBX": OUTPUT_BANDWDIDTH_BPBX, "BANDWIDTH_BPBX": dict(BANDWIDTH_BPBX), "INPUT_LATENCY_BX": INPUT_LATENCY_BX}
+UNPRESCALED_DATA_RATES_MBPS = dict([(input_type, rate * PRESCALE) for input_type, rate in DATA_RATES_MBPS.items()])
+
 frontend_buffers = []
 input_buffers = []
 
 daq = None
 
 max_buf_usage = []
-total_buf_usage = np.zeros(shape=(BX_PER_SECOND), dtype="uint32")
 
-input_data_rate = np.zeros(shape=(BX_PER_SECOND), dtype="uint16")
-output_data_rate = np.zeros(shape=(BX_PER_SECOND), dtype="uint16")
+# per BX values of the current chunk in the per BX model
+total_buf_usage = np.zeros(shape=(STATS_CHUNK_BX), dtype="uint32")
+input_data_rate = np.zeros(shape=(STATS_CHUNK_BX), dtype="uint16")
+output_data_rate = np.zeros(shape=(STATS_CHUNK_BX), dtype="uint16")
+
+total_buf_stats = None
+input_rate_stats = None
+output_rate_stats = None
 
 class Daq:
 
@@ -91,14 +120,11 @@ class Daq:
                 self.trailer_bits_sent = 0
                 self.input_idx = 0
 
-                if len(self.l1a_fifo) == 0:
+                l1a = self.popReadyL1a(inputBuffers)
+                if l1a == -1:
                     return self.output_bandwidth_bpbx - bitsToSend
                 else:
-                    if not self.allBuffersHaveL1a(self.l1a_fifo[0], inputBuffers):
-                        return self.output_bandwidth_bpbx - bitsToSend
-
-                    self.l1a = self.l1a_fifo[0]
-                    del self.l1a_fifo[0]
+                    self.l1a = l1a
                     self.header_bits_sent = 0
                     self.trailer_bits_sent = 0
                     self.state = "HEADER"
@@ -133,6 +159,14 @@ class Daq:
 
         return self.output_bandwidth_bpbx - bitsToSend
 
+    # removes and returns the first L1A in the FIFO if all input buffers have the complete event for it, otherwise returns -1
+    def popReadyL1a(self, inputBuffers):
+        if len(self.l1a_fifo) == 0 or not self.allBuffersHaveL1a(self.l1a_fifo[0], inputBuffers):
+            return -1
+        l1a = self.l1a_fifo[0]
+        del self.l1a_fifo[0]
+        return l1a
+
     def allBuffersHaveL1a(self, l1aId, inputBuffers):
         for i in range(len(inputBuffers)):
             if (inputBuffers[i].getFirstL1A() != l1aId) or (not inputBuffers[i].getEvent(l1aId).is_complete):
@@ -140,6 +174,47 @@ class Daq:
 
         return True
 
+    # called by the input buffers when they have received the complete event for an L1A (this DAQ checks all buffers in allBuffersHaveL1a instead)
+    def inputComplete(self, l1aId):
+        pass
+
+# same as Daq, but the L1A FIFO is a ring buffer, and instead of looking at all input buffers for the first L1A in every idle BX,
+# it counts the inputs that have received the complete event of each L1A (the input buffers report it with inputComplete)
+# the L1A can be started when the count reaches the number of inputs: the DAQ takes the L1As in order and the frontends send them in order,
+# so at that point the L1A is the first one in all input buffers, which is what Daq.allBuffersHaveL1a checks
+class RingDaq(Daq):
+
+    def __init__(self, outputBandwidthBpbx, headerSize, trailerSize, capacity = RING_BUFFER_CAPACITY):
+        Daq.__init__(self, outputBandwidthBpbx, headerSize, trailerSize)
+        self.l1a_fifo = [0] * capacity
+        self.fifo_head = 0
+        self.fifo_count = 0
+        self.complete_inputs = {} # L1A ID -> number of inputs that have the complete event
+
+    def addL1a(self, l1aId):
+        if self.fifo_count == len(self.l1a_fifo):
+            self.l1a_fifo = self.l1a_fifo[self.fifo_head:] + self.l1a_fifo[:self.fifo_head] + [0] * len(self.l1a_fifo)
+            self.fifo_head = 0
+        self.l1a_fifo[(self.fifo_head + self.fifo_count) % len(self.l1a_fifo)] = l1aId
+        self.fifo_count += 1
+
+    def popReadyL1a(self, inputBuffers):
+        if self.fifo_count == 0:
+            return -1
+        l1a = self.l1a_fifo[self.fifo_head]
+        if self.complete_inputs.get(l1a, 0) != len(inputBuffers):
+            return -1
+        del self.complete_inputs[l1a]
+        self.fifo_head = (self.fifo_head + 1) % len(self.l1a_fifo)
+        self.fifo_count -= 1
+        return l1a
+
+    def allBuffersHaveL1a(self, l1aId, inputBuffers):
+        return self.complete_inputs.get(l1aId, 0) == len(inputBuffers)
+
+    def inputComplete(self, l1aId):
+        self.complete_inputs[l1aId] = self.complete_inputs.get(l1aId, 0) + 1
+
 class Buffer:
 
     bit_cnt = 0
@@ -197,6 +272,97 @@ class Buffer:
         else:
             return -1
 
+    def getFirstBx(self):
+        return self.events[self.l1as[0]].bx_id
+
+    def getNumBits(self):
+        return self.bit_cnt
+
+# same interface as Buffer, but the events are kept in preallocated ring buffers (L1A ID, BX, remaining bits, complete flag), so adding and removing an event is O(1)
+# events are always read and removed from the head, and bits are only added to the last event, which is how the frontends and the DAQ use the buffers
+# (the arrays are python lists, because single elements are much faster to access from the per BX loop than in numpy arrays, see daq_emulator_benchmark.py)
+class RingBuffer:
+
+    def __init__(self, onComplete = None, capacity = RING_BUFFER_CAPACITY):
+        self.l1as = [0] * capacity
+        self.bxs = [0] * capacity
+        self.sizes = [0] * capacity
+        self.complete = [False] * capacity
+        self.head = 0
+        self.count = 0
+        self.bit_cnt = 0
+        self.on_complete = onComplete # called with the L1A ID when addBitsToEvent completes an event
+
+    def push(self, bxId, l1aId, size, isComplete):
+        capacity = len(self.l1as)
+        if self.count == capacity:
+            self.grow()
+            capacity = len(self.l1as)
+        tail = (self.head + self.count) % capacity
+        self.l1as[tail] = l1aId
+        self.bxs[tail] = bxId
+        self.sizes[tail] = size
+        self.complete[tail] = isComplete
+        self.count += 1
+        self.bit_cnt += size
+
+    # doubles the capacity, moving the events to the start of the arrays
+    def grow(self):
+        capacity = len(self.l1as)
+        self.l1as = self.l1as[self.head:] + self.l1as[:self.head] + [0] * capacity
+        self.bxs = self.bxs[self.head:] + self.bxs[:self.head] + [0] * capacity
+        self.sizes = self.sizes[self.head:] + self.sizes[:self.head] + [0] * capacity
+        self.complete = self.complete[self.head:] + self.complete[:self.head] + [False] * capacity
+        self.head = 0
+
+    def addEvent(self, event):
+        self.push(event.bx_id, event.l1a_id, event.size, event.is_complete)
+
+    def addBitsToEvent(self, bxId, l1aId, numBits, isSetComplete):
+        tail = (self.head + self.count - 1) % len(self.l1as)
+        if self.count == 0 or self.l1as[tail] != l1aId:
+            # like Buffer, a new event starts with the first chunk, and then the chunk is added again below
+            self.push(bxId, l1aId, numBits, isSetComplete)
+            tail = (self.head + self.count - 1) % len(self.l1as)
+        self.sizes[tail] += numBits
+        self.bit_cnt += numBits
+        if isSetComplete:
+            self.complete[tail] = True
+            if self.on_complete is not None:
+                self.on_complete(l1aId)
+
+    def readEvent(self, l1aId, numBits):
+        if self.count == 0 or self.l1as[self.head] != l1aId:
+            return False, 0
+        size = self.sizes[self.head]
+        if size > numBits:
+            self.sizes[self.head] = size - numBits
+            self.bit_cnt -= numBits
+            return True, numBits
+        else:
+            self.sizes[self.head] = 0
+            self.bit_cnt -= size
+            return False, size
+
+    def isCompleteEvent(self, l1aId):
+        return self.count > 0 and self.l1as[self.head] == l1aId and self.complete[self.head]
+
+    def removeL1a(self, l1aId):
+        if self.count > 0 and self.l1as[self.head] == l1aId:
+            self.head = (self.head + 1) % len(self.l1as)
+            self.count -= 1
+        else:
+            raise ValueError("Attempting to delete L1A %d from a buffer which is not the first L1A in the FIFO" % l1aId)
+
+    def getFirstL1A(self):
+        if self.count > 0:
+            return self.l1as[self.head]
+        else:
+            return -1
+
+    def getFirstBx(self):
+        return self.bxs[self.head]
+
     def getNumBits(self):
         return self.bit_cnt
 
@@ -228,116 +394,394 @@ class Event:
     def setComplete(self, isComplete):
         self.is_complete = isComplete
 
-def main():
-
-    for i in range(len(INPUT_TYPES)):
-        frontend_buffers.append(Buffer())
-        input_buffers.append(Buffer())
-        max_buf_usage.append(0)
+# online statistics of a per BX series (values are added in chunks), in constant memory:
+# count, sum and running max, a histogram with fixed width bins (the quantiles come from it), and the min and max of each block of BXs for plotting
+# when there would be more than maxPoints blocks, neighbouring blocks are merged and the block size is doubled
+class StreamStats:
+
+    def __init__(self, binWidth, blockBx = STATS_DOWNSAMPLE_BX, maxPoints = STATS_MAX_POINTS):
+        self.bin_width = binWidth
+        self.hist = np.zeros(0, dtype="int64")
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+        self.block_bx = blockBx
+        self.max_points = maxPoints
+        self.block_mins = np.zeros(0, dtype="int64")
+        self.block_maxs = np.zeros(0, dtype="int64")
+        # the last block, until it has block_bx values
+        self.partial_count = 0
+        self.partial_min = 0
+        self.partial_max = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype="int64")
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.sum += int(values.sum())
+        self.max = max(self.max, int(values.max()))
+
+        bins = values // self.bin_width
+        if self.max // self.bin_width >= self.hist.size:
+            self.hist = np.append(self.hist, np.zeros(max(self.max // self.bin_width + 1, 2 * self.hist.size) - self.hist.size, dtype="int64"))
+        self.hist += np.bincount(bins, minlength=self.hist.size)
+
+        pos = 0
+        while pos < values.size:
+            if self.partial_count == 0 and values.size - pos >= self.block_bx:
+                # as many full blocks as fit before the next merge
+                num_blocks = min((values.size - pos) // self.block_bx, self.max_points - self.block_mins.size + 1)
+                blocks = values[pos:pos + num_blocks * self.block_bx].reshape(num_blocks, self.block_bx)
+                pos += num_blocks * self.block_bx
+                self.appendBlocks(blocks.min(axis=1), blocks.max(axis=1))
+            else:
+                part = values[pos:pos + self.block_bx - self.partial_count]
+                if self.partial_count == 0:
+                    self.partial_min = int(part.min())
+                    self.partial_max = int(part.max())
+                else:
+                    self.partial_min = min(self.partial_min, int(part.min()))
+                    self.partial_max = max(self.partial_max, int(part.max()))
+                self.partial_count += part.size
+                pos += part.size
+                if self.partial_count == self.block_bx:
+                    self.partial_count = 0
+                    self.appendBlocks(np.array([self.partial_min]), np.array([self.partial_max]))
+
+    # called when there is no partial block
+    def appendBlocks(self, mins, maxs):
+        self.block_mins = np.append(self.block_mins, mins)
+        self.block_maxs = np.append(self.block_maxs, maxs)
+        if self.block_mins.size > self.max_points:
+            if self.block_mins.size % 2 == 1:
+                # the odd block is the first half of the next (partial) block
+                self.partial_count = self.block_bx
+                self.partial_min = int(self.block_mins[-1])
+                self.partial_max = int(self.block_maxs[-1])
+                self.block_mins = self.block_mins[:-1]
+                self.block_maxs = self.block_maxs[:-1]
+            self.block_mins = self.block_mins.reshape(-1, 2).min(axis=1)
+            self.block_maxs = self.block_maxs.reshape(-1, 2).max(axis=1)
+            self.block_bx *= 2
+
+    # returns the first BX of each block, and the min and max values of the blocks (including the partial one)
+    def getBlocks(self):
+        mins = self.block_mins
+        maxs = self.block_maxs
+        if self.partial_count > 0:
+            mins = np.append(mins, self.partial_min)
+            maxs = np.append(maxs, self.partial_max)
+        return np.arange(mins.size) * self.block_bx, mins, maxs
+
+    # returns the histogram counts up to the bin of the max value, and the bin edges
+    def getHistogram(self):
+        num_bins = self.max // self.bin_width + 1 if self.count > 0 else 0
+        return self.hist[:num_bins], np.arange(num_bins + 1) * self.bin_width
+
+    def getMean(self):
+        return self.sum / self.count if self.count > 0 else 0.0
+
+    # returns the smallest value that at least a fraction q of the values are not larger than (rounded up to the top of its histogram bin)
+    def getQuantile(self, q):
+        if self.count == 0:
+            return 0
+        idx = int(np.searchsorted(np.cumsum(self.hist), max(int(np.ceil(q * self.count)), 1)))
+        return min((idx + 1) * self.bin_width - 1, self.max)
 
-    global daq
-    daq = Daq(OUTPUT_BANDWDIDTH_BPBX, DAQ_HEADER_SIZE_BITS, DAQ_TRAILER_SIZE_BITS)
+def main():
 
-    # global buf_usage
-    # buf_usage = np.zeros(shape=(len(INPUT_TYPES), BX_PER_SECOND), dtype="uint32")
+    perBx = False
+    seed = None
+    sweepFilename = None
+    jobs = defaultSweepJobs()
+    outPrefix = "daq_emulator_sweep"
+    plotPrefix = "daq_emulator"
+    args = sys.argv[1:]
+    if '--per-bx' in args:
+        perBx = True
+        args.remove('--per-bx')
+    if '--seed' in args:
+        i = args.index('--seed')
+        seed = int(args[i + 1])
+        del args[i:i + 2]
+    if '--sweep' in args:
+        i = args.index('--sweep')
+        sweepFilename = args[i + 1]
+        del args[i:i + 2]
+    if '--jobs' in args:
+        i = args.index('--jobs')
+        jobs = int(args[i + 1])
+        del args[i:i + 2]
+    if '--out' in args:
+        i = args.index('--out')
+        outPrefix = args[i + 1]
+        del args[i:i + 2]
+    if '--plots' in args:
+        i = args.index('--plots')
+        plotPrefix = args[i + 1]
+        del args[i:i + 2]
+
+    if len(args) > 0:
+        print('Usage: daq_emulator.py [--per-bx] [--seed N] [--plots PREFIX]')
+        print('       daq_emulator.py --sweep SWEEP_FILE [--seed N] [--jobs N] [--out PREFIX]')
+        print('--per-bx clocks the DAQ one BX at a time (slow, this is the reference model), by default the event driven engine is used, which gives exactly the same results')
+        print('--seed N seeds the L1A and event size generation, so that a run can be repeated (by default a random seed is used, and printed)')
+        print('--plots PREFIX writes the plots to PREFIX_buffer_usage.png, PREFIX_data_rates.png and PREFIX_buffer_occupancy.png (default is %s)' % plotPrefix)
+        print('--sweep runs one simulated second for each configuration in SWEEP_FILE, which is a JSON object with these (optional) keys:')
+        print('    "base": parameters used by all configurations, "configs": list of configurations, "grid": parameter -> list of values, all combinations are run (for each of the configs if both are given)')
+        print('    the parameters are %s (BANDWIDTH_BPBX is a dictionary of input type -> bits per BX, the given types replace the defaults)' % ", ".join(SWEEP_PARAMETERS))
+        print('    L1A_RATE is the rate before prescaling (default is %d), configurations without a seed get one derived from the sweep seed (--seed, default is 1) and their index' % DEFAULT_CONFIG["L1A_RATE"])
+        print('--jobs N runs N configurations in parallel (default is the number of cores, but at most one per %dMB of available memory: %d)' % (SWEEP_JOB_MEMORY_MB, defaultSweepJobs()))
+        print('--out PREFIX writes the sweep results to PREFIX.csv and PREFIX.json (default is %s)' % outPrefix)
+        return
+
+    if sweepFilename is not None:
+        runSweep(sweepFilename, 1 if seed is None else seed, jobs, outPrefix)
+        return
+
+    resetEmulator()
 
     t1 = time()
 
-    runOneSecond()
+    runOneSecond(perBx, seed)
 
-    printStats()
+    printStats(plotPrefix)
 
     t2 = time()
 
     print("time took: %fs" % (t2 - t1))
 
-def runOneSecond():
-    print("generating L1As")
-    bx_l1a_id = [-1] * BX_PER_SECOND
-    for i in range(L1A_RATE):
-        bx_id = randint(0, BX_PER_SECOND - 1)
-        while bx_l1a_id[bx_id] >= 0:
-            bx_id = randint(0, BX_PER_SECOND - 1)
-        bx_l1a_id[bx_id] = i
-
-    print("sorting L1As")
-    l1a_id = 0
-    for bx in range(BX_PER_SECOND):
-        if bx_l1a_id[bx] >= 0:
-            bx_l1a_id[bx] = l1a_id
-            l1a_id += 1
+def runOneSecond(perBx = False, seed = None):
+    if seed is None:
+        seed = randint(0, 2**31 - 1)
+    print("generating L1As and input events (seed = %d)" % seed)
+    l1a_bxs, input_sizes = generateInputs(seed)
 
-    print("generating input events")
-    input_data = []
-    for i in range(len(INPUT_TYPES)):
-        input_data.append({})
-        input_type = INPUT_TYPES[i]
-        data_to_send = DATA_RATES_MBPS[input_type] * 1000000
-        while data_to_send > 0:
-            #this is just using a simple constant event size, this has to be changed of course
-            l1a_id = randint(0, L1A_RATE - 1)
-            if l1a_id in input_data[i]:
-                # TODO: in this case consider adding a smaller amount e.g. something like one more CFEB worth of data
-                input_data[i][l1a_id] += CFEB_DATA_SIZE
-                data_to_send -= CFEB_DATA_SIZE
-            else:
-                input_data[i][l1a_id] = CONSTANT_DATA_SIZE
-                data_to_send -= CONSTANT_DATA_SIZE
+    if perBx:
+        runPerBx(l1a_bxs, input_sizes)
+    else:
+        runEventDriven(l1a_bxs, input_sizes)
 
-            # while l1a_id in input_data[i]:
-            #     l1a_id = randint(0, L1A_RATE - 1)
-            # input_data[i][l1a_id] = CONSTANT_DATA_SIZE
+# returns the L1A BXs in increasing order (L1A ID is the index), and the event size of each input for each L1A as an (input, L1A) array (zero if the input has no data)
+# the same seed always gives the same L1As and event sizes
+def generateInputs(seed):
+    rng = np.random.default_rng(seed)
+    l1a_bxs = np.sort(rng.choice(BX_PER_SECOND, size=L1A_RATE, replace=False))
 
+    input_sizes = np.zeros(shape=(len(INPUT_TYPES), L1A_RATE), dtype="int32")
+    for i in range(len(INPUT_TYPES)):
+        input_sizes[i] = generateEventSizes(rng, DATA_RATES_MBPS[INPUT_TYPES[i]] * 1000000, L1A_RATE)
+
+    return l1a_bxs, input_sizes
+
+# picks random L1As until data_to_send bits are used up: the first time an L1A is picked it gets CONSTANT_DATA_SIZE bits, and every next time one more CFEB worth of data (CFEB_DATA_SIZE)
+# this is done for all picks at once: every pick is at least CFEB_DATA_SIZE, so data_to_send / CFEB_DATA_SIZE picks are always enough, and the ones after the data is used up are dropped
+# TODO: this is just using a simple constant event size, this has to be changed of course
+def generateEventSizes(rng, data_to_send, num_l1as):
+    if data_to_send <= 0:
+        return np.zeros(num_l1as, dtype="int32")
+    picks = rng.integers(0, num_l1as, size=int(np.ceil(data_to_send / CFEB_DATA_SIZE)), dtype="int32")
+    # the pick index where each L1A is picked for the first time
+    first_pick_idxs = np.full(num_l1as, picks.size)
+    np.minimum.at(first_pick_idxs, picks, np.arange(picks.size))
+    first_picks = first_pick_idxs[picks] == np.arange(picks.size)
+    data_sent = np.cumsum(np.where(first_picks, CONSTANT_DATA_SIZE, CFEB_DATA_SIZE))
+    num_picks = np.searchsorted(data_sent, data_to_send) + 1
+    counts = np.bincount(picks[:num_picks], minlength=num_l1as)
+    return np.where(counts > 0, CONSTANT_DATA_SIZE + (counts - 1) * CFEB_DATA_SIZE, 0).astype("int32")
+
+# reference model: clocks the frontends and the DAQ one BX at a time
+def runPerBx(l1a_bxs, input_sizes):
     print("start clocking DAQ")
+    next_l1a_id = 0
     for bx in range(BX_PER_SECOND):
         if bx % 10000 == 0:
             print("processing bx #%d" % bx)
-
-        l1a_id = bx_l1a_id[bx]
+        chunk_idx = bx % STATS_CHUNK_BX
 
         # L1A
-        if l1a_id != -1:
+        if next_l1a_id < l1a_bxs.size and l1a_bxs[next_l1a_id] == bx:
+            l1a_id = next_l1a_id
+            next_l1a_id += 1
             daq.addL1a(l1a_id)
+            sizes = input_sizes[:, l1a_id].tolist()
             for i in range(len(INPUT_TYPES)):
-                size = 0
-                if l1a_id in input_data[i]:
-                    size = input_data[i][l1a_id]
-                event = Event(bx, l1a_id, size, True)
+                event = Event(bx, l1a_id, sizes[i], True)
                 frontend_buffers[i].addEvent(event)
 
         # frontend to FED
         total_bits_received = 0
         for i in range(len(INPUT_TYPES)):
             first_l1a = frontend_buffers[i].getFirstL1A()
-            if (first_l1a != -1) and (bx - frontend_buffers[i].getEvent(first_l1a).bx_id >= INPUT_LATENCY_BX):
+            if (first_l1a != -1) and (bx - frontend_buffers[i].getFirstBx() >= INPUT_LATENCY_BX):
                 (is_bits_left, bits_read) = frontend_buffers[i].readEvent(first_l1a, BANDWIDTH_BPBX[INPUT_TYPES[i]])
                 if not is_bits_left:
                     frontend_buffers[i].removeL1a(first_l1a)
                 input_buffers[i].addBitsToEvent(bx, first_l1a, bits_read, not is_bits_left)
                 total_bits_received += bits_read
 
-        input_data_rate[bx] = total_bits_received
+        input_data_rate[chunk_idx] = total_bits_received
 
         # execute DAQ logic
         bits_sent = daq.runOneBx(input_buffers)
-        output_data_rate[bx] = bits_sent
+        output_data_rate[chunk_idx] = bits_sent
 
         #collect stats
-        collectStats(bx)
-
-def collectStats(bx):
+        collectStats(chunk_idx)
+        if chunk_idx == STATS_CHUNK_BX - 1 or bx == BX_PER_SECOND - 1:
+            addStats(total_buf_usage[:chunk_idx + 1], input_data_rate[:chunk_idx + 1], output_data_rate[:chunk_idx + 1])
+
+# event driven engine, gives exactly the same results as runPerBx, but only does work at the BXs where something changes
+# each frontend link and the DAQ output link is a FIFO server, so the BX where each transfer starts follows from the previous one: start = max(ready, previous start + previous duration)
+# that is solved for all events at once with a running max, then the buffer usage is evaluated at the BXs where it can peak, and the per BX statistics are filled in bulk
+# the DAQ is modelled as a continuous stream of output bits (bit position = BX * output bandwidth), which matches Daq.runOneBx as long as the header and trailer fit in one BX
+def runEventDriven(l1a_bxs, input_sizes):
+    out_bw = daq.output_bandwidth_bpbx
+    if out_bw <= max(daq.header_size_bits, daq.trailer_size_bits):
+        print("output bandwidth is not larger than the DAQ header/trailer size, using the per BX model")
+        runPerBx(l1a_bxs, input_sizes)
+        return
+
+    num_inputs = len(INPUT_TYPES)
+    num_l1as = l1a_bxs.size
+
+    print("scheduling frontend transfers")
+    # the DAQ can start an L1A in the BX when all inputs have received the complete event (and not before it's done with the previous one)
+    ready_bxs = np.zeros(num_l1as, dtype="int64")
+    data_sizes = np.zeros(num_l1as, dtype="int64")
+    for i in range(num_inputs):
+        starts, ends = scheduleFrontendTransfers(l1a_bxs, input_sizes[i], BANDWIDTH_BPBX[INPUT_TYPES[i]])
+        np.maximum(ready_bxs, ends, out=ready_bxs)
+        data_sizes += bufferSizes(input_sizes[i], BANDWIDTH_BPBX[INPUT_TYPES[i]])
+
+    print("scheduling DAQ output")
+    event_sizes = daq.header_size_bits + data_sizes + daq.trailer_size_bits
+    daq_starts = fifoStarts(ready_bxs * out_bw, event_sizes) # in output bit positions
+    data_starts = daq_starts + daq.header_size_bits
+
+    print("finding max buffer usage per input")
+    read_offsets = np.zeros(num_l1as, dtype="int64") # where each input's data starts within the L1A data
+    for i in range(num_inputs):
+        bw = BANDWIDTH_BPBX[INPUT_TYPES[i]]
+        sizes = input_sizes[i]
+        buffer_sizes = bufferSizes(sizes, bw)
+        starts, ends = scheduleFrontendTransfers(l1a_bxs, sizes, bw)
+        read_starts = data_starts + read_offsets
+        read_offsets += buffer_sizes
+
+        # the usage can only peak in the BX before the DAQ reads from this buffer or while it's reading (or at the very end)
+        reads = np.flatnonzero((buffer_sizes > 0) & (read_starts < BX_PER_SECOND * out_bw))
+        first_bxs = read_starts[reads] // out_bw - 1
+        num_bxs = (read_starts[reads] + buffer_sizes[reads] - 1) // out_bw - first_bxs + 1
+        # all BXs from first_bxs to first_bxs + num_bxs - 1 of each read, in one array
+        bxs = np.repeat(first_bxs - np.cumsum(num_bxs) + num_bxs, num_bxs) + np.arange(num_bxs.sum())
+        bxs = np.append(bxs[(bxs >= 0) & (bxs < BX_PER_SECOND)], BX_PER_SECOND - 1)
+
+        usage = receivedBits(starts, ends, buffer_sizes, bw, bxs) - cumulativeBits(read_starts, buffer_sizes, (bxs + 1) * out_bw)
+        max_buf_usage[i] = max(max_buf_usage[i], int(usage.max()))
+
+    print("filling per BX statistics")
+    # the received bits per BX of all inputs are filled one window at a time as a difference array: a transfer of n BXs gets bw bits in the first n - 1 BXs and the rest in the last one
+    # the first chunk of each event is also added to first_chunks, because the input buffers count it twice
+    # the transfers of each input are scheduled window by window (carrying on from where the previous window left off), and the ones that aren't done by the end of a window are kept for the next one
+    empty = np.zeros(0, dtype="int64")
+    pending = [(empty, empty, empty)] * num_inputs # starts, ends and sizes of the unfinished transfers of each input
+    free_bxs = [0] * num_inputs # first BX where each frontend link is free after the transfers scheduled so far
+    next_l1a = 0
+    rate = 0
+    received = 0
+    for start_bx in range(0, BX_PER_SECOND, EVENT_DRIVEN_WINDOW_BX):
+        bxs = np.arange(start_bx, min(start_bx + EVENT_DRIVEN_WINDOW_BX, BX_PER_SECOND))
+        rate_diff = np.zeros(bxs.size, dtype="int64")
+        first_chunks = np.zeros(bxs.size, dtype="int64")
+        # the transfers of the L1As after this window's ones can't start before the window ends
+        last_l1a = int(np.searchsorted(l1a_bxs, bxs[-1] + 1 - INPUT_LATENCY_BX))
+        for i in range(num_inputs):
+            bw = BANDWIDTH_BPBX[INPUT_TYPES[i]]
+            sizes = input_sizes[i, next_l1a:last_l1a].astype("int64")
+            starts, ends = scheduleFrontendTransfers(l1a_bxs[next_l1a:last_l1a], sizes, bw, free_bxs[i])
+            if ends.size > 0:
+                free_bxs[i] = int(ends[-1]) + 1
+            starts = np.concatenate((pending[i][0], starts))
+            ends = np.concatenate((pending[i][1], ends))
+            sizes = np.concatenate((pending[i][2], sizes))
+            addTransfers(rate_diff, first_chunks, start_bx, starts, ends, sizes, bw)
+            done = np.searchsorted(ends, bxs[-1], side="left") # the last bits of a transfer are taken off the rate in the BX after it ends
+            pending[i] = (starts[done:], ends[done:], sizes[done:])
+        next_l1a = last_l1a
+
+        window_rate = rate + np.cumsum(rate_diff)
+        window_received = received + np.cumsum(window_rate + first_chunks)
+        rate = window_rate[-1]
+        received = window_received[-1]
+        sent = cumulativeBits(daq_starts, event_sizes, np.append(bxs, bxs[-1] + 1) * out_bw)
+        addStats(window_received - cumulativeBits(data_starts, data_sizes, (bxs + 1) * out_bw), window_rate, np.diff(sent))
+
+# sizes of the events in an input buffer: the first chunk of each event is counted twice (see Buffer.addBitsToEvent), so that's also what the DAQ reads out
+def bufferSizes(sizes, bandwidth):
+    return sizes + np.minimum(sizes, bandwidth)
+
+# adds the transfers of one input (in order) to the received bits difference array and the first chunks of a window that starts at startBx, the parts outside of the window are ignored
+# the starts (and the ends) of one input's transfers are all different, so they can be added with fancy indexing
+def addTransfers(rateDiff, firstChunks, startBx, starts, ends, sizes, bandwidth):
+    last_chunks = sizes - (ends - starts) * bandwidth
+    for bins, idxs, weights in [(rateDiff, starts, np.full(starts.size, bandwidth)), (rateDiff, ends, last_chunks - bandwidth), (rateDiff, ends + 1, -last_chunks), (firstChunks, starts, np.minimum(sizes, bandwidth))]:
+        first, last = np.searchsorted(idxs, [startBx, startBx + bins.size])
+        bins[idxs[first:last] - startBx] += weights[first:last]
+
+# returns the BXs where each event of one input starts and finishes the transfer from the frontend to the input buffer
+# (a transfer takes ceil(size / bandwidth) BXs, but at least one, and starts INPUT_LATENCY_BX after the L1A or in the BX after the previous transfer finished)
+# the first transfer can't start before freeBx (the link is busy with earlier transfers until then)
+def scheduleFrontendTransfers(l1a_bxs, sizes, bandwidth, freeBx = 0):
+    durations = np.maximum((sizes + bandwidth - 1) // bandwidth, 1)
+    starts = fifoStarts(np.maximum(l1a_bxs + INPUT_LATENCY_BX, freeBx), durations)
+    return starts, starts + durations - 1
+
+# start times of jobs served one after another in order, where a job can't start before its ready time or before the previous job is done:
+# start[j] = max(ready[j], start[j - 1] + durations[j - 1]), which is the sum of the previous durations plus the running max of (ready - sum of the previous durations)
+def fifoStarts(ready, durations):
+    busy = np.cumsum(durations) - durations
+    return busy + np.maximum.accumulate(ready - busy)
+
+# returns the total length of the parts of the intervals (given by their starts and lengths, in order and not overlapping) that are before each of the positions
+def cumulativeBits(starts, lengths, positions):
+    done = np.searchsorted(starts + lengths, positions, side="right")
+    total = np.append(0, np.cumsum(lengths))[done]
+    partial = done < starts.size
+    idxs = done[partial]
+    total[partial] += np.clip(positions[partial] - starts[idxs], 0, lengths[idxs])
+    return total
+
+# returns the number of bits that an input buffer received by the end of each of the given BXs (each event counted with its size in the buffer, and the partially received one with the bits so far)
+def receivedBits(starts, ends, buffer_sizes, bandwidth, bxs):
+    done = np.searchsorted(ends, bxs, side="right")
+    total = np.append(0, np.cumsum(buffer_sizes))[done]
+    # a partially received event has more than one chunk, so the first chunk is a full one (counted twice)
+    partial = done < starts.size
+    partial[partial] = starts[done[partial]] <= bxs[partial]
+    total[partial] += (bxs[partial] - starts[done[partial]] + 2) * bandwidth
+    return total
+
+# puts the buffer usage of the given BX (index in the current chunk) into total_buf_usage, and updates the max buffer usage per input
+def collectStats(chunkIdx):
 
     total_buf = 0
     for i in range(len(input_buffers)):
         bits_used = input_buffers[i].getNumBits()
         total_buf += bits_used
-        # buf_usage[i, bx] = bits_used
         if bits_used > max_buf_usage[i]:
             max_buf_usage[i] = bits_used
 
-    total_buf_usage[bx] = total_buf
+    total_buf_usage[chunkIdx] = total_buf
 
-def printStats():
+# adds the per BX total buffer usage, input and output data rates of consecutive BXs to the statistics
+def addStats(totalBufUsage, inputDataRate, outputDataRate):
+    total_buf_stats.add(totalBufUsage)
+    input_rate_stats.add(inputDataRate)
+    output_rate_stats.add(outputDataRate)
+
+def printStats(plotPrefix):
 
     max_total = 0
     print("max buffer usage per input:")
@@ -346,25 +790,163 @@ def printStats():
         max_total += max_buf_usage[i]
     print("Max total buffer usage: %dMb" % (max_total/1000000))
 
+    print("total buffer usage: max = %dMb, mean = %.3fMb, %s" % (total_buf_stats.max / 1000000, total_buf_stats.getMean() / 1000000, ", ".join(["%g%% = %.3fMb" % (q * 100, total_buf_stats.getQuantile(q) / 1000000) for q in STATS_QUANTILES])))
+    print("input data rate: max = %d bits/BX, mean = %.1f bits/BX" % (input_rate_stats.max, input_rate_stats.getMean()))
+    print("output data rate: max = %d bits/BX, mean = %.1f bits/BX, output link utilisation = %.3f" % (output_rate_stats.max, output_rate_stats.getMean(), output_rate_stats.getMean() / OUTPUT_BANDWDIDTH_BPBX))
 
-    # fig = plt.figure(figsize=(30, 30))
-    # ax = plt.axes()
-    # x = np.linspace(0, BX_PER_SECOND - 1, BX_PER_SECOND, dtype="uint32")
-    # ax.plot(x, input_data_rate)
-    # ax.plot(x, output_data_rate)
-    # # plt.plot(np.linspace(0, 9, 10, dtype="uint16"), np.linspace(0, 9, 10, dtype="uint16"))
-    # fig.show()
-
-    # tk = tkinter.Tk()
+    plotMinMax(plotPrefix + "_buffer_usage.png", "Total input buffer usage (min and max per %d BX)" % total_buf_stats.block_bx, "bits", [("total buffer usage", total_buf_stats)])
+    plotMinMax(plotPrefix + "_data_rates.png", "Data rates (min and max per %d BX)" % input_rate_stats.block_bx, "bits/BX", [("input", input_rate_stats), ("output", output_rate_stats)])
+    plotHistogram(plotPrefix + "_buffer_occupancy.png", "Total input buffer occupancy", "bits", total_buf_stats)
+    print("plots written to %s_*.png" % plotPrefix)
 
-    fig = plt.figure(figsize=(30, 30))
+# plots the min/max band of each of the (label, StreamStats) series over the BXs
+def plotMinMax(filename, title, ylabel, series):
+    fig = plt.figure(figsize=(16, 9))
     ax = plt.axes()
-    x = np.linspace(0, BX_PER_SECOND - 1, BX_PER_SECOND, dtype="uint32")
-    ax.plot(x, total_buf_usage)
-    plt.show()
-    # fig.show()
-
-    # tk.mainloop()
+    for label, stats in series:
+        bxs, mins, maxs = stats.getBlocks()
+        ax.fill_between(bxs, mins, maxs, step="post", alpha=0.6, label=label)
+    ax.set_title(title)
+    ax.set_xlabel("BX")
+    ax.set_ylabel(ylabel)
+    ax.legend()
+    fig.savefig(filename)
+    plt.close(fig)
+
+# plots the histogram of a StreamStats series (number of BXs per value bin)
+def plotHistogram(filename, title, xlabel, stats):
+    fig = plt.figure(figsize=(16, 9))
+    ax = plt.axes()
+    counts, edges = stats.getHistogram()
+    ax.stairs(counts, edges, fill=True)
+    ax.set_yscale("log")
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("BXs")
+    fig.savefig(filename)
+    plt.close(fig)
+
+# (re)creates the buffers, the DAQ and the statistics arrays for the current module settings
+# the ring buffer classes are used unless legacyBuffers is set (the per BX results are the same, see daq_emulator_benchmark.py)
+def resetEmulator(legacyBuffers = False):
+    global frontend_buffers, input_buffers, daq, max_buf_usage, total_buf_usage, input_data_rate, output_data_rate, total_buf_stats, input_rate_stats, output_rate_stats
+    if legacyBuffers:
+        daq = Daq(OUTPUT_BANDWDIDTH_BPBX, DAQ_HEADER_SIZE_BITS, DAQ_TRAILER_SIZE_BITS)
+        frontend_buffers = [Buffer() for i in range(len(INPUT_TYPES))]
+        input_buffers = [Buffer() for i in range(len(INPUT_TYPES))]
+    else:
+        daq = RingDaq(OUTPUT_BANDWDIDTH_BPBX, DAQ_HEADER_SIZE_BITS, DAQ_TRAILER_SIZE_BITS)
+        frontend_buffers = [RingBuffer() for i in range(len(INPUT_TYPES))]
+        input_buffers = [RingBuffer(daq.inputComplete) for i in range(len(INPUT_TYPES))]
+    max_buf_usage = [0] * len(INPUT_TYPES)
+    total_buf_usage = np.zeros(shape=(STATS_CHUNK_BX), dtype="uint32")
+    input_data_rate = np.zeros(shape=(STATS_CHUNK_BX), dtype="uint16")
+    output_data_rate = np.zeros(shape=(STATS_CHUNK_BX), dtype="uint16")
+    total_buf_stats = StreamStats(STATS_BUF_BIN_BITS)
+    input_rate_stats = StreamStats(1)
+    output_rate_stats = StreamStats(1)
+
+# sets the module settings to the defaults overridden by the given configuration (see SWEEP_PARAMETERS), and resets the emulator
+def applyConfig(config):
+    global PRESCALE, BX_PER_SECOND, L1A_RATE, DATA_RATES_MBPS, BANDWIDTH_BPBX, OUTPUT_BANDWDIDTH_BPBX, INPUT_LATENCY_BX
+    for param in config:
+        if param not in SWEEP_PARAMETERS:
+            raise ValueError("Unknown sweep parameter: %s" % param)
+    PRESCALE = config.get("PRESCALE", DEFAULT_CONFIG["PRESCALE"])
+    BX_PER_SECOND = int(40079000 / PRESCALE)
+    L1A_RATE = int(config.get("L1A_RATE", DEFAULT_CONFIG["L1A_RATE"]) / PRESCALE)
+    DATA_RATES_MBPS = dict([(input_type, rate / PRESCALE) for input_type, rate in UNPRESCALED_DATA_RATES_MBPS.items()])
+    BANDWIDTH_BPBX = dict(DEFAULT_CONFIG["BANDWIDTH_BPBX"])
+    BANDWIDTH_BPBX.update(config.get("BANDWIDTH_BPBX", {}))
+    OUTPUT_BANDWDIDTH_BPBX = config.get("OUTPUT_BANDWDIDTH_BPBX", DEFAULT_CONFIG["OUTPUT_BANDWDIDTH_BPBX"])
+    INPUT_LATENCY_BX = config.get("INPUT_LATENCY_BX", DEFAULT_CONFIG["INPUT_LATENCY_BX"])
+    resetEmulator()
+
+# returns the list of configurations of a sweep file (see main() for the format)
+def readSweepConfigs(sweepFilename):
+    with open(sweepFilename) as f:
+        sweep = json.load(f)
+    configs = []
+    grid = sweep.get("grid", {})
+    params = sorted(grid.keys())
+    for config in sweep.get("configs", [{}]):
+        for values in itertools.product(*[grid[param] for param in params]):
+            full_config = dict(sweep.get("base", {}))
+            full_config.update(config)
+            full_config.update(zip(params, values))
+            configs.append(full_config)
+    return configs
+
+# runs one simulated second of one sweep configuration (in a worker process), returns a results dictionary
+def runSweepConfig(idx_config):
+    idx, config = idx_config
+    applyConfig(dict([(param, value) for param, value in config.items() if param != "seed"]))
+    t1 = time()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        runOneSecond(False, config["seed"])
+    return {"index": idx,
+            "config": config,
+            "seconds": time() - t1,
+            "max_buf_usage": list(max_buf_usage),
+            "sum_max_buf_usage": sum(max_buf_usage),
+            "max_total_buf_usage": total_buf_stats.max,
+            "total_buf_usage_quantiles": [total_buf_stats.getQuantile(q) for q in STATS_QUANTILES],
+            "output_link_utilisation": output_rate_stats.sum / (BX_PER_SECOND * OUTPUT_BANDWDIDTH_BPBX)}
+
+# returns the number of cores, limited so that each job gets SWEEP_JOB_MEMORY_MB of the available memory (if that can be read from /proc/meminfo)
+def defaultSweepJobs():
+    jobs = multiprocessing.cpu_count()
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    jobs = max(1, min(jobs, int(line.split()[1]) // 1024 // SWEEP_JOB_MEMORY_MB))
+    except (IOError, OSError, ValueError):
+        pass
+    return jobs
+
+# runs all configurations of a sweep file in a process pool and writes the results table to outPrefix.csv and outPrefix.json
+# each configuration gets its own seed (unless it has one): the seeds are drawn from the sweep seed, so the same sweep file and seed always give the same results
+def runSweep(sweepFilename, sweepSeed, jobs, outPrefix):
+    configs = readSweepConfigs(sweepFilename)
+    seeds = np.random.SeedSequence(sweepSeed).generate_state(len(configs))
+    for idx in range(len(configs)):
+        if "seed" not in configs[idx]:
+            configs[idx]["seed"] = int(seeds[idx])
+
+    print("running %d configurations with %d jobs" % (len(configs), jobs))
+    t1 = time()
+    results = []
+    # one configuration per worker process, so that the memory of a finished one is given back
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=1)
+    for res in pool.imap_unordered(runSweepConfig, enumerate(configs)):
+        results.append(res)
+        print("    %d/%d done: configuration #%d %s: max total buffer usage = %dMb, sum of max buffer usage per input = %dMb, output link utilisation = %.3f (%.1fs)" % (len(results), len(configs), res["index"], json.dumps(res["config"], sort_keys=True), res["max_total_buf_usage"] / 1000000, res["sum_max_buf_usage"] / 1000000, res["output_link_utilisation"], res["seconds"]))
+    pool.close()
+    pool.join()
+    results.sort(key=lambda res: res["index"])
+
+    with open(outPrefix + ".json", "w") as f:
+        json.dump({"sweep_file": sweepFilename, "sweep_seed": sweepSeed, "input_types": INPUT_TYPES, "quantiles": STATS_QUANTILES, "results": results}, f, indent=1)
+    writeSweepCsv(outPrefix + ".csv", results)
+    print("results written to %s.csv and %s.json (took %.1fs)" % (outPrefix, outPrefix, time() - t1))
+
+# one row per configuration: the parameters (one column per input type for BANDWIDTH_BPBX), the summary numbers, and the max buffer usage of each input
+def writeSweepCsv(filename, results):
+    input_types = sorted(set(INPUT_TYPES))
+    header = ["index", "seed", "PRESCALE", "L1A_RATE", "OUTPUT_BANDWDIDTH_BPBX", "INPUT_LATENCY_BX"] + ["BANDWIDTH_BPBX %s" % input_type for input_type in input_types]
+    header += ["max_total_buf_usage"] + ["total_buf_usage %g%%" % (q * 100) for q in STATS_QUANTILES] + ["sum_max_buf_usage", "output_link_utilisation", "seconds"] + ["max_buf_usage %d (%s)" % (i, INPUT_TYPES[i]) for i in range(len(INPUT_TYPES))]
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for res in results:
+            config = dict(DEFAULT_CONFIG)
+            config.update(res["config"])
+            bandwidths = dict(DEFAULT_CONFIG["BANDWIDTH_BPBX"])
+            bandwidths.update(res["config"].get("BANDWIDTH_BPBX", {}))
+            row = [res["index"], config["seed"], config["PRESCALE"], config["L1A_RATE"], config["OUTPUT_BANDWDIDTH_BPBX"], config["INPUT_LATENCY_BX"]] + [bandwidths[input_type] for input_type in input_types]
+            row += [res["max_total_buf_usage"]] + res["total_buf_usage_quantiles"] + [res["sum_max_buf_usage"], res["output_link_utilisation"], res["seconds"]] + res["max_buf_usage"]
+            writer.writerow(row)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,135 @@
+import sys
+import io
+import contextlib
+import numpy as np
+from time import *
+import daq_emulator as de
+
+# micro-benchmark of the daq_emulator event FIFOs: the original Buffer and Daq classes (dict of events plus an L1A list, and an L1A list in the DAQ)
+# against RingBuffer and RingDaq (preallocated ring buffers, and the number of complete inputs per L1A counted as the events arrive)
+# it also runs the per BX model on a prescaled second with both sets of classes and checks that the results are exactly the same
+
+QUEUE_DEPTHS = [1, 16, 256, 4096] # number of events waiting in a buffer while events are pushed and popped
+NUM_OPERATIONS = 200000
+DEFAULT_PRESCALE = 200
+CHUNK_BITS = 1000 # bits read per call in the buffer benchmark
+EVENT_BITS = 3500 # size of the events in the buffer benchmark (so an event is read in 4 chunks)
+
+def main():
+
+    prescale = DEFAULT_PRESCALE
+    seed = 1
+    numOps = NUM_OPERATIONS
+    args = sys.argv[1:]
+    if '--prescale' in args:
+        i = args.index('--prescale')
+        prescale = int(args[i + 1])
+        del args[i:i + 2]
+    if '--seed' in args:
+        i = args.index('--seed')
+        seed = int(args[i + 1])
+        del args[i:i + 2]
+    if '--ops' in args:
+        i = args.index('--ops')
+        numOps = int(args[i + 1])
+        del args[i:i + 2]
+
+    if len(args) > 0:
+        print('Usage: daq_emulator_benchmark.py [--prescale N] [--seed N] [--ops N]')
+        print('--prescale N prescale of the per BX run (default is %d), use 0 to skip it' % DEFAULT_PRESCALE)
+        print('--seed N seed of the per BX run (default is 1)')
+        print('--ops N number of events pushed and popped in each micro-benchmark (default is %d)' % NUM_OPERATIONS)
+        return
+
+    print("buffer push / read / pop (%d events of %d bits, read in %d bit chunks):" % (numOps, EVENT_BITS, CHUNK_BITS))
+    for depth in QUEUE_DEPTHS:
+        legacy = benchmarkBuffer(de.Buffer(), depth, numOps)
+        ring = benchmarkBuffer(de.RingBuffer(), depth, numOps)
+        printResult("queue depth %d" % depth, legacy, ring, numOps)
+
+    print("DAQ L1A FIFO push / pop with %d complete inputs:" % len(de.INPUT_TYPES))
+    for depth in QUEUE_DEPTHS:
+        legacy = benchmarkDaqFifo(True, depth, numOps)
+        ring = benchmarkDaqFifo(False, depth, numOps)
+        printResult("queue depth %d" % depth, legacy, ring, numOps)
+
+    print("idle DAQ BX waiting for the last of %d inputs:" % len(de.INPUT_TYPES))
+    legacy = benchmarkDaqIdle(True, numOps)
+    ring = benchmarkDaqIdle(False, numOps)
+    printResult("idle BX", legacy, ring, numOps)
+
+    if prescale > 0:
+        print("per BX model, one second with prescale %d (seed %d):" % (prescale, seed))
+        legacy, legacyResults = runPerBx(prescale, seed, True)
+        ring, ringResults = runPerBx(prescale, seed, False)
+        print("    %-16s Buffer/Daq %10.2f s   RingBuffer/RingDaq %10.2f s   (x%.2f)" % ("full run", legacy, ring, legacy / ring))
+        same = legacyResults[0] == ringResults[0] and all([np.array_equal(a, b) for a, b in zip(legacyResults[1:], ringResults[1:])])
+        print("    results are %s" % ("the same" if same else "DIFFERENT"))
+
+def printResult(name, legacySeconds, ringSeconds, numOps):
+    print("    %-16s Buffer/Daq %10.3f us  RingBuffer/RingDaq %10.3f us  (x%.2f)" % (name, legacySeconds / numOps * 1e6, ringSeconds / numOps * 1e6, legacySeconds / ringSeconds))
+
+# keeps depth events in the buffer, and then for each new event reads the first one in chunks and removes it, returns the time it took
+def benchmarkBuffer(buffer, depth, numOps):
+    for l1a in range(depth):
+        buffer.addEvent(de.Event(l1a, l1a, EVENT_BITS, True))
+    t1 = time()
+    for l1a in range(depth, depth + numOps):
+        buffer.addEvent(de.Event(l1a, l1a, EVENT_BITS, True))
+        first_l1a = buffer.getFirstL1A()
+        is_bits_left = True
+        while is_bits_left:
+            (is_bits_left, bits_read) = buffer.readEvent(first_l1a, CHUNK_BITS)
+        buffer.removeL1a(first_l1a)
+    return time() - t1
+
+# returns a DAQ (old or ring classes) and its input buffers, with the empty events of the given L1As in all inputs
+def makeDaq(legacy, l1as, numCompleteInputs):
+    if legacy:
+        daq = de.Daq(de.OUTPUT_BANDWDIDTH_BPBX, de.DAQ_HEADER_SIZE_BITS, de.DAQ_TRAILER_SIZE_BITS)
+        inputs = [de.Buffer() for i in range(len(de.INPUT_TYPES))]
+    else:
+        daq = de.RingDaq(de.OUTPUT_BANDWDIDTH_BPBX, de.DAQ_HEADER_SIZE_BITS, de.DAQ_TRAILER_SIZE_BITS)
+        inputs = [de.RingBuffer(daq.inputComplete) for i in range(len(de.INPUT_TYPES))]
+    for l1a in l1as:
+        daq.addL1a(l1a)
+        for i in range(len(inputs)):
+            inputs[i].addBitsToEvent(0, l1a, 0, i < numCompleteInputs)
+    return daq, inputs
+
+# keeps depth L1As in the DAQ FIFO (with empty events in all inputs), and then for each new L1A takes the first one and removes it from the inputs, returns the time it took
+def benchmarkDaqFifo(legacy, depth, numOps):
+    daq, inputs = makeDaq(legacy, range(depth), len(de.INPUT_TYPES))
+    t1 = time()
+    for l1a in range(depth, depth + numOps):
+        daq.addL1a(l1a)
+        for i in range(len(inputs)):
+            inputs[i].addBitsToEvent(0, l1a, 0, True)
+        first_l1a = daq.popReadyL1a(inputs)
+        for i in range(len(inputs)):
+            inputs[i].removeL1a(first_l1a)
+    return time() - t1
+
+# one L1A that all inputs but the last have received, the DAQ checks in every BX if it can start it, returns the time it took
+def benchmarkDaqIdle(legacy, numOps):
+    daq, inputs = makeDaq(legacy, [0], len(de.INPUT_TYPES) - 1)
+    t1 = time()
+    for bx in range(numOps):
+        daq.runOneBx(inputs)
+    return time() - t1
+
+# runs the per BX model for one second, returns the time it took and the results
+def runPerBx(prescale, seed, legacy):
+    de.applyConfig({"PRESCALE": prescale})
+    de.resetEmulator(legacy)
+    t1 = time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        de.runOneSecond(True, seed)
+    t2 = time()
+    results = [list(de.max_buf_usage)]
+    for stats in [de.total_buf_stats, de.input_rate_stats, de.output_rate_stats]:
+        results += [np.array([stats.count, stats.sum, stats.max]), stats.getHistogram()[0]] + list(stats.getBlocks())
+    return t2 - t1, results
+
+if __name__ == '__main__':
+    main()
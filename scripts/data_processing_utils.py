@@ -1,43 +1,65 @@
 import struct
 from utils import *
 import numpy as np
+import sys
 import time
 import os
+import io
+import bisect
 
 ##########################
 ######## unpacker ########
 ##########################
 
-class FedEvent:
+# shared empty error list and CFEB list, the unpacker objects only allocate their own lists when they actually have an error or CFEBs (see addUnpackError)
+NO_ERRORS = ()
+NO_CFEBS = np.zeros(0, dtype=np.int64)
 
-    l1Id = None
-    bxId = None
-    unpackErrors = None
+# appends an error to obj.unpackErrors, allocating the list on the first error
+def addUnpackError(obj, err):
+    if obj.unpackErrors is NO_ERRORS:
+        obj.unpackErrors = []
+    obj.unpackErrors.append(err)
 
-    def __init__(self, words):
+# all the unpacker classes use __slots__ to keep the per object memory small, since a file can easily yield millions of them
+class FedEvent(object):
+
+    __slots__ = ('words', 'dmbTable', 'dmbTableOffset', 'l1Id', 'bxId', 'header', 'unpackErrors', '_dmbs')
+
+    # dmbTable is an optional DMB table (see indexEvents()) of this event, where the DMB start offsets are relative to dmbTableOffset (e.g. a slice of the EventIndex DMB table, and the event start offset)
+    # if it's not provided, the DMB blocks are located here
+    def __init__(self, words, dmbTable = None, dmbTableOffset = 0):
         self.words = words
-        self.dmbs = []
-        self.unpackErrors = []
+        self.dmbTable = dmbTable
+        self.dmbTableOffset = dmbTableOffset
+        self.header = None # decoded DDU header and trailer fields (FED_HEADER_DTYPE record), filled in by unpackHeader and unpackTrailer
+        self.unpackErrors = NO_ERRORS
+        self._dmbs = None
         self.init()
 
-    # does the absolute minimum to get L1A ID, BX ID, and find DMB blocks and create DMB objects, without unpacking the DMB contents except for some minimal information like crate ID and DMB ID
+    # does the absolute minimum to get L1A ID, BX ID, and find DMB blocks, without unpacking the DMB contents except for some minimal information like crate ID and DMB ID
+    # DMB objects are only created when the dmbs list is accessed for the first time
     def init(self):
         self.l1Id = (int(self.words[0]) >> 32) & 0xffffff
         self.bxId = (int(self.words[0]) >> 20) & 0xfff
 
         if self.words.size < 6:
-            self.errors.append("FED block size is smaller than 6 words (size = %d words)" % self.words.size)
+            addUnpackError(self, "FED block size is smaller than 6 words (size = %d words)" % self.words.size)
 
-        dmbHeaders = np.where(self.words & 0xf000f000f000f000 == 0x9000900090009000)[0]
-        if dmbHeaders.size == 0:
-            return
-        for i in range(1, dmbHeaders.size):
-            self.dmbs.append(DmbEvent(self.words[dmbHeaders[i - 1]:dmbHeaders[i]]))
-        self.dmbs.append(DmbEvent(self.words[dmbHeaders[dmbHeaders.size - 1]:self.words.size - 3]))
+        if self.dmbTable is None:
+            self.dmbTable = locateDmbBlocks(self.words, np.array([self.words.size], dtype=np.int64))
+            self.dmbTableOffset = 0
 
-        for dmb in self.dmbs:
-            for err in dmb.unpackErrors:
-                self.unpackErrors.append("DMB error (crateId = %d, dmbId = %d): %s" % (dmb.crateId, dmb.dmbId, err))
+        for dmb in self.dmbTable[self.dmbTable['length'] < 4]:
+            addUnpackError(self, "DMB error (crateId = %d, dmbId = %d): DMB block size is smaller than 4 words (size = %d words)" % (dmb['crateId'], dmb['dmbId'], dmb['length']))
+
+    @property
+    def dmbs(self):
+        if self._dmbs is None:
+            self._dmbs = []
+            for start, length in zip(self.dmbTable['start'] - self.dmbTableOffset, self.dmbTable['length']):
+                self._dmbs.append(DmbEvent(self.words[start:start + length]))
+        return self._dmbs
 
     def unpackAll(self):
         self.unpackHeader()
@@ -45,38 +67,47 @@ class FedEvent:
         for dmb in self.dmbs:
             dmb.unpackAll()
             for err in dmb.unpackErrors:
-                self.unpackErrors.append("DMB error (crateId = %d, dmbId = %d): %s" % (dmb.crateId, dmb.dmbId, err))
+                addUnpackError(self, "DMB error (crateId = %d, dmbId = %d): %s" % (dmb.crateId, dmb.dmbId, err))
 
 
-    # TODO: implement unpacking of the FED header and trailer
+    # the header and trailer fields are decoded together by decodeFedHeaders, the same way as for a whole file
     def unpackHeader(self):
-        pass
+        if self.words.size < 6:
+            return
+        event = np.zeros(1, dtype=FED_EVENT_DTYPE)
+        event['end'] = self.words.size
+        self.header = decodeFedHeaders(self.words, event)[0]
 
     def unpackTrailer(self):
         pass
 
 
-class DmbEvent:
+class DmbEvent(object):
 
-    crateId = 0
-    dmbId = 0
-    l1Id = 0
-    bxId = 0
-    unpackErrors = None
+    __slots__ = ('words', 'crateId', 'dmbId', 'l1Id', 'bxId', 'unpackErrors', 'alcts', 'tmbs', 'cfebStarts', 'cfebL1Ids', '_cfebs')
 
     def __init__(self, words):
         self.words = words
-        self.cfebs = []
-        self.unpackErrors = []
+        self.crateId = 0
+        self.dmbId = 0
+        self.l1Id = 0
+        self.bxId = 0
+        self.unpackErrors = NO_ERRORS
+        self.alcts = ()
+        self.tmbs = ()
+        self.cfebStarts = NO_CFEBS # word offsets of the CFEB blocks
+        self.cfebL1Ids = NO_CFEBS  # 6 bit L1A IDs of the CFEB blocks
+        self._cfebs = None
         self.init()
 
     def init(self):
         if self.words.size < 4:
-            self.unpackErrors.append("DMB block size is smaller than 4 words (size = %d words)" % self.words.size)
+            addUnpackError(self, "DMB block size is smaller than 4 words (size = %d words)" % self.words.size)
         else:
             self.crateId = (int(self.words[1]) >> 20) & 0xff
             self.dmbId = (int(self.words[1]) >> 16) & 0xf
 
+    # unpacks the ALCT and TMB blocks, locates the CFEB blocks and gets their L1A IDs, but CfebEvent objects are only created when the cfebs list is accessed
     def unpackAll(self):
         if len(self.unpackErrors) > 0:
             return
@@ -86,23 +117,44 @@ class DmbEvent:
 
         cfebBlockIdx = 2
         trigHeaders = np.where(self.words & 0xf000f000f000f000 == 0xd000d000d000d000)[0]
-        #TODO: unpack the ALCT and TMB
+        self.unpackTrig(trigHeaders)
         if trigHeaders.size > 0:
             cfebBlockIdx = trigHeaders[trigHeaders.size - 1] + 1
 
-        cfebIdx = 1
-        while cfebBlockIdx + 25*8 <= self.words.size - 2:
-            cfeb = CfebEvent(self.words[cfebBlockIdx:cfebBlockIdx+25*8])
-            cfeb.unpackAll()
-            for err in cfeb.unpackErrors:
-                self.unpackErrors.append("CFEB #%d error: %s" % (cfebIdx, err))
-
-            self.cfebs.append(cfeb)
-            cfebIdx += 1
-            cfebBlockIdx += 25*8
+        numCfebs = max(self.words.size - 2 - cfebBlockIdx, 0) // CFEB_BLOCK_WORDS
+        self.cfebStarts = cfebBlockIdx + np.arange(numCfebs) * CFEB_BLOCK_WORDS
+        self.cfebL1Ids = (self.words[self.cfebStarts + 24] >> np.uint64(38)) & np.uint64(0x3f)
+        self._cfebs = None
 
+        cfebIdx = numCfebs + 1
+        cfebBlockIdx += numCfebs * CFEB_BLOCK_WORDS
         if cfebBlockIdx != self.words.size - 2:
-            self.unpackErrors.append("CFEB #%d block did not end in the correct place: CFEB block start word idx = %d, expected CFEB block end word idx = %d, first DMB trailer word idx = %d" % (cfebIdx, cfebBlockIdx, cfebBlockIdx+25*8, self.words.size - 2))
+            addUnpackError(self, "CFEB #%d block did not end in the correct place: CFEB block start word idx = %d, expected CFEB block end word idx = %d, first DMB trailer word idx = %d" % (cfebIdx, cfebBlockIdx, cfebBlockIdx+25*8, self.words.size - 2))
+
+    # uses the same ALCT/TMB block pairing as the batch checker (see unpackTrigBlocks), treating this DMB as a single entry DMB table
+    def unpackTrig(self, trigWords):
+        if trigWords.size == 0:
+            return
+        dmbTable = np.zeros(1, dtype=DMB_DTYPE)
+        dmbTable['length'] = self.words.size
+        alcts, tmbs = unpackTrigBlocks(self.words, dmbTable, trigWords)
+        self.alcts = [AlctEvent(self.words[start:end + 1]) for start, end in zip(alcts.blocks['header'], np.maximum(alcts.blocks['trailer'], alcts.blocks['header']))]
+        self.tmbs = [TmbEvent(self.words[start:end + 1]) for start, end in zip(tmbs.blocks['header'], np.maximum(tmbs.blocks['trailer'], tmbs.blocks['header']))]
+        for name, blocks in [["ALCT", self.alcts], ["TMB", self.tmbs]]:
+            for block in blocks:
+                block.unpackAll()
+                for err in block.unpackErrors:
+                    addUnpackError(self, "%s error: %s" % (name, err))
+
+    @property
+    def cfebs(self):
+        if self._cfebs is None:
+            self._cfebs = []
+            for start in self.cfebStarts:
+                cfeb = CfebEvent(self.words[start:start + CFEB_BLOCK_WORDS])
+                cfeb.unpackAll()
+                self._cfebs.append(cfeb)
+        return self._cfebs
 
     # TODO: implement unpacking of the DMB header and trailer
     def unpackHeader(self):
@@ -118,126 +170,590 @@ class DmbEvent:
     def printDmbInfo(self):
         print ("Crate %d DMB %d" % (self.crateId, self.dmbId))
 
-class AlctEvent:
+class AlctEvent(object):
+
+    __slots__ = ('words', 'bxId', 'l1Id', 'readoutCounter', 'hitWords', 'unpackErrors')
 
+    # words include the header and the trailer word (only the header word if the trailer is missing)
     def __init__(self, words):
         self.words = words
-        self.unpackErrors = []
+        self.bxId = 0
+        self.l1Id = 0
+        self.readoutCounter = 0
+        self.hitWords = None # 16bit words between the header and the trailer word
+        self.unpackErrors = NO_ERRORS
         self.init()
 
     def init(self):
-        pass
+        if self.words.size < 2 or int(self.words[-1]) & TRIG_MARKER_MASK != ALCT_TRAILER_MARKER:
+            addUnpackError(self, "ALCT header is not followed by an ALCT trailer")
 
-    # TODO: implement unpacking of the ALCT data
     def unpackAll(self):
-        pass
+        header = int(self.words[0])
+        self.bxId = (header >> 16) & 0xfff
+        self.l1Id = (header >> 32) & 0xfff
+        self.readoutCounter = (header >> 48) & 0xfff
+        self.hitWords = np.ascontiguousarray(self.words[1:-1]).view(np.dtype('<u2'))
 
-class TmbEvent:
+class TmbEvent(object):
 
+    __slots__ = ('words', 'bxId', 'l1Id', 'readoutCounter', 'hitWords', 'unpackErrors')
+
+    # words include the header and the trailer word (only the header word if the trailer is missing)
     def __init__(self, words):
         self.words = words
-        self.unpackErrors = []
+        self.bxId = 0
+        self.l1Id = 0
+        self.readoutCounter = 0
+        self.hitWords = None # 16bit words between the header and the trailer word
+        self.unpackErrors = NO_ERRORS
         self.init()
 
     def init(self):
-        pass
+        if self.words.size < 2 or int(self.words[-1]) & TRIG_MARKER_MASK != TMB_TRAILER_MARKER:
+            addUnpackError(self, "TMB header is not followed by a TMB trailer")
 
-    # TODO: implement unpacking of the TMB data
     def unpackAll(self):
-        pass
+        header = int(self.words[0])
+        self.bxId = (header >> 16) & 0xfff
+        self.l1Id = (header >> 32) & 0xfff
+        self.readoutCounter = (header >> 48) & 0xfff
+        self.hitWords = np.ascontiguousarray(self.words[1:-1]).view(np.dtype('<u2'))
 
-class CfebEvent:
+class CfebEvent(object):
 
-    l1Id = None
+    __slots__ = ('words', 'l1Id', 'unpackErrors', '_timeSamples')
 
     def __init__(self, words):
         self.words = words
-        self.unpackErrors = []
-        self.timeSamples = []
+        self.l1Id = None
+        self.unpackErrors = NO_ERRORS
+        self._timeSamples = None
         self.init()
 
     def init(self):
         if self.words.size < 25*8:
-            self.unpackErrors.append("CFEB block size is smaller than 25*8 words: %d" % self.words.size)
+            addUnpackError(self, "CFEB block size is smaller than 25*8 words: %d" % self.words.size)
 
-    # TODO: implement unpacking of the CFEB data
+    # the L1A ID is taken from the first time sample, time sample objects are only created when the timeSamples list is accessed
     def unpackAll(self):
         if len(self.unpackErrors) > 0:
             return
 
-        for i in range(0, 8):
-            timeSample = CfebTimeSample(self.words[i*25:(i+1)*25])
-            timeSample.unpackAll()
-            for err in timeSample.unpackErrors:
-                self.unpackErrors.append("Time sample #%d error: %s" % (i, err))
-            self.timeSamples.append(timeSample)
-            if self.l1Id is None:
-                self.l1Id = timeSample.l1Id
-            # elif self.l1Id != timeSample.l1Id:
-            #     self.unpackErrors.append("Time sample #%d has a different L1 ID than others: expected %d, but got %d" % (i, self.l1Id, timeSample.l1Id))
+        self.l1Id = (int(self.words[24]) >> 38) & 0x3f
 
+    @property
+    def timeSamples(self):
+        if self._timeSamples is None:
+            self._timeSamples = []
+            if len(self.unpackErrors) > 0:
+                return self._timeSamples
+            for i in range(0, 8):
+                timeSample = CfebTimeSample(self.words[i*25:(i+1)*25])
+                timeSample.unpackAll()
+                for err in timeSample.unpackErrors:
+                    addUnpackError(self, "Time sample #%d error: %s" % (i, err))
+                self._timeSamples.append(timeSample)
+                # if self.l1Id != timeSample.l1Id:
+                #     self.unpackErrors.append("Time sample #%d has a different L1 ID than others: expected %d, but got %d" % (i, self.l1Id, timeSample.l1Id))
+        return self._timeSamples
 
-class CfebTimeSample:
 
-    l1Id = 0
+class CfebTimeSample(object):
+
+    __slots__ = ('words', 'l1Id', 'crc', 'unpackErrors')
 
     def __init__(self, words):
         self.words = words
-        self.unpackErrors = []
+        self.l1Id = 0
+        self.crc = 0
+        self.unpackErrors = NO_ERRORS
         self.init()
 
     def init(self):
         pass
 
-    # TODO: implement full unpacking of the CFEB time sample
+    # only the trailer fields are unpacked here (see CfebSamples for the layout of the trailer word)
     def unpackAll(self):
         trail = int(self.words[self.words.size - 1])
         self.l1Id = (trail >> 38) & 0x3f
+        self.crc = (trail >> 16) & 0xffff
 
-def unpackFile(localDaqFilename, removeEmptyEvents = False, removeDmbs = []):
+    # 12 bit ADC values with shape (layer, strip), decoded from the words every time they're accessed (use unpackCfebSamples to decode many samples at once)
+    @property
+    def adc(self):
+        return CfebSamples(np.ascontiguousarray(self.words).view(np.dtype('<u2'))).adc
 
-    # read the whole file into a numpy array
-    print("Reading the file")
-    f = open(localDaqFilename, 'rb')
-    raw = np.fromfile(f, dtype=np.dtype('u8'))
-    f.close()
+    # the top 4 bits of each ADC word (see CFEB_FLAG_*), decoded from the words every time they're accessed
+    @property
+    def flags(self):
+        return CfebSamples(np.ascontiguousarray(self.words).view(np.dtype('<u2'))).flags
 
-    eoes = np.where(raw==0x8000ffff80008000)
+##########################
+###### event index #######
+##########################
 
-    print("Unpacking events")
-    events = []
-    start = 0
-    i = 0
-    for eoe in eoes[0]:
-        event = FedEvent(raw[start:eoe+3])
+EOE_MARKER = 0x8000ffff80008000
+FED_HEADER1_CODE = 0x50 # top byte of the FED header #1
+DMB_HEADER1_MASK = 0xf000f000f000f000
+DMB_HEADER1_CODE = 0x9000900090009000
+STREAM_BLOCK_WORDS = 16 * 1024 * 1024 # 128MB read buffer when streaming (the peak memory is a few times this, because of the index and check arrays of a chunk)
+
+FED_EVENT_DTYPE = np.dtype([('eventNum', np.int64),  # event number within the file
+                            ('start', np.int64),     # 64bit word offset of the first FED header word
+                            ('end', np.int64),       # 64bit word offset just past the last FED trailer word
+                            ('l1Id', np.uint32),
+                            ('bxId', np.uint16),
+                            ('dmbStart', np.int64),  # index of the first DMB of this event in the DMB table
+                            ('numDmbs', np.int32)])
+
+DMB_DTYPE = np.dtype([('eventIdx', np.int64),  # index of the event in the event table
+                      ('start', np.int64),     # 64bit word offset of the DMB header #1
+                      ('length', np.int64),    # DMB block length in 64bit words (including the DMB trailer)
+                      ('crateId', np.uint8),
+                      ('dmbId', np.uint8)])
+
+class EventIndex(object):
+
+    # raw is the u8 array of the data, events is a FED_EVENT_DTYPE structured array and dmbs is a DMB_DTYPE structured array, all offsets are relative to raw
+    # offset is the 64bit word offset of raw within the file
+    def __init__(self, raw, events, dmbs, offset = 0):
+        self.raw = raw
+        self.events = events
+        self.dmbs = dmbs
+        self.offset = offset
+
+    def __len__(self):
+        return self.events.size
+
+    # returns the DMB table of the given event with word offsets relative to the beginning of the event
+    def getEventDmbs(self, idx):
+        dmbStart = self.events['dmbStart'][idx]
+        dmbs = self.dmbs[dmbStart:dmbStart + self.events['numDmbs'][idx]].copy()
+        dmbs['start'] -= self.events['start'][idx]
+        return dmbs
+
+    # returns a FedEvent view of the given event (neither the event words nor the DMB table are copied)
+    def getEvent(self, idx):
+        start = self.events['start'][idx]
+        dmbStart = self.events['dmbStart'][idx]
+        return FedEvent(self.raw[start:self.events['end'][idx]], self.dmbs[dmbStart:dmbStart + self.events['numDmbs'][idx]], start)
+
+    def getEvents(self):
+        return [self.getEvent(i) for i in range(self.events.size)]
+
+    # returns a new index without the DMBs listed in removeDmbs (list of [crateId, dmbId]) and without the events that are left with no DMBs
+    def removeDmbs(self, removeDmbs):
+        dmbKeys = self.dmbs['crateId'].astype(np.int64) * 16 + self.dmbs['dmbId']
+        removeKeys = np.array([crateId * 16 + dmbId for crateId, dmbId in removeDmbs], dtype=np.int64)
+        dmbs = self.dmbs[~np.isin(dmbKeys, removeKeys)]
+
+        numDmbs = np.bincount(dmbs['eventIdx'], minlength=self.events.size)
+        keepEvents = numDmbs > 0
+        events = self.events[keepEvents]
+        events['numDmbs'] = numDmbs[keepEvents]
+        events['dmbStart'] = np.cumsum(events['numDmbs']) - events['numDmbs']
+        dmbs['eventIdx'] = (np.cumsum(keepEvents) - 1)[dmbs['eventIdx']]
+
+        return EventIndex(self.raw, events, dmbs, self.offset)
+
+# locates all DMB blocks in the given data, where eventEnds is an array of offsets just past the end of each event (events are assumed to be back to back, starting at offset 0)
+# returns a DMB_DTYPE structured array (sorted by event)
+def locateDmbBlocks(raw, eventEnds):
+    dmbHeaders = np.flatnonzero(raw[:eventEnds[-1] if eventEnds.size > 0 else 0] & np.uint64(DMB_HEADER1_MASK) == np.uint64(DMB_HEADER1_CODE))
+    dmbs = np.zeros(dmbHeaders.size, dtype=DMB_DTYPE)
+    if dmbHeaders.size == 0:
+        return dmbs
+
+    eventIdx = np.searchsorted(eventEnds, dmbHeaders, side='right')
+    # each DMB block ends at the next DMB header, except for the last one in the event, which ends where the FED trailer (3 words) begins
+    dmbEnds = np.empty_like(dmbHeaders)
+    dmbEnds[:-1] = dmbHeaders[1:]
+    lastInEvent = np.append(eventIdx[1:] != eventIdx[:-1], True)
+    dmbEnds[lastInEvent] = eventEnds[eventIdx[lastInEvent]] - 3
+
+    dmbs['eventIdx'] = eventIdx
+    dmbs['start'] = dmbHeaders
+    dmbs['length'] = np.maximum(dmbEnds - dmbHeaders, 0)
+
+    valid = dmbs['length'] >= 4
+    header2 = raw[dmbHeaders[valid] + 1]
+    dmbs['crateId'][valid] = (header2 >> np.uint64(20)) & np.uint64(0xff)
+    dmbs['dmbId'][valid] = (header2 >> np.uint64(16)) & np.uint64(0xf)
+
+    return dmbs
+
+# scans the whole u8 array once and returns an EventIndex with the FED event table and the flat DMB table
+# FED events are delimited by the 0x8000ffff80008000 trailer word (which is followed by two more trailer words), any data after the last complete event is ignored
+# eoes can optionally be provided if the positions of the 0x8000ffff80008000 words are already known
+def indexEvents(raw, eoes = None):
+    if eoes is None:
+        eoes = np.flatnonzero(raw == np.uint64(EOE_MARKER))
+    ends = np.minimum(eoes + 3, raw.size)
+
+    events = np.zeros(ends.size, dtype=FED_EVENT_DTYPE)
+    events['eventNum'] = np.arange(ends.size)
+    events['end'] = ends
+    events['start'][1:] = ends[:-1]
+    header1 = raw[events['start']]
+    events['l1Id'] = (header1 >> np.uint64(32)) & np.uint64(0xffffff)
+    events['bxId'] = (header1 >> np.uint64(20)) & np.uint64(0xfff)
+
+    dmbs = locateDmbBlocks(raw, ends)
+    events['numDmbs'] = np.bincount(dmbs['eventIdx'], minlength=ends.size)
+    events['dmbStart'] = np.cumsum(events['numDmbs']) - events['numDmbs']
+
+    return EventIndex(raw, events, dmbs)
+
+# CTP7 text dumps (see csc_daq.py) are also accepted, they're parsed into the same u8 layout (see readCtp7Dump)
+def indexFile(localDaqFilename):
+    if isCtp7Dump(localDaqFilename):
+        raw, eventBounds = readCtp7Dump(localDaqFilename)
+    else:
+        raw = np.fromfile(localDaqFilename, dtype=np.dtype('u8'))
+    return indexEvents(raw)
+
+# fills the buffer (of any word size) from the file starting at word offset filled, returns the new number of words in the buffer, and whether the end of the file was reached
+# (a partial word at the end of the file is dropped)
+def readWords(file, buf, filled):
+    bytesBuf = buf.view(np.uint8)
+    numBytes = filled * buf.itemsize
+    while numBytes < bytesBuf.size:
+        n = file.readinto(bytesBuf[numBytes:])
+        if not n:
+            return numBytes // buf.itemsize, True
+        numBytes += n
+    return numBytes // buf.itemsize, False
+
+# reads the file in chunks of chunkWords 64bit words into one reused buffer, and yields (pos, raw, eoes) for every chunk, where pos is the word offset of raw in the file,
+# and eoes are the EOE marker offsets in raw. raw only contains complete events, except the last chunk, which has everything up to the end of the file (like the whole file mode)
+# the incomplete event at the end of a chunk is moved to the front of the buffer and only the rest of the buffer is refilled, so every word is read and searched for EOE markers only once
+# the buffer is only grown if a single event doesn't fit in it, and raw gets overwritten by the next chunk, so it has to be copied if it's needed after that
+# CTP7 text dumps are parsed as a whole and yielded as a single chunk
+def readEventChunks(localDaqFilename, chunkWords = STREAM_BLOCK_WORDS):
+    if isCtp7Dump(localDaqFilename):
+        raw, eventBounds = readCtp7Dump(localDaqFilename)
+        if raw.size > 0:
+            yield 0, raw, np.flatnonzero(raw == np.uint64(EOE_MARKER))
+        return
+
+    buf = np.empty(chunkWords, dtype=np.dtype('u8'))
+    filled = 0 # number of words in the buffer
+    eoes = np.zeros(0, dtype=np.int64)
+    pos = 0
+    eof = False
+    with io.open(localDaqFilename, 'rb') as file:
+        while True:
+            scanned = filled
+            filled, eof = readWords(file, buf, filled)
+            eoes = np.concatenate((eoes, scanned + np.flatnonzero(buf[scanned:filled] == np.uint64(EOE_MARKER))))
+
+            if eof:
+                if filled > 0:
+                    yield pos, buf[:filled], eoes
+                return
+
+            complete = eoes[eoes + 3 <= filled]
+            # no complete event in the buffer, so make it bigger
+            if complete.size == 0:
+                bigBuf = np.empty(buf.size * 2, dtype=buf.dtype)
+                bigBuf[:filled] = buf[:filled]
+                buf = bigBuf
+                continue
+
+            end = complete[-1] + 3
+            yield pos, buf[:end], complete
+
+            buf[:filled - end] = buf[end:filled]
+            eoes = eoes[eoes >= end] - end
+            filled -= end
+            pos += end
+
+# reads the file one chunk at a time (blockWords 64bit words, or more if an event doesn't fit, see readEventChunks) and yields an EventIndex for all the complete events in each chunk
+# the indexes reference the read buffer directly, so an index (and the events taken from it) is only valid until the next one is requested
+# if mapped is set to True, the indexes reference a read only memory map of the file instead (the chunks are still only used to find the events), so they stay valid
+def streamEventIndexes(localDaqFilename, blockWords = STREAM_BLOCK_WORDS, mapped = False):
+    numEvents = 0
+    fileWords = None
+    for pos, raw, eoes in readEventChunks(localDaqFilename, blockWords):
+        if mapped:
+            if fileWords is None:
+                fileWords = np.memmap(localDaqFilename, dtype=np.dtype('u8'), mode='r')
+            raw = fileWords[pos:pos + raw.size]
+        index = indexEvents(raw, eoes)
+        index.events['eventNum'] += numEvents
+        index.offset = pos
+        numEvents += len(index)
+        yield index
+
+# generator version of unpackFile, which yields FedEvent views into the memory mapped file as it scans forward (see streamEventIndexes)
+# CTP7 text dumps are parsed as a whole, so the events are views into the parsed words instead
+def streamFile(localDaqFilename, removeEmptyEvents = False, removeDmbs = [], blockWords = STREAM_BLOCK_WORDS):
+    for index in streamEventIndexes(localDaqFilename, blockWords, mapped = not isCtp7Dump(localDaqFilename)):
         if removeEmptyEvents:
-            dmbsToRemove = []
-            for j in range(0, len(event.dmbs)):
-                if [event.dmbs[j].crateId, event.dmbs[j].dmbId] in removeDmbs:
-                    dmbsToRemove.append(j)
-            for j in reversed(dmbsToRemove):
-                del event.dmbs[j]
-            if len(event.dmbs) > 0:
-                events.append(event)
-        else:
-            events.append(event)
-        start = eoe + 3
-        i += 1
-        if (i % 1000 == 0):
-            print "%d events unpacked (out of %d)" % (i, eoes[0].size)
+            index = index.removeDmbs(removeDmbs)
+        for i in range(len(index)):
+            yield index.getEvent(i)
+
+# if stream is set to True, a generator of events is returned (see streamFile) instead of a list of all events in the file
+def unpackFile(localDaqFilename, removeEmptyEvents = False, removeDmbs = [], stream = False):
 
+    if stream:
+        return streamFile(localDaqFilename, removeEmptyEvents, removeDmbs)
 
-    # for i in range(0, 20):
-    #     print("=============== event %d, L1 ID %d ===============" % (i, events[i].l1Id))
-    #     for dmb in events[i].dmbs:
-    #         dmb.printDmbInfo()
+    # read the whole file into a numpy array
+    print("Reading the file")
+    index = indexFile(localDaqFilename)
+
+    print("Unpacking events")
+    if removeEmptyEvents:
+        index = index.removeDmbs(removeDmbs)
+    events = index.getEvents()
 
     print "=============== DONE ==============="
-    print "read %d bytes" % (raw.size * 8)
+    print "read %d bytes" % (index.raw.size * 8)
     print "unpacked %d events" % len(events)
 
     return events
 
+##########################
+#### CTP7 text dumps #####
+##########################
+
+# csc_daq.py writes the events read out to the CTP7 as text: a "=== Event N ===" line, then one "0x%016x" line per 64bit word, then a "=== Num words = N ===" line and a "=====" line
+CTP7_DUMP_MAGIC = b"========"
+CTP7_DUMP_EVENT_MARKER = b" Event"
+CTP7_DUMP_EVENT_MARKER_OFFSET = 24 # the event marker comes after this many '=' characters
+CTP7_DUMP_HEX_DIGITS = 16
+
+# byte values of all pairs of hex digit characters (read as a little endian 16bit word, so the first character is in the low byte), 0xffff if a character isn't a hex digit
+HEX_DIGIT_VALUES = np.full(256, 0xff, dtype=np.uint16)
+HEX_DIGIT_VALUES[np.frombuffer(b"0123456789abcdef", dtype=np.uint8)] = np.arange(16)
+HEX_DIGIT_VALUES[np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)] = np.arange(16)
+HEX_PAIR_VALUES = np.where((HEX_DIGIT_VALUES[np.arange(65536) & 0xff] == 0xff) | (HEX_DIGIT_VALUES[np.arange(65536) >> 8] == 0xff), 0xffff,
+                           (HEX_DIGIT_VALUES[np.arange(65536) & 0xff] << 4) | HEX_DIGIT_VALUES[np.arange(65536) >> 8]).astype(np.uint16)
+
+def isCtp7Dump(filename):
+    with io.open(filename, 'rb') as file:
+        return file.read(len(CTP7_DUMP_MAGIC)) == CTP7_DUMP_MAGIC
+
+# parses a whole CTP7 text dump with numpy (like cfedReadNextEvent does line by line, words before the first event line and between the end and the start of an event are ignored)
+# returns a u8 array with all the event words back to back, and the word offsets of the event boundaries (numEvents + 1 of them)
+# the dumped events are wrapped in the AMC13 header and trailer words (see daq.vhd), which are dropped unless keepAmc13Words is set, so by default the layout is the same as a local DAQ raw file
+def readCtp7Dump(filename, keepAmc13Words = False):
+    text = np.fromfile(filename, dtype=np.uint8)
+    if text.size == 0:
+        return np.zeros(0, dtype=np.dtype('u8')), np.zeros(1, dtype=np.int64)
+    newlines = np.flatnonzero(text == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [text.size]))
+    # drop the carriage returns
+    crs = (ends > starts) & (text[np.maximum(ends - 1, 0)] == ord('\r'))
+    ends[crs] -= 1
+    lineSizes = ends - starts
+
+    firstChars = np.zeros(starts.size, dtype=np.uint8)
+    firstChars[lineSizes > 0] = text[starts[lineSizes > 0]]
+    isSeparator = firstChars == ord('=')
+    isEventStart = isSeparator & (lineSizes >= CTP7_DUMP_EVENT_MARKER_OFFSET + len(CTP7_DUMP_EVENT_MARKER))
+    marker = np.frombuffer(CTP7_DUMP_EVENT_MARKER, dtype=np.uint8)
+    candidates = np.flatnonzero(isEventStart)
+    markerChars = text[starts[candidates, None] + CTP7_DUMP_EVENT_MARKER_OFFSET + np.arange(marker.size)]
+    isEventStart[candidates] = (markerChars == marker).all(axis=1)
+
+    # data lines belong to the event that was started by the last separator line before them (if that was an event start line)
+    lineIdxs = np.arange(starts.size)
+    lastSeparator = np.maximum.accumulate(np.where(isSeparator, lineIdxs, -1))
+    isData = ~isSeparator & (lineSizes > 0) & (lastSeparator >= 0)
+    isData[isData] = isEventStart[lastSeparator[isData]]
+    dataLines = np.flatnonzero(isData)
+
+    if (lineSizes[dataLines] != CTP7_DUMP_HEX_DIGITS + 2).any():
+        raise ValueError("Unexpected data line length in %s on line %d" % (filename, dataLines[np.flatnonzero(lineSizes[dataLines] != CTP7_DUMP_HEX_DIGITS + 2)[0]] + 1))
+    # overlapping view where row i holds the characters starting at offset i, so the digits of all data lines are taken with one row lookup, and converted to bytes two at a time
+    rows = np.lib.stride_tricks.as_strided(text, shape=(max(text.size - CTP7_DUMP_HEX_DIGITS + 1, 0), CTP7_DUMP_HEX_DIGITS), strides=(1, 1))
+    digits = rows[starts[dataLines] + 2]
+    values = HEX_PAIR_VALUES[digits.view(np.dtype('<u2'))]
+    if (values == 0xffff).any():
+        raise ValueError("Invalid hex digit in %s on line %d" % (filename, dataLines[np.flatnonzero((values == 0xffff).any(axis=1))[0]] + 1))
+    # the bytes of a line make a big endian 64bit word
+    raw = values.astype(np.uint8).view(np.dtype('>u8')).ravel().astype(np.dtype('u8'))
+
+    eventNums = np.cumsum(isEventStart) - 1
+    eventSizes = np.bincount(eventNums[dataLines], minlength=np.count_nonzero(isEventStart))
+    eventBounds = np.concatenate(([0], np.cumsum(eventSizes)))
+    if keepAmc13Words:
+        return raw, eventBounds
+    return stripAmc13Words(raw, eventBounds)
+
+# keeps only the FED event words of each event (from the FED header #1 up to the last FED trailer word), returns the new words and event boundaries
+# if an event has no FED header #1 it's kept from its start, and if it has no EOE marker after the header it's kept up to its end (e.g. when the spy FIFO chopped it off)
+def stripAmc13Words(raw, eventBounds):
+    eventStarts = eventBounds[:-1]
+    eventEnds = eventBounds[1:]
+    headers = np.flatnonzero((raw >> np.uint64(56)) == np.uint64(FED_HEADER1_CODE))
+    eoes = np.flatnonzero(raw == np.uint64(EOE_MARKER))
+
+    starts = eventStarts.copy()
+    if headers.size > 0:
+        firstHeaders = headers[np.minimum(np.searchsorted(headers, eventStarts), headers.size - 1)]
+        hasHeader = (firstHeaders >= eventStarts) & (firstHeaders < eventEnds)
+        starts[hasHeader] = firstHeaders[hasHeader]
+    ends = eventEnds.copy()
+    if eoes.size > 0:
+        trailerEnds = eoes[np.minimum(np.searchsorted(eoes, starts), eoes.size - 1)] + 3
+        hasTrailer = (trailerEnds - 3 >= starts) & (trailerEnds <= eventEnds)
+        ends[hasTrailer] = trailerEnds[hasTrailer]
+
+    # the kept ranges don't overlap, so the words inside of them are the ones where the running count of range starts minus range ends is positive
+    edges = np.zeros(raw.size + 1, dtype=np.int64)
+    np.add.at(edges, starts, 1)
+    np.add.at(edges, ends, -1)
+    keep = np.cumsum(edges[:-1]) > 0
+    return raw[keep], np.concatenate(([0], np.cumsum(ends - starts)))
+
+# writes the events of a CTP7 text dump to a binary file in the local DAQ raw layout, returns the number of events
+def convertCtp7Dump(textFilename, rawFilename):
+    raw, eventBounds = readCtp7Dump(textFilename)
+    raw.tofile(rawFilename)
+    return eventBounds.size - 1
+
+# maps a local DAQ raw file into memory as read only u8 words, CTP7 text dumps are parsed instead, so the word offsets are the same as the ones given by indexFile and readEventChunks
+def mapRawFile(filename):
+    if isCtp7Dump(filename):
+        raw, eventBounds = readCtp7Dump(filename)
+        return raw
+    return np.memmap(filename, dtype=np.dtype('u8'), mode='r')
+
+# opens a local DAQ raw file for binary reading, or returns an in memory binary file with the converted contents if it's a CTP7 text dump
+def openRawFile(filename):
+    if isCtp7Dump(filename):
+        raw, eventBounds = readCtp7Dump(filename)
+        return io.BytesIO(raw.tobytes())
+    return io.open(filename, 'rb')
+
+##########################
+##### sidecar index ######
+##########################
+
+SIDECAR_INDEX_VERSION = 1
+SIDECAR_INDEX_SUFFIX = ".idx.npz"
+
+SIDECAR_EVENT_DTYPE = np.dtype([('offset', np.int64),  # byte offset of the event in the raw file
+                                ('l1Id', np.uint32),
+                                ('bxId', np.uint16),
+                                ('numWords', np.int32),  # FED block size in 64bit words
+                                ('numDmbs', np.int32)])
+
+def buildSidecarIndex(localDaqFilename):
+    tables = []
+    for index in streamEventIndexes(localDaqFilename):
+        table = np.zeros(len(index), dtype=SIDECAR_EVENT_DTYPE)
+        table['offset'] = (index.events['start'] + index.offset) * 8
+        table['l1Id'] = index.events['l1Id']
+        table['bxId'] = index.events['bxId']
+        table['numWords'] = index.events['end'] - index.events['start']
+        table['numDmbs'] = index.events['numDmbs']
+        tables.append(table)
+
+    if len(tables) == 0:
+        return np.zeros(0, dtype=SIDECAR_EVENT_DTYPE)
+    return np.concatenate(tables)
+
+# returns the SIDECAR_EVENT_DTYPE event table of the given raw file, which is stored next to the raw file (<raw_file>.idx.npz) and rebuilt only if the raw file size or modification time changes
+def loadSidecarIndex(localDaqFilename):
+    idxFilename = localDaqFilename + SIDECAR_INDEX_SUFFIX
+    stat = os.stat(localDaqFilename)
+    meta = np.array([SIDECAR_INDEX_VERSION, stat.st_size, stat.st_mtime], dtype=np.float64)
+
+    if os.path.isfile(idxFilename):
+        try:
+            f = np.load(idxFilename)
+            try:
+                if np.array_equal(f['meta'], meta):
+                    return f['events']
+            finally:
+                f.close()
+        except (IOError, ValueError, KeyError):
+            pass
+
+    print("Building the event index of %s" % localDaqFilename)
+    events = buildSidecarIndex(localDaqFilename)
+    try:
+        # write to a temporary file first, so that an interrupted write doesn't leave a corrupted index behind
+        tmpFilename = idxFilename + ".tmp"
+        f = open(tmpFilename, 'wb')
+        np.savez(f, meta=meta, events=events)
+        f.close()
+        os.rename(tmpFilename, idxFilename)
+    except (IOError, OSError) as e:
+        printRed("Could not write the event index file %s: %s" % (idxFilename, e))
+
+    return events
+
+# L1A ID lookup in a sidecar event table (see loadSidecarIndex): the events are sorted by L1A ID once, so that finding the events of an L1A ID is a binary search
+class SidecarL1IdLookup(object):
+
+    def __init__(self, sidecarEvents):
+        self.events = sidecarEvents
+        self.ends = sidecarEvents['offset'] + sidecarEvents['numWords'].astype(np.int64) * 8
+        self.l1IdOrder = np.argsort(sidecarEvents['l1Id'], kind='mergesort')
+        self.sortedL1Ids = sidecarEvents['l1Id'][self.l1IdOrder]
+
+    # returns the index of the first event with the given L1A ID that ends after the given byte position, or -1 if there's none
+    def findL1Id(self, l1Id, pos = 0):
+        first = np.searchsorted(self.sortedL1Ids, l1Id, side='left')
+        last = np.searchsorted(self.sortedL1Ids, l1Id, side='right')
+        # the events of one L1A ID are in file order (stable sort), so their ends are increasing
+        matches = self.l1IdOrder[first:last]
+        i = np.searchsorted(self.ends[matches], pos, side='right')
+        if i == matches.size:
+            return -1
+        return matches[i]
+
+# returns the SidecarL1IdLookup of the sidecar event table of the given raw file (see loadSidecarIndex)
+def loadSidecarL1IdLookup(localDaqFilename):
+    return SidecarL1IdLookup(loadSidecarIndex(localDaqFilename))
+
+# seeks the file to the first event with the given L1A ID at or after the current file position using the sidecar L1A ID lookup (see loadSidecarL1IdLookup), or to the end of the file if there's no such event
+# returns True if the event was found
+def seekToL1Id(file, sidecarLookup, l1Id):
+    pos = file.tell()
+    idx = sidecarLookup.findL1Id(l1Id, pos)
+    if idx == -1:
+        file.seek(0, os.SEEK_END)
+        return False
+    file.seek(max(pos, sidecarLookup.events['offset'][idx]))
+    return True
+
+# random access to the events of all the parts of a local DAQ run (see getAllLocalDaqRawFiles), by global event number or by L1A ID
+class LocalDaqRunIndex(object):
+
+    def __init__(self, rawFilenamePattern, maxFiles = None):
+        self.files = getAllLocalDaqRawFiles(rawFilenamePattern, maxFiles)
+        tables = [loadSidecarIndex(fname) for fname in self.files]
+        self.events = np.concatenate(tables) if len(tables) > 0 else np.zeros(0, dtype=SIDECAR_EVENT_DTYPE)
+        self.fileIdx = np.repeat(np.arange(len(tables)), [table.size for table in tables])
+        self.l1IdOrder = np.argsort(self.events['l1Id'], kind='mergesort')
+        self.sortedL1Ids = self.events['l1Id'][self.l1IdOrder]
+
+    def __len__(self):
+        return self.events.size
+
+    # returns the global event numbers of all the events with the given L1A ID (in file order)
+    def findL1Id(self, l1Id):
+        first = np.searchsorted(self.sortedL1Ids, l1Id, side='left')
+        last = np.searchsorted(self.sortedL1Ids, l1Id, side='right')
+        return self.l1IdOrder[first:last]
+
+    # returns the words of the given global event number as a u8 array
+    def readEvent(self, eventNum):
+        f = open(self.files[self.fileIdx[eventNum]], 'rb')
+        f.seek(self.events['offset'][eventNum])
+        words = np.fromfile(f, dtype=np.dtype('u8'), count=self.events['numWords'][eventNum])
+        f.close()
+        return words
+
 def checkEventErrors(event):
     errors = []
     event.unpackAll()
@@ -247,11 +763,8 @@ def checkEventErrors(event):
         # check L1 ID consistency
         if dmb.l1Id != event.l1Id:
             errors.append("DMB (crate %d dmb %d) L1A ID doesn't match the FED L1A ID: FED = %d, DMB = %d" % (dmb.crateId, dmb.dmbId, event.l1Id, dmb.l1Id))
-        for cfebIdx in range(0, len(dmb.cfebs)):
-            cfeb = dmb.cfebs[cfebIdx]
-            if cfeb.l1Id != (dmb.l1Id & 0x3f):
-                # pass
-                errors.append("CFEB #%d (crate %d dmb %d) L1A ID doesn't match the DMB L1A ID: DMB = %d, CFEB = %d, CFEB expected = %d" % (cfebIdx, dmb.crateId, dmb.dmbId, dmb.l1Id, cfeb.l1Id, dmb.l1Id & 0x3f))
+        for cfebIdx in np.flatnonzero(dmb.cfebL1Ids != (dmb.l1Id & 0x3f)):
+            errors.append("CFEB #%d (crate %d dmb %d) L1A ID doesn't match the DMB L1A ID: DMB = %d, CFEB = %d, CFEB expected = %d" % (cfebIdx, dmb.crateId, dmb.dmbId, dmb.l1Id, dmb.cfebL1Ids[cfebIdx], dmb.l1Id & 0x3f))
         # check BX ID consistency
         # if dmb.bxId != event.bxId:
         #     errors.append("DMB (crate %d dmb %d) BX ID doesn't match the FED BX ID: FED = %d, DMB = %d" % (dmb.crateId, dmb.dmbId, event.bxId, dmb.bxId))
@@ -260,16 +773,653 @@ def checkEventErrors(event):
         if dmb.words[dmb.words.size - 2] & 0xf000f000f000f000 != 0xf000f000f000f000 or dmb.words[dmb.words.size - 1] & 0xf000f000f000f000 != 0xe000e000e000e000:
             errors.append("DMB (crate %d dmb %d) trailer words don't have the correct DDU codes, suspect that it's misaligned with 64bit boundaries: trailer1 = %s, trailer2 = %s" % (dmb.crateId, dmb.dmbId, hexPadded64(dmb.words[dmb.words.size - 2]), hexPadded64(dmb.words[dmb.words.size - 1])))
 
+        # check L1 ID consistency of ALCT and TMB (12 bits)
+        for name, blocks in [["ALCT", dmb.alcts], ["TMB", dmb.tmbs]]:
+            for block in blocks:
+                if block.l1Id != dmb.l1Id & 0xfff:
+                    errors.append("%s (crate %d dmb %d) L1A ID doesn't match the DMB L1A ID: DMB = %d, %s = %d, %s expected = %d" % (name, dmb.crateId, dmb.dmbId, dmb.l1Id, name, block.l1Id, name, dmb.l1Id & 0xfff))
 
-        # TODO: check L1 ID consistency of ALCT and TMB
+    # check the DDU trailer event length and CRC
+    if event.header is not None:
+        if event.header['eventLength'] != event.words.size:
+            errors.append("FED trailer event length doesn't match the FED block size: trailer = %d, FED block size = %d" % (event.header['eventLength'], event.words.size))
+        crc = DDU_CRC.compute(event.words[:-1])
+        if event.header['crc'] != crc:
+            errors.append("FED CRC mismatch: trailer CRC = %s, calculated CRC = %s" % (hexPadded(int(event.header['crc']), 2), hexPadded(int(crc), 2)))
 
-    # TODO: implement many other consistency checks, including perhaps also the CRC checking..
+    # TODO: implement many other consistency checks
 
     return errors
 
+##########################
+## DDU header / trailer ##
+##########################
+
+# DDU header 1: [63:56] 0x50, [55:32] L1A ID, [31:20] BX ID, [19:8] source (board) ID, [7:4] format version
+# DDU header 3: [63:48] live inputs, [47:32] status flags, [31:16] inputs with data, [15:8] error flags, [7:4] TTS state, [3:0] number of inputs with data
+# DDU trailer 2: [63:32] status flags, [30:16] inputs in error state, [14:0] inputs in warning state
+# DDU trailer 3: [63:60] 0xA, [59] DMB 64bit misalignment, [55:32] event length (64bit words, including the header and trailer), [31:16] CRC, [11:8] error flags, [7:4] TTS state
+FED_HEADER_DTYPE = np.dtype([('sourceId', np.uint16),
+                             ('formatVersion', np.uint8),
+                             ('liveInputs', np.uint16),
+                             ('headerStatus', np.uint16),
+                             ('davInputs', np.uint16),
+                             ('headerErrors', np.uint8),
+                             ('headerTts', np.uint8),
+                             ('numDavs', np.uint8),
+                             ('trailerStatus', np.uint32),
+                             ('errorInputs', np.uint16),
+                             ('warningInputs', np.uint16),
+                             ('dmbMisaligned', np.bool_),
+                             ('eventLength', np.uint32),
+                             ('crc', np.uint16),
+                             ('trailerErrors', np.uint8),
+                             ('ttsState', np.uint8)])
+
+# returns a bit field of the given words: (words >> shift) & mask
+def bitField(words, shift, mask):
+    return (words >> np.uint64(shift)) & np.uint64(mask)
+
+# decodes the DDU header and trailer words of all the events in the events table (needs the 'start' and 'end' columns, see FED_EVENT_DTYPE)
+# returns a FED_HEADER_DTYPE table, events smaller than 6 words are left zeroed
+def decodeFedHeaders(raw, events):
+    headers = np.zeros(events.size, dtype=FED_HEADER_DTYPE)
+    valid = events['end'] - events['start'] >= 6
+    h1 = raw[events['start'][valid]]
+    h3 = raw[events['start'][valid] + 2]
+    t2 = raw[events['end'][valid] - 2]
+    t3 = raw[events['end'][valid] - 1]
+
+    for field, words, shift, mask in [['sourceId', h1, 8, 0xfff], ['formatVersion', h1, 4, 0xf],
+                                      ['liveInputs', h3, 48, 0xffff], ['headerStatus', h3, 32, 0xffff], ['davInputs', h3, 16, 0xffff], ['headerErrors', h3, 8, 0xff], ['headerTts', h3, 4, 0xf], ['numDavs', h3, 0, 0xf],
+                                      ['trailerStatus', t2, 32, 0xffffffff], ['errorInputs', t2, 16, 0x7fff], ['warningInputs', t2, 0, 0x7fff],
+                                      ['dmbMisaligned', t3, 59, 0x1], ['eventLength', t3, 32, 0xffffff], ['crc', t3, 16, 0xffff], ['trailerErrors', t3, 8, 0xf], ['ttsState', t3, 4, 0xf]]:
+        headers[field][valid] = bitField(words, shift, mask)
+
+    return headers
+
+##########################
+######### CRC16 ##########
+##########################
+
+# table driven CRC16 engine, which processes whole words at a time and can compute the CRCs of many word ranges (e.g. all events in a file) at once
+# the parameters follow the firmware CRC modules in common/hdl/utils:
+#   crc16_usb: poly = 0x8005, MSB first, 64bit words, init = 0xffff (this one is used for the DDU trailer CRC)
+#   crc16_ccitt: poly = 0x1021, MSB first, init = 0xffff
+#   crc16: poly = 0x8408 (reversed 0x1021), LSB first (reflected), init = 0xffff
+# since the CRC is linear, the register update for one word is split into a part that only depends on the word (looked up in one 64k entry table per 16bit word)
+# and a part that only depends on the previous register value (also a 64k entry table), and tables of the 2^k powers of the latter are used to skip the register over many zero words at once
+# word ranges are processed in blocks of BLOCK_WORDS words: all blocks are stepped through in parallel, and the block CRCs are then shifted into place and combined per range
+class Crc16(object):
+
+    BLOCK_WORDS = 64
+    BATCH_WORDS = 1024*1024 # max number of words processed at once in computeRanges (limits the temporary memory)
+
+    # wordBits must be a multiple of 16
+    def __init__(self, poly, init = 0xffff, reflected = False, wordBits = 64):
+        self.poly = poly
+        self.init = init
+        self.reflected = reflected
+        self.wordBits = wordBits
+
+        # contribution of each data bit (with a zero register), and the register update of each register bit (with zero data)
+        dataCols = [self.serialUpdate(0, 1 << i) for i in range(wordBits)]
+        regCols = [self.serialUpdate(1 << i, 0) for i in range(16)]
+
+        self.dataTables = [self.table16(dataCols[i:i + 16]) for i in range(0, wordBits, 16)]
+        self.regTables = [self.table16(regCols)] # register update applied 2^k times
+        for k in range(1, 32):
+            self.regTables.append(self.regTables[-1][self.regTables[-1]])
+
+    # bit serial reference implementation, returns the register value after processing one word
+    def serialUpdate(self, crc, word):
+        for i in range(self.wordBits):
+            if self.reflected:
+                bit = (word >> i) & 1
+                feedback = (crc & 1) ^ bit
+                crc >>= 1
+            else:
+                bit = (word >> (self.wordBits - 1 - i)) & 1
+                feedback = ((crc >> 15) & 1) ^ bit
+                crc = (crc << 1) & 0xffff
+            if feedback:
+                crc ^= self.poly
+        return crc
+
+    # 64k entry table of the xor of the given 16 columns, selected by the bits of the table index
+    def table16(self, cols):
+        table = np.zeros(65536, dtype=np.uint16)
+        values = np.arange(65536)
+        for bit in range(16):
+            table[(values >> bit) & 1 == 1] ^= cols[bit]
+        return table
+
+    # applies the register update (with zero data) n[i] times to crcs[i]
+    def applyRegN(self, crcs, n):
+        k = 0
+        while (n >> k).any():
+            crcs = np.where((n >> k) & 1 == 1, self.regTables[k][crcs], crcs)
+            k += 1
+        return crcs
+
+    # contribution of each word to the register, as if it was processed with a zero register
+    def wordCrcs(self, words):
+        crcs = np.zeros(words.shape, dtype=np.uint16)
+        for i in range(len(self.dataTables)):
+            crcs ^= self.dataTables[i][(words >> np.uint64(i * 16)) & np.uint64(0xffff)]
+        return crcs
+
+    # returns the CRCs of the word ranges raw[starts[i]:ends[i]]
+    def computeRanges(self, raw, starts, ends):
+        blockWords = self.BLOCK_WORDS
+        starts = np.asarray(starts, dtype=np.int64)
+        lengths = np.maximum(np.asarray(ends, dtype=np.int64) - starts, 0)
+        crcs = self.applyRegN(np.full(starts.size, self.init, dtype=np.uint16), lengths)
+
+        # ranges are padded with zero words at the front to a whole number of blocks (leading zero words don't change a zero register)
+        numBlocks = (lengths + blockWords - 1) // blockWords
+        blockStarts = starts + lengths - numBlocks * blockWords
+
+        # split the ranges into batches of roughly BATCH_WORDS words (always at least one range per batch)
+        blockEnds = np.cumsum(numBlocks)
+        bounds = np.searchsorted(blockEnds, np.arange(1, blockEnds[-1] * blockWords // self.BATCH_WORDS + 1) * (self.BATCH_WORDS // blockWords)) if starts.size > 0 else []
+        bounds = np.unique(np.concatenate(([0], np.asarray(bounds, dtype=np.int64) + 1, [starts.size])))
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            batchBlocks = numBlocks[first:last]
+            nonEmpty = np.flatnonzero(batchBlocks > 0)
+            if nonEmpty.size == 0:
+                continue
+            blockRange = np.repeat(np.arange(first, last), batchBlocks)
+            blockNum = np.arange(blockRange.size) - np.repeat(np.cumsum(batchBlocks) - batchBlocks, batchBlocks)
+            wordIdx = (blockStarts[blockRange] + blockNum * blockWords)[:, np.newaxis] + np.arange(blockWords)
+            valid = wordIdx >= starts[blockRange][:, np.newaxis]
+            wordCrcs = np.where(valid, self.wordCrcs(raw[np.where(valid, wordIdx, 0)]), 0).astype(np.uint16).T.copy()
+
+            blockCrcs = np.zeros(blockRange.size, dtype=np.uint16)
+            for i in range(blockWords):
+                blockCrcs = self.regTables[0][blockCrcs] ^ wordCrcs[i]
+
+            # each block CRC goes through the register update once for every word in the blocks that follow it in its range
+            blockCrcs = self.applyRegN(blockCrcs, (batchBlocks[blockRange - first] - 1 - blockNum) * blockWords)
+            crcs[first + nonEmpty] ^= np.bitwise_xor.reduceat(blockCrcs, (np.cumsum(batchBlocks) - batchBlocks)[nonEmpty])
+
+        return crcs
+
+    def compute(self, words):
+        return int(self.computeRanges(words, [0], [words.size])[0])
+
+CRC16_USB = Crc16(0x8005)
+DDU_CRC = CRC16_USB
+
+# returns the calculated DDU CRCs of all events in the events table (see FED_EVENT_DTYPE), zero for events smaller than 6 words
+# the firmware calculates the CRC over all the event words from the DDU header 1 up to (and including) the DDU trailer 2
+def computeFedCrcs(raw, events):
+    valid = events['end'] - events['start'] >= 6
+    return np.where(valid, DDU_CRC.computeRanges(raw, events['start'], np.where(valid, events['end'] - 1, events['start'])), 0).astype(np.uint16)
+
+##########################
+### ALCT / TMB decoder ###
+##########################
+
+# ALCT and TMB blocks start with a header word, where the lowest 16bit word is 0xDB0A (ALCT) or 0xDB0C (TMB) and end with a trailer word, where the lowest 16bit word is 0xDE0D (ALCT) or 0xDE0F (TMB)
+# the other 16bit words of these words carry the 0xD DDU code on top, and 12 bits of data: header = [BX ID, L1A ID, readout counter], trailer = [CRC low, CRC high, word count]
+# the words in between the header and the trailer word are the remaining header words and the wire group (ALCT) or CLCT (TMB) hit words
+TRIG_MARKER_MASK = 0xffff
+ALCT_HEADER_MARKER = 0xdb0a
+ALCT_TRAILER_MARKER = 0xde0d
+TMB_HEADER_MARKER = 0xdb0c
+TMB_TRAILER_MARKER = 0xde0f
+
+TRIG_BLOCK_DTYPE = np.dtype([('dmbIdx', np.int64),         # index of the DMB in the DMB table
+                             ('header', np.int64),         # 64bit word offset of the header word
+                             ('trailer', np.int64),        # 64bit word offset of the trailer word, or -1 if it's missing
+                             ('bxId', np.uint16),
+                             ('l1Id', np.uint16),          # 12 bit L1A ID
+                             ('readoutCounter', np.uint16),
+                             ('trailerWord', np.uint64),
+                             ('hitWordsStart', np.int64),  # offset of the first hit word of this block in the hitWords array
+                             ('numHitWords', np.int64)])   # number of 16bit hit words
+
+class TrigBlocks(object):
+
+    def __init__(self, blocks, hitWords):
+        self.blocks = blocks     # TRIG_BLOCK_DTYPE table
+        self.hitWords = hitWords # 16bit words between the header and trailer of all blocks, concatenated
+
+    def getHitWords(self, idx):
+        return self.hitWords[self.blocks['hitWordsStart'][idx]:self.blocks['hitWordsStart'][idx] + self.blocks['numHitWords'][idx]]
+
+# pairs each header with the first trailer that follows it within the same DMB (and before the next header), and decodes the header and trailer words
+def decodeTrigBlocks(raw, dmbs, headers, trailers):
+    dmbIdx = np.searchsorted(dmbs['start'], headers, side='right') - 1
+    inDmb = dmbIdx >= 0
+    inDmb[inDmb] = headers[inDmb] < dmbs['start'][dmbIdx[inDmb]] + dmbs['length'][dmbIdx[inDmb]]
+    headers = headers[inDmb]
+    dmbIdx = dmbIdx[inDmb]
+
+    blocks = np.zeros(headers.size, dtype=TRIG_BLOCK_DTYPE)
+    blocks['dmbIdx'] = dmbIdx
+    blocks['header'] = headers
+
+    nextTrailer = np.searchsorted(trailers, headers, side='right')
+    hasTrailer = nextTrailer < trailers.size
+    trailerIdx = np.where(hasTrailer, trailers[np.minimum(nextTrailer, trailers.size - 1)] if trailers.size > 0 else -1, -1)
+    nextHeader = np.append(headers[1:], np.iinfo(np.int64).max)
+    hasTrailer &= (trailerIdx < dmbs['start'][dmbIdx] + dmbs['length'][dmbIdx]) & (trailerIdx < nextHeader)
+    blocks['trailer'] = np.where(hasTrailer, trailerIdx, -1)
+
+    headerWords = raw[headers]
+    blocks['bxId'] = (headerWords >> np.uint64(16)) & np.uint64(0xfff)
+    blocks['l1Id'] = (headerWords >> np.uint64(32)) & np.uint64(0xfff)
+    blocks['readoutCounter'] = (headerWords >> np.uint64(48)) & np.uint64(0xfff)
+    blocks['trailerWord'][hasTrailer] = raw[blocks['trailer'][hasTrailer]]
+
+    numWords = np.where(hasTrailer, blocks['trailer'] - headers - 1, 0)
+    blocks['numHitWords'] = numWords * 4
+    blocks['hitWordsStart'] = np.cumsum(blocks['numHitWords']) - blocks['numHitWords']
+    wordIdx = np.repeat(headers + 1 - (np.cumsum(numWords) - numWords), numWords) + np.arange(numWords.sum())
+    hitWords = np.ascontiguousarray(raw[wordIdx]).view(np.dtype('<u2'))
+
+    return TrigBlocks(blocks, hitWords)
+
+# locates and decodes all the ALCT and TMB blocks of the DMBs in the given DMB table in one pass, returns TrigBlocks for ALCTs and TMBs
+# trigWords can optionally be provided if the ALCT/TMB words are already located (see locateTrigWords)
+def unpackTrigBlocks(raw, dmbs, trigWords = None):
+    if trigWords is None:
+        trigWords = locateTrigWords(raw, dmbs)
+    markers = raw[trigWords] & np.uint64(TRIG_MARKER_MASK)
+    alcts = decodeTrigBlocks(raw, dmbs, trigWords[markers == ALCT_HEADER_MARKER], trigWords[markers == ALCT_TRAILER_MARKER])
+    tmbs = decodeTrigBlocks(raw, dmbs, trigWords[markers == TMB_HEADER_MARKER], trigWords[markers == TMB_TRAILER_MARKER])
+    return alcts, tmbs
+
+##########################
+##### batch checker ######
+##########################
+
+CFEB_BLOCK_WORDS = 25 * 8
+TRIG_WORD_CODE = 0xd000d000d000d000
+DMB_TRAILER1_CODE = 0xf000f000f000f000
+DMB_TRAILER2_CODE = 0xe000e000e000e000
+
+# error codes (bit flags) used by checkEvents
+CHECK_ERR_FED_SIZE = 0x01
+CHECK_ERR_DMB_SIZE = 0x02
+CHECK_ERR_CFEB_ALIGNMENT = 0x04
+CHECK_ERR_DMB_L1A = 0x08
+CHECK_ERR_CFEB_L1A = 0x10
+CHECK_ERR_DMB_TRAILER = 0x20
+CHECK_ERR_ALCT_TRAILER = 0x40
+CHECK_ERR_TMB_TRAILER = 0x80
+CHECK_ERR_ALCT_L1A = 0x100
+CHECK_ERR_TMB_L1A = 0x200
+CHECK_ERR_FED_LENGTH = 0x400
+CHECK_ERR_FED_CRC = 0x800
+
+CFEB_DTYPE = np.dtype([('dmbIdx', np.int64),  # index of the DMB in the DMB table
+                       ('start', np.int64),   # 64bit word offset of the CFEB block
+                       ('l1Id', np.uint8)])   # 6 bit L1A ID taken from the first time sample trailer
+
+# returns the offsets of all ALCT/TMB words (all four 16bit words having the 0xD DDU code) within the DMB blocks of the given DMB table
+def locateTrigWords(raw, dmbs):
+    end = (dmbs['start'] + dmbs['length']).max() if dmbs.size > 0 else 0
+    return np.flatnonzero(raw[:end] & np.uint64(DMB_HEADER1_MASK) == np.uint64(TRIG_WORD_CODE))
+
+# locates the CFEB blocks of all DMBs in the DMB table: they start right after the last ALCT/TMB word (or after the DMB header if there's no ALCT/TMB) and are 25*8 words long
+# returns the CFEB_DTYPE table and an array of CFEB block end offsets per DMB (where the DMB trailer is expected)
+def locateCfebBlocks(raw, dmbs, trigWords = None):
+    dmbEnds = dmbs['start'] + dmbs['length']
+    validDmbs = dmbs['length'] >= 4
+    if trigWords is None:
+        trigWords = locateTrigWords(raw, dmbs)
+    lastTrigWord = np.searchsorted(trigWords, dmbEnds, side='left') - 1
+    hasTrigWords = lastTrigWord >= 0
+    hasTrigWords[hasTrigWords] = trigWords[lastTrigWord[hasTrigWords]] >= dmbs['start'][hasTrigWords]
+    cfebStarts = np.where(hasTrigWords, trigWords[np.maximum(lastTrigWord, 0)] + 1 if trigWords.size > 0 else 0, dmbs['start'] + 2)
+
+    numCfebs = np.maximum(dmbEnds - 2 - cfebStarts, 0) // CFEB_BLOCK_WORDS
+    numCfebs[~validDmbs] = 0
+    cfebEnds = cfebStarts + numCfebs * CFEB_BLOCK_WORDS
+
+    cfebs = np.zeros(numCfebs.sum(), dtype=CFEB_DTYPE)
+    cfebs['dmbIdx'] = np.repeat(np.arange(dmbs.size), numCfebs)
+    cfebNum = np.arange(cfebs.size) - np.repeat(np.cumsum(numCfebs) - numCfebs, numCfebs)
+    cfebs['start'] = cfebStarts[cfebs['dmbIdx']] + cfebNum * CFEB_BLOCK_WORDS
+    cfebs['l1Id'] = (raw[cfebs['start'] + 24] >> np.uint64(38)) & np.uint64(0x3f)
+
+    return cfebs, cfebEnds
+
+class EventCheckResult(object):
+
+    def __init__(self, index, eventErrors, dmbErrors, dmbL1Ids, cfebs, cfebEnds, cfebErrors, alcts, tmbs, fedHeaders, fedCrcs):
+        self.index = index
+        self.eventErrors = eventErrors  # error code bit flags per event (includes all the DMB errors of the event)
+        self.dmbErrors = dmbErrors      # error code bit flags per DMB
+        self.dmbL1Ids = dmbL1Ids
+        self.cfebs = cfebs
+        self.cfebEnds = cfebEnds
+        self.cfebErrors = cfebErrors    # boolean mask of CFEBs with L1A ID mismatch
+        self.alcts = alcts              # TrigBlocks of the ALCTs
+        self.tmbs = tmbs                # TrigBlocks of the TMBs
+        self.fedHeaders = fedHeaders    # FED_HEADER_DTYPE table
+        self.fedCrcs = fedCrcs          # calculated DDU CRC per event
+
+    # returns the indexes of events that have errors
+    def getErrorEvents(self):
+        return np.flatnonzero(self.eventErrors != 0)
+
+    # returns the list of error strings for the given event (same wording as checkEventErrors)
+    def formatEventErrors(self, idx):
+        errors = []
+        raw = self.index.raw
+        evt = self.index.events[idx]
+        dmbIdxs = range(evt['dmbStart'], evt['dmbStart'] + evt['numDmbs'])
+
+        if self.eventErrors[idx] & CHECK_ERR_FED_SIZE:
+            errors.append("FED block size is smaller than 6 words (size = %d words)" % (evt['end'] - evt['start']))
+
+        for i in dmbIdxs:
+            dmb = self.index.dmbs[i]
+            if self.dmbErrors[i] & CHECK_ERR_DMB_SIZE:
+                errors.append("DMB error (crateId = %d, dmbId = %d): DMB block size is smaller than 4 words (size = %d words)" % (dmb['crateId'], dmb['dmbId'], dmb['length']))
+            for name, blocks, errCode, trailerMsg in [["ALCT", self.alcts, CHECK_ERR_ALCT_TRAILER, "an ALCT"], ["TMB", self.tmbs, CHECK_ERR_TMB_TRAILER, "a TMB"]]:
+                if self.dmbErrors[i] & errCode:
+                    for block in blocks.blocks[(blocks.blocks['dmbIdx'] == i) & (blocks.blocks['trailer'] < 0)]:
+                        errors.append("DMB error (crateId = %d, dmbId = %d): %s error: %s header is not followed by %s trailer" % (dmb['crateId'], dmb['dmbId'], name, name, trailerMsg))
+            if self.dmbErrors[i] & CHECK_ERR_CFEB_ALIGNMENT:
+                numCfebs = np.count_nonzero(self.cfebs['dmbIdx'] == i)
+                cfebBlockIdx = self.cfebEnds[i] - dmb['start']
+                errors.append("DMB error (crateId = %d, dmbId = %d): CFEB #%d block did not end in the correct place: CFEB block start word idx = %d, expected CFEB block end word idx = %d, first DMB trailer word idx = %d" % (dmb['crateId'], dmb['dmbId'], numCfebs + 1, cfebBlockIdx, cfebBlockIdx + CFEB_BLOCK_WORDS, dmb['length'] - 2))
+
+        for i in dmbIdxs:
+            dmb = self.index.dmbs[i]
+            if self.dmbErrors[i] & CHECK_ERR_DMB_L1A:
+                errors.append("DMB (crate %d dmb %d) L1A ID doesn't match the FED L1A ID: FED = %d, DMB = %d" % (dmb['crateId'], dmb['dmbId'], evt['l1Id'], self.dmbL1Ids[i]))
+            if self.dmbErrors[i] & CHECK_ERR_CFEB_L1A:
+                dmbCfebs = np.flatnonzero(self.cfebs['dmbIdx'] == i)
+                for cfebIdx in np.flatnonzero(self.cfebErrors[dmbCfebs]):
+                    errors.append("CFEB #%d (crate %d dmb %d) L1A ID doesn't match the DMB L1A ID: DMB = %d, CFEB = %d, CFEB expected = %d" % (cfebIdx, dmb['crateId'], dmb['dmbId'], self.dmbL1Ids[i], self.cfebs['l1Id'][dmbCfebs[cfebIdx]], self.dmbL1Ids[i] & 0x3f))
+            if self.dmbErrors[i] & CHECK_ERR_DMB_TRAILER:
+                trailerIdx = dmb['start'] + dmb['length'] - 2
+                errors.append("DMB (crate %d dmb %d) trailer words don't have the correct DDU codes, suspect that it's misaligned with 64bit boundaries: trailer1 = %s, trailer2 = %s" % (dmb['crateId'], dmb['dmbId'], hexPadded64(int(raw[trailerIdx])), hexPadded64(int(raw[trailerIdx + 1]))))
+            for name, blocks, errCode in [["ALCT", self.alcts, CHECK_ERR_ALCT_L1A], ["TMB", self.tmbs, CHECK_ERR_TMB_L1A]]:
+                if self.dmbErrors[i] & errCode:
+                    for block in blocks.blocks[blocks.blocks['dmbIdx'] == i]:
+                        if block['l1Id'] != self.dmbL1Ids[i] & 0xfff:
+                            errors.append("%s (crate %d dmb %d) L1A ID doesn't match the DMB L1A ID: DMB = %d, %s = %d, %s expected = %d" % (name, dmb['crateId'], dmb['dmbId'], self.dmbL1Ids[i], name, block['l1Id'], name, self.dmbL1Ids[i] & 0xfff))
+
+        if self.eventErrors[idx] & CHECK_ERR_FED_LENGTH:
+            errors.append("FED trailer event length doesn't match the FED block size: trailer = %d, FED block size = %d" % (self.fedHeaders['eventLength'][idx], evt['end'] - evt['start']))
+        if self.eventErrors[idx] & CHECK_ERR_FED_CRC:
+            errors.append("FED CRC mismatch: trailer CRC = %s, calculated CRC = %s" % (hexPadded(int(self.fedHeaders['crc'][idx]), 2), hexPadded(int(self.fedCrcs[idx]), 2)))
+
+        return errors
+
+# vectorized version of checkEventErrors, which checks all events of an EventIndex at once and returns an EventCheckResult
+# checks: FED and DMB block size sanity, CFEB block alignment, DMB vs FED L1A ID, CFEB vs DMB L1A ID (6 bits), the DMB trailer DDU codes, ALCT/TMB trailers, ALCT/TMB vs DMB L1A ID (12 bits),
+# and the DDU trailer event length and CRC (the CRC check can be turned off with checkCrc = False, since it's the most expensive one)
+# DMBs that are smaller than 4 words are only reported as such (no other checks are done on them)
+def checkEvents(index, checkCrc = True):
+    raw = index.raw
+    events = index.events
+    dmbs = index.dmbs
+
+    eventErrors = np.zeros(events.size, dtype=np.uint32)
+    eventErrors[events['end'] - events['start'] < 6] |= CHECK_ERR_FED_SIZE
+
+    dmbErrors = np.zeros(dmbs.size, dtype=np.uint32)
+    validDmbs = dmbs['length'] >= 4
+    dmbErrors[~validDmbs] |= CHECK_ERR_DMB_SIZE
+
+    trigWords = locateTrigWords(raw, dmbs)
+    cfebs, cfebEnds = locateCfebBlocks(raw, dmbs, trigWords)
+    alcts, tmbs = unpackTrigBlocks(raw, dmbs, trigWords)
+    dmbEnds = dmbs['start'] + dmbs['length']
+    dmbErrors[validDmbs & (cfebEnds != dmbEnds - 2)] |= CHECK_ERR_CFEB_ALIGNMENT
+
+    header1 = raw[dmbs['start']]
+    dmbL1Ids = (((header1 & np.uint64(0xfff0000)) >> np.uint64(4)) + (header1 & np.uint64(0xfff))).astype(np.uint32)
+    dmbErrors[validDmbs & (dmbL1Ids != events['l1Id'][dmbs['eventIdx']])] |= CHECK_ERR_DMB_L1A
+
+    cfebErrors = cfebs['l1Id'] != (dmbL1Ids[cfebs['dmbIdx']] & 0x3f)
+    dmbErrors[np.unique(cfebs['dmbIdx'][cfebErrors])] |= CHECK_ERR_CFEB_L1A
+
+    trailerIdx = np.maximum(dmbEnds - 2, 0)
+    badTrailer = ((raw[trailerIdx] & np.uint64(DMB_HEADER1_MASK)) != np.uint64(DMB_TRAILER1_CODE)) | ((raw[trailerIdx + 1] & np.uint64(DMB_HEADER1_MASK)) != np.uint64(DMB_TRAILER2_CODE))
+    dmbErrors[validDmbs & badTrailer] |= CHECK_ERR_DMB_TRAILER
+
+    for blocks, trailerErrCode, l1aErrCode in [[alcts, CHECK_ERR_ALCT_TRAILER, CHECK_ERR_ALCT_L1A], [tmbs, CHECK_ERR_TMB_TRAILER, CHECK_ERR_TMB_L1A]]:
+        blockDmbs = blocks.blocks['dmbIdx']
+        blockErrors = np.zeros(dmbs.size, dtype=np.uint32)
+        blockErrors[blockDmbs[blocks.blocks['trailer'] < 0]] |= trailerErrCode
+        blockErrors[blockDmbs[blocks.blocks['l1Id'] != (dmbL1Ids[blockDmbs] & 0xfff)]] |= l1aErrCode
+        dmbErrors[validDmbs] |= blockErrors[validDmbs]
+
+    np.bitwise_or.at(eventErrors, dmbs['eventIdx'], dmbErrors)
+
+    validEvents = events['end'] - events['start'] >= 6
+    fedHeaders = decodeFedHeaders(raw, events)
+    eventErrors[validEvents & (fedHeaders['eventLength'] != events['end'] - events['start'])] |= CHECK_ERR_FED_LENGTH
+    fedCrcs = np.zeros(events.size, dtype=np.uint16)
+    if checkCrc:
+        fedCrcs = computeFedCrcs(raw, events)
+        eventErrors[validEvents & (fedHeaders['crc'] != fedCrcs)] |= CHECK_ERR_FED_CRC
+
+    return EventCheckResult(index, eventErrors, dmbErrors, dmbL1Ids, cfebs, cfebEnds, cfebErrors, alcts, tmbs, fedHeaders, fedCrcs)
+
+##########################
+### CFEB sample decoder ##
+##########################
+
+# a CFEB time sample is 25 64bit words = 100 16bit words (lowest 16 bits of a 64bit word first):
+#   16bit words 0-95 are the ADC words ordered by strip, then layer (word = strip * 6 + layer), each one having a 12 bit ADC value and 4 flag bits on top
+#   16bit words 96-99 are the trailer: word 97 = CRC, word 98 = [5:0] sample number, [11:6] L1A ID (this is the same L1A ID as used by the unpacker objects)
+CFEB_NUM_SAMPLES = 8
+CFEB_NUM_LAYERS = 6
+CFEB_NUM_STRIPS = 16
+CFEB_SAMPLE_WORDS16 = 100
+
+CFEB_FLAG_ADC_OVERFLOW = 0x1
+CFEB_FLAG_CONTROLLER_DATA = 0x2
+CFEB_FLAG_OVERLAPPED_SAMPLE = 0x4
+CFEB_FLAG_ERROR = 0x8
+
+class CfebSamples(object):
+
+    # words16 is an array of 16bit words with shape (..., 100), e.g. (cfeb, sample, 100), all the fields keep the leading dimensions
+    def __init__(self, words16):
+        data = words16[..., :CFEB_NUM_LAYERS * CFEB_NUM_STRIPS].reshape(words16.shape[:-1] + (CFEB_NUM_STRIPS, CFEB_NUM_LAYERS))
+        data = np.swapaxes(data, -1, -2)
+        self.adc = data & 0xfff                            # shape (..., layer, strip)
+        self.flags = (data >> 12).astype(np.uint8)         # shape (..., layer, strip)
+        self.trailer = words16[..., CFEB_NUM_LAYERS * CFEB_NUM_STRIPS:]
+        self.crc = self.trailer[..., 1]
+        self.sampleNum = (self.trailer[..., 2] & 0x3f).astype(np.uint8)
+        self.l1Id = ((self.trailer[..., 2] >> 6) & 0x3f).astype(np.uint8)
+        self.overlapped = ((self.flags & CFEB_FLAG_OVERLAPPED_SAMPLE) != 0).any(axis=(-2, -1))
+
+# decodes all the time samples of the given CFEB blocks (CFEB_DTYPE table, see locateCfebBlocks) at once
+# returns CfebSamples where adc and flags have shape (cfeb, sample, layer, strip) and the trailer fields have shape (cfeb, sample)
+def unpackCfebSamples(raw, cfebs):
+    words16 = np.ascontiguousarray(raw).view(np.dtype('<u2'))
+    # overlapping view where row i holds the 16bit words of the CFEB block that would start at 64bit word i
+    blocks = np.lib.stride_tricks.as_strided(words16, shape=(max(raw.size - CFEB_BLOCK_WORDS + 1, 0), CFEB_BLOCK_WORDS * 4), strides=(8, 2))
+    return CfebSamples(blocks[cfebs['start']].reshape(cfebs.size, CFEB_NUM_SAMPLES, CFEB_SAMPLE_WORDS16))
+
+# decodes all the CFEB time samples of an EventIndex, returns the CFEB_DTYPE table and the CfebSamples
+def unpackIndexCfebSamples(index):
+    cfebs, cfebEnds = locateCfebBlocks(index.raw, index.dmbs)
+    return cfebs, unpackCfebSamples(index.raw, cfebs)
+
+##########################
+####### word diff ########
+##########################
+
+WORD_DIFF_DTYPE = np.dtype([('size1', np.int64),           # number of 64bit words in the first range
+                            ('size2', np.int64),           # number of 64bit words in the second range
+                            ('numMismatches', np.int64),   # number of mismatching 64bit words within the common size
+                            ('firstMismatch64', np.int64), # offset of the first mismatching 64bit word, -1 if none
+                            ('firstMismatch16', np.int64), # offset of the first mismatching 16bit word (lowest 16 bits of a 64bit word first), -1 if none
+                            ('value1', np.uint16),         # first mismatching 16bit word in the first range
+                            ('value2', np.uint16)])        # first mismatching 16bit word in the second range
+
+# compares pairs of DMB blocks (two equally long lists of 64bit word arrays) in one go: the payloads are concatenated and compared with diffWordRanges
+# returns a WORD_DIFF_DTYPE table with one row per pair
+def diffDmbBlocks(words1, words2):
+    sizes1 = np.array([w.size for w in words1], dtype=np.int64)
+    sizes2 = np.array([w.size for w in words2], dtype=np.int64)
+    noWords = [np.zeros(0, dtype=np.dtype('u8'))] # so that empty lists can be concatenated too
+    return diffWordRanges(np.concatenate(noWords + list(words1)), np.cumsum(sizes1) - sizes1, sizes1, np.concatenate(noWords + list(words2)), np.cumsum(sizes2) - sizes2, sizes2)
+
+# compares pairs of 64bit word ranges, given by their start offsets and sizes in raw1 and raw2, in one go: the words within the common size of all the pairs are compared at once
+# returns a WORD_DIFF_DTYPE table with one row per pair
+def diffWordRanges(raw1, starts1, sizes1, raw2, starts2, sizes2):
+    diffs = np.zeros(len(sizes1), dtype=WORD_DIFF_DTYPE)
+    diffs['firstMismatch64'] = -1
+    diffs['firstMismatch16'] = -1
+    diffs['size1'] = sizes1
+    diffs['size2'] = sizes2
+    common = np.minimum(sizes1, sizes2)
+
+    # pair index and offset within the pair of each compared word
+    pairs = np.repeat(np.arange(common.size), common)
+    offsets = np.arange(pairs.size) - np.repeat(np.cumsum(common) - common, common)
+    a = raw1[starts1[pairs] + offsets]
+    b = raw2[starts2[pairs] + offsets]
+    mismatchIdxs = np.nonzero(a != b)[0]
+    diffs['numMismatches'] = np.bincount(pairs[mismatchIdxs], minlength=common.size)
+    if mismatchIdxs.size == 0:
+        return diffs
+
+    # the mismatch indexes are sorted, so the first one of each pair is where the pair index changes
+    mismatchPairs, firstIdxs = np.unique(pairs[mismatchIdxs], return_index=True)
+    firstIdxs = mismatchIdxs[firstIdxs]
+    x = a[firstIdxs] ^ b[firstIdxs]
+    shifts = np.arange(4, dtype=np.uint64) * np.uint64(16)
+    lanes = np.argmax(((x[:, None] >> shifts) & np.uint64(0xffff)) != 0, axis=1)
+    diffs['firstMismatch64'][mismatchPairs] = offsets[firstIdxs]
+    diffs['firstMismatch16'][mismatchPairs] = offsets[firstIdxs] * 4 + lanes
+    diffs['value1'][mismatchPairs] = (a[firstIdxs] >> shifts[lanes]) & np.uint64(0xffff)
+    diffs['value2'][mismatchPairs] = (b[firstIdxs] >> shifts[lanes]) & np.uint64(0xffff)
+    return diffs
+
 ##########################
 ######## raw utils ########
 ##########################
+DDU_READER_BLOCK_WORDS = 1024 * 1024 # 8MB read buffer
+DDU_HEADER2_MASK = 0xffffffffffff0000
+DDU_HEADER2_CODE = 0x8000000180000000
+
+# block reader version of dduReadEventRaw: the file is read in big blocks into a reused buffer, and the DDU header and EOE markers of each block are located with numpy when it's read
+# the marker positions are kept in plain lists, so that reading an event only takes a couple of bisects
+# events are returned as numpy array views into the buffer (zero copy), so they're only valid until the next readEvent() call (use .copy() or .tolist() to keep them)
+# the reader keeps track of its own position in the file, and provides tell() and seek() that should be used instead of the file ones (e.g. it can be passed to seekToL1Id)
+class DduEventReader(object):
+
+    def __init__(self, file, blockWords = DDU_READER_BLOCK_WORDS):
+        self.file = file
+        self.buf = np.empty(blockWords, dtype=np.dtype('u8'))
+        self.bufOffset = file.tell() # byte offset of the first buffer word in the file
+        self.filled = 0              # number of words in the buffer
+        self.pos = 0                 # buffer index of the next word to be read
+        self.eof = False
+        self.clearMarkers()
+
+    def clearMarkers(self):
+        self.eoes = []        # buffer indexes of the EOE markers
+        self.headers = []     # buffer indexes of the DDU header 2 words (that follow a DDU header 1 word)
+        self.headerL1Ids = [] # L1A IDs of the above headers
+
+    def tell(self):
+        return self.bufOffset + self.pos * 8
+
+    def seek(self, offset, whence = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        elif whence == os.SEEK_END:
+            self.file.seek(0, os.SEEK_END)
+            offset += self.file.tell()
+        if offset >= self.bufOffset and offset <= self.bufOffset + self.filled * 8 and (offset - self.bufOffset) % 8 == 0:
+            self.pos = (offset - self.bufOffset) // 8
+        else:
+            self.file.seek(offset)
+            self.bufOffset = offset
+            self.filled = 0
+            self.pos = 0
+            self.eof = False
+            self.clearMarkers()
+
+    # drops the buffer words before keepFrom, and reads more words from the file after the rest (the buffer is grown if nothing can be dropped)
+    # the markers in the new words are located, returns the number of words that the buffer contents were moved by
+    def refill(self, keepFrom):
+        if keepFrom == 0 and self.filled == self.buf.size:
+            bigBuf = np.empty(self.buf.size * 2, dtype=self.buf.dtype)
+            bigBuf[:self.filled] = self.buf[:self.filled]
+            self.buf = bigBuf
+        elif keepFrom > 0:
+            self.buf[:self.filled - keepFrom] = self.buf[keepFrom:self.filled]
+            self.filled -= keepFrom
+            self.pos = max(self.pos - keepFrom, 0)
+            self.bufOffset += keepFrom * 8
+            firstHeader = bisect.bisect_right(self.headers, keepFrom)
+            self.headers = [h - keepFrom for h in self.headers[firstHeader:]]
+            self.headerL1Ids = self.headerL1Ids[firstHeader:]
+            self.eoes = [e - keepFrom for e in self.eoes[bisect.bisect_left(self.eoes, keepFrom):]]
+
+        scanned = self.filled
+        self.filled, self.eof = readWords(self.file, self.buf, self.filled)
+        # both the EOE and the header 2 words have 0x8000 in the top 16 bits, so those are found first by only looking at the top 16bit words
+        candidates = scanned + np.flatnonzero(self.buf[scanned:self.filled].view(np.dtype('<u2'))[3::4] == 0x8000)
+        candidateWords = self.buf[candidates]
+        self.eoes += candidates[candidateWords == np.uint64(EOE_MARKER)].tolist()
+        # the first buffer word can't be a header 2 word, since the header 1 word would be before the buffer
+        header2 = candidates[(candidateWords & np.uint64(DDU_HEADER2_MASK) == np.uint64(DDU_HEADER2_CODE)) & (candidates > 0)]
+        header1 = self.buf[header2 - 1]
+        isHeader = header1 >> np.uint64(60) == np.uint64(0x5)
+        self.headers += header2[isHeader].tolist()
+        self.headerL1Ids += ((header1[isHeader] >> np.uint64(32)) & np.uint64(0xffffff)).tolist()
+        return keepFrom
+
+    # returns the next event starting from the current position (with the given L1A ID if l1Id is not None) as a numpy array, including the two DDU trailer words after the EOE marker
+    # an empty array is returned if no event is found, and a truncated one if the file ends in the middle of the event
+    def readEvent(self, l1Id = None):
+        # the header 1 word has to be at or after the current position, and the header 2 word right after it
+        while True:
+            i = bisect.bisect_left(self.headers, self.pos + 1)
+            if l1Id is not None and i < len(self.headers):
+                try:
+                    i = self.headerL1Ids.index(l1Id, i)
+                except ValueError:
+                    i = len(self.headers)
+            if i < len(self.headers):
+                break
+            if self.eof:
+                self.pos = self.filled
+                return self.buf[:0]
+            # all the words except the last one (which could be a header 1 word) can be dropped
+            self.refill(max(self.pos, self.filled - 1))
+
+        self.pos = self.headers[i] - 1
+        while True:
+            j = bisect.bisect_left(self.eoes, self.pos + 2)
+            if j < len(self.eoes) or self.eof:
+                break
+            self.refill(self.pos)
+        if j == len(self.eoes):
+            start = self.pos
+            self.pos = self.filled
+            return self.buf[start:self.filled]
+
+        # read the last two ddu trailer words
+        eoe = self.eoes[j]
+        while eoe + 3 > self.filled and not self.eof:
+            eoe -= self.refill(self.pos)
+        start = self.pos
+        self.pos = min(eoe + 3, self.filled)
+        return self.buf[start:self.pos]
+
+# reads the next event from the file with the given L1A ID (any L1A ID if eventIdx is None), one word at a time
+# (& binds tighter than != in python, so the header check below does compare the 24 bit L1A ID of the DDU header #1 with eventIdx)
+# DduEventReader does the same on big blocks, and is much faster
 def dduReadEventRaw(file, eventIdx):
 
     words = []
@@ -327,83 +1477,120 @@ def dumpEvents(cfedEvent, dduEvent):
         else:
             print(line)
 
-def dumpEventsNumpy(words1, words2, annotateWords1 = True, maxSize = 5000):
+DUMP_DMB_HEADER2_CODE = 0xa000a000a000a000
+DUMP_DMB_TRAILER2_CODE = 0xe000e000e000e000
+DUMP_TRIG_MASK = 0xf000f000f000ffff
+DUMP_MARKERS = [[DMB_HEADER1_MASK, DUMP_DMB_HEADER2_CODE, "   <=== DMB HEADER #2"],
+                [DMB_HEADER1_MASK, DUMP_DMB_TRAILER2_CODE, "   <=== DMB TRAILER #2"],
+                [DUMP_TRIG_MASK, 0xd000d000d000db0a, "   <=== ALCT HEADER"],
+                [DUMP_TRIG_MASK, 0xd000d000d000de0d, "   <=== ALCT TRAILER"],
+                [DUMP_TRIG_MASK, 0xd000d000d000db0c, "   <=== TMB HEADER"],
+                [DUMP_TRIG_MASK, 0xd000d000d000de0f, "   <=== TMB TRAILER"]]
+HEX_CHARS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# formats the given unsigned integers as lower case hex strings of numDigits digits (without 0x), with a space after every spaceEvery digits if given
+# returns a list of strings
+def hexStrings(values, numDigits, spaceEvery = None):
+    values = np.asarray(values, dtype=np.uint64)
+    shifts = np.arange(numDigits - 1, -1, -1, dtype=np.uint64) * np.uint64(4)
+    digits = HEX_CHARS[(values[:, None] >> shifts) & np.uint64(0xf)]
+    if spaceEvery is not None:
+        numChars = numDigits + (numDigits - 1) // spaceEvery
+        chars = np.full((values.size, numChars), ord(' '), dtype=np.uint8)
+        chars[:, np.arange(numDigits) + np.arange(numDigits) // spaceEvery] = digits
+        digits = chars
+    return np.ascontiguousarray(digits).view('S%d' % digits.shape[1]).ravel().tolist()
+
+# returns the marker type of each word (index into DUMP_MARKERS, or -1), and the number of CFEB words seen so far in the DMB block at each word (0 if not in CFEB data)
+# CFEB data starts right after the DMB header #2 (if no ALCT or TMB header was seen so far), the ALCT trailer (if no TMB header was seen so far) or the TMB trailer
+def findDumpAnnotations(words):
+    types = np.full(words.size, -1, dtype=np.int64)
+    for t in reversed(range(len(DUMP_MARKERS))):
+        mask, code, name = DUMP_MARKERS[t]
+        types[(words & np.uint64(mask)) == np.uint64(code)] = t
+    isType = [types == t for t in range(len(DUMP_MARKERS))]
+    isHeader2, isTrailer2, isAlctHeader, isAlctTrailer, isTmbHeader, isTmbTrailer = isType
+    seenAlctHeader = np.cumsum(isAlctHeader) > 0
+    seenTmbHeader = np.cumsum(isTmbHeader) > 0
+
+    # cfebStart[i] is True if the CFEB data starts at word i (if it hasn't started already in the DMB block)
+    cfebStart = np.zeros(words.size, dtype=np.bool_)
+    cfebStart[1:] = (isHeader2[:-1] & ~isHeader2[1:] & ~seenAlctHeader[1:] & ~seenTmbHeader[1:]) | \
+                    (isAlctTrailer[:-1] & ~isAlctTrailer[1:] & ~seenTmbHeader[1:]) | \
+                    (isTmbTrailer[:-1] & ~isTmbTrailer[1:])
+
+    # the CFEB word count is reset at every DMB header #2, and keeps counting from the first CFEB start in the block
+    blocks = np.cumsum(isHeader2)
+    starts = np.flatnonzero(cfebStart)
+    firstStarts = np.full(blocks[-1] + 1 if words.size > 0 else 1, words.size, dtype=np.int64)
+    startBlocks, firstIdxs = np.unique(blocks[starts], return_index=True)
+    firstStarts[startBlocks] = starts[firstIdxs]
+    idxs = np.arange(words.size)
+    cfebWordCnts = np.maximum(idxs - firstStarts[blocks] + 1, 0)
+    return types, cfebWordCnts
+
+# renders lines [first, first + maxSize) of the dump of words1 (and words2 side by side, if given), maxSize = None means all the lines
+# the hex conversion, annotations and mismatches are all done with numpy, returns a list of lines
+def renderEventsNumpy(words1, words2, annotateWords1 = True, maxSize = 5000, first = 0, colors = True):
     len1 = words1.size
     len2 = 0
     if words2 is not None:
         len2 = words2.size
 
-    length = len1
-    if (len2 > len1):
-        length = len2
-    if length > maxSize:
-        length = maxSize
-
-    line = ""
-    dmbHead2Idx = -9999
-    alctHeadIdx = None
-    alctTrailIdx = None
-    tmbHeadIdx = None
-    tmbTrailIdx = None
-    cfebData = False
-    cfebWordCnt = 0
-    dmbTrail2Idx = None
-    for i in range(0, length):
-        line = hexPadded(i*8, 2) + ":   "
-        if (i < len1):
-            line += hexPadded((int(words1[i]) >> 48) & 0xffff, 2, False) + " " + hexPadded((int(words1[i]) >> 32) & 0xffff, 2, False) + " " + hexPadded((int(words1[i]) >> 16) & 0xffff, 2, False) + " " + hexPadded(int(words1[i]) & 0xffff, 2, False)
-            if annotateWords1:
-                if  (int(words1[i]) & 0xf000f000f000f000) == 0xa000a000a000a000:
-                    dmbHead2Idx = i
-                    cfebData = False
-                    cfebWordCnt = 0
-                elif (int(words1[i]) & 0xf000f000f000f000) == 0xe000e000e000e000:
-                    dmbTrail2Idx = i
-                elif (int(words1[i]) & 0xf000f000f000ffff) == 0xd000d000d000db0a:
-                    alctHeadIdx = i
-                elif (int(words1[i]) & 0xf000f000f000ffff) == 0xd000d000d000de0d:
-                    alctTrailIdx = i
-                elif (int(words1[i]) & 0xf000f000f000ffff) == 0xd000d000d000db0c:
-                    tmbHeadIdx = i
-                elif (int(words1[i]) & 0xf000f000f000ffff) == 0xd000d000d000de0f:
-                    tmbTrailIdx = i
-
-                if ((dmbHead2Idx == i - 1) and (alctHeadIdx is None) and (tmbHeadIdx is None)) or \
-                   ((alctTrailIdx is not None) and (alctTrailIdx == i -1) and (tmbHeadIdx is None)) or \
-                   ((tmbTrailIdx is not None) and (tmbTrailIdx == i - 1)):
-                    cfebData = True
-
-                if cfebData:
-                    cfebWordCnt += 1
-        else:
-            line = "                  "
-
-        if words2 is not None:
-            line += "  ----  "
-
-            if (i < len2):
-                line += hexPadded((int(words2[i]) >> 48) & 0xffff, 2, False) + " " + hexPadded((int(words2[i]) >> 32) & 0xffff, 2, False) + " " + hexPadded((int(words2[i]) >> 16) & 0xffff, 2, False) + " " + hexPadded(int(words2[i]) & 0xffff, 2, False)
-
-        if annotateWords1:
-            if dmbHead2Idx == i:
-                line += "   <=== DMB HEADER #2"
-            elif dmbTrail2Idx == i:
-                line += "   <=== DMB TRAILER #2"
-            elif alctHeadIdx == i:
-                line += "   <=== ALCT HEADER"
-            elif alctTrailIdx == i:
-                line += "   <=== ALCT TRAILER"
-            elif tmbHeadIdx == i:
-                line += "   <=== TMB HEADER"
-            elif tmbTrailIdx == i:
-                line += "   <=== TMB TRAILER"
-            elif (cfebWordCnt > 0) and (cfebWordCnt % 25 == 0):
-                line += "   <=== CFEB SAMPLE %d TRAILER" % int(cfebWordCnt / 25)
-
-        if words2 is not None and (i < len1) and (i < len2) and (words1[i] != words2[i]):
-            printRed(line)
-        else:
-            print(line)
+    length = max(len1, len2)
+    last = length if maxSize is None else min(length, first + maxSize)
+    if first >= last:
+        return []
+    idxs = np.arange(first, last)
+    # the word columns are left out (the whole left column is blank) after the end of the words
+    end1 = min(max(len1, first), last)
+    end2 = min(max(len2, first), last)
+
+    offsets = idxs * 8
+    offsetStrs = []
+    numDigits = 4
+    while len(offsetStrs) < idxs.size:
+        group = offsets[len(offsetStrs):]
+        group = group[group < 16 ** numDigits]
+        offsetStrs += ["0x" + o + ":   " for o in hexStrings(group, numDigits)]
+        numDigits += 1
+    left = [o + w for o, w in zip(offsetStrs, hexStrings(words1[first:end1], 16, 4))] + ["                  "] * (last - end1)
+
+    lines = left
+    if words2 is not None:
+        right = hexStrings(words2[first:end2], 16, 4) + [""] * (last - end2)
+        lines = [l + "  ----  " + r for l, r in zip(left, right)]
+
+    if annotateWords1:
+        types, cfebWordCnts = findDumpAnnotations(words1)
+        # past the end of words1 the CFEB word count stays where it was at the last word
+        lineTypes = np.full(idxs.size, -1, dtype=np.int64)
+        lineTypes[:end1 - first] = types[first:end1]
+        lineCnts = np.full(idxs.size, cfebWordCnts[-1] if len1 > 0 else 0, dtype=np.int64)
+        lineCnts[:end1 - first] = cfebWordCnts[first:end1]
+        for i in np.flatnonzero(lineTypes >= 0):
+            lines[i] += DUMP_MARKERS[lineTypes[i]][2]
+        for i in np.flatnonzero((lineTypes < 0) & (lineCnts > 0) & (lineCnts % 25 == 0)):
+            lines[i] += "   <=== CFEB SAMPLE %d TRAILER" % (lineCnts[i] // 25)
+
+    if words2 is not None and colors:
+        common = max(min(len1, len2, last), first)
+        mismatches = np.flatnonzero(words1[first:common] != words2[first:common])
+        for i in mismatches:
+            lines[i] = Colors.RED + lines[i] + Colors.ENDC
+
+    return lines
+
+# prints a dump of words1 (and words2 side by side, if given, with the mismatching words in red), annotating the DMB, ALCT, TMB and CFEB sample markers in words1 if annotateWords1 is set
+# the dump is split into pages of maxSize lines (maxSize = None means no limit), and only the given page is printed
+# everything is written in one go to out (stdout by default, but it can be any file like object)
+def dumpEventsNumpy(words1, words2, annotateWords1 = True, maxSize = 5000, page = 0, out = None, colors = True):
+    first = 0 if maxSize is None else page * maxSize
+    lines = renderEventsNumpy(words1, words2, annotateWords1, maxSize, first, colors)
+    if out is None:
+        out = sys.stdout
+    if len(lines) > 0:
+        out.write("\n".join(lines) + "\n")
 
 def printRawWords(words64):
     i = 0
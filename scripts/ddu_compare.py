@@ -19,16 +19,19 @@ def main():
 
     heading('Welcome to CSC_FED - DDU raw file comparison tool')
 
-    cfedFile = open(cfedFilename, 'r')
+    cfedRaw, cfedEventBounds = readCtp7Dump(cfedFilename, keepAmc13Words = True)
     dduFile = open(dduFilename, 'rb')
+    dduReader = DduEventReader(dduFile)
+    dduIndex = loadSidecarL1IdLookup(dduFilename)
 
     numEvents = 0
-    while True:
-        cfedWords = cfedReadNextEvent(cfedFile)
+    while numEvents < cfedEventBounds.size - 1:
+        cfedWords = cfedRaw[cfedEventBounds[numEvents]:cfedEventBounds[numEvents + 1]].tolist()
         l1aId = (cfedWords[0] >> 32) & 0xffffff;
         sys.stdout.write("\rEvent: %i (L1A ID %d)" % (numEvents, l1aId))
         sys.stdout.flush()
-        dduWords = dduReadEventRaw(dduFile, l1aId)
+        seekToL1Id(dduReader, dduIndex, l1aId)
+        dduWords = dduReader.readEvent(l1aId).tolist()
 
         # empty event in both paths (this shouldn't happen in 904 when it's self triggering, but hmm, whatever)
         if (len(cfedWords) == 8 and len(dduWords) == 6):
@@ -68,30 +71,8 @@ def main():
     #
     # print("Num words = %d" % numWords)
 
-    cfedFile.close()
     dduFile.close()
 
-def cfedReadNextEvent(file):
-
-    line = "dummy"
-
-    # find the beginning of event
-    while ("======================== Event" not in line) and (line != ""):
-        line = file.readline()
-
-    line = "dummy"
-
-    # read event contents
-    words = []
-    while True:
-        line = file.readline()
-        if ("========" in line) or (line == ''):
-            break
-        word = int(line[2:], 16)
-        words.append(word)
-
-    return words
-
 def dumpEvents(cfedEvent, dduEvent):
     cfedLen = len(cfedEvent)
     dduLen = len(dduEvent)
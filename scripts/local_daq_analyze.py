@@ -1,109 +1,141 @@
 from utils import *
 from data_processing_utils import *
 import signal
+import multiprocessing
 import sys
 import os
 import struct
+import functools
 import numpy as np
+import json
 from time import *
 
 #IGNORE_DMBS = [[1, 1], [12, 1]]  # these DMBs will get ignored
 IGNORE_DMBS = [[0, 0]]  # dummy DMB ignore list
 REMOVE_EMPTY_EVENTS = False
+BIG_EVENT_WORDS = 10000 # events larger than this are reported (and the first one is dumped)
+SIZE_PERCENTILES = [50, 90, 99, 99.9]
 
 def main():
 
     ldaqFilename = ""
     maxFiles = None
+    jobs = 1
+    chunkWords = STREAM_BLOCK_WORDS
 
-    if len(sys.argv) < 2:
-        print('Usage: local_daq_analyze.py <local_daq_data_file_pattern> [max_num_files_match]')
+    args = sys.argv[1:]
+    if '--jobs' in args:
+        i = args.index('--jobs')
+        jobs = int(args[i + 1])
+        del args[i:i + 2]
+    if '--chunk-mb' in args:
+        i = args.index('--chunk-mb')
+        chunkWords = int(args[i + 1]) * 1024 * 1024 // 8
+        del args[i:i + 2]
+    dumpFile = None
+    if '--dump-file' in args:
+        i = args.index('--dump-file')
+        dumpFile = open(args[i + 1], 'w')
+        del args[i:i + 2]
+    dumpLines = 5000
+    if '--dump-lines' in args:
+        i = args.index('--dump-lines')
+        dumpLines = int(args[i + 1])
+        del args[i:i + 2]
+    statsOut = None
+    if '--stats-out' in args:
+        i = args.index('--stats-out')
+        statsOut = args[i + 1]
+        del args[i:i + 2]
+
+    if len(args) < 1:
+        print('Usage: local_daq_analyze.py <local_daq_data_file_pattern> [max_num_files_match] [--jobs N] [--chunk-mb N] [--dump-file FILE] [--dump-lines N] [--stats-out PREFIX]')
         print('file patterns can be exact filenames or have a * indicating a wildcard, but only for the part number (last number in the local daq filename)')
         print('if a wildcard is used, you can optionally provide a max number of files to match to (default is no limit)')
+        print('--jobs N analyzes N files in parallel (default is 1), the results are the same as when running with one job')
+        print('--chunk-mb N reads the files in chunks of N MB (default is %d), the peak memory is a few times this per job, the results are the same for any chunk size' % (STREAM_BLOCK_WORDS * 8 // (1024 * 1024)))
+        print('--dump-file FILE writes the dumps of the events with errors to FILE (without colors) instead of the screen')
+        print('--dump-lines N dumps at most N words per event (default is 5000, 0 means no limit)')
+        print('--stats-out PREFIX saves the FED and DMB block size histograms to PREFIX.npz and a summary (with the non-empty histogram bins) to PREFIX.json')
         return
     else:
-        ldaqFilename = sys.argv[1]
+        ldaqFilename = args[0]
 
-    if len(sys.argv) > 2:
-        maxFiles = int(sys.argv[2])
+    if len(args) > 1:
+        maxFiles = int(args[1])
 
     heading('Welcome to Local DAQ raw file analyzer')
 
     files = getAllLocalDaqRawFiles(ldaqFilename, maxFiles)
 
-    events = []
-    fileIdx = -1
     evtNum = 0
-    idx = -1
 
     # error log
     errors = []
 
     # size stats
-    totalWords = 0
-    minWords = 99999
     maxWords = 0
     maxWordsEvtNum = 0
-    totalDmbWords = {} # dictionary of total words per DMB, where key is "crateID, DMBID", and value is an array holding the total word count, number of blocks, min word count, and max word count
+    sizeStats = SizeStats()
+    bigEventDumped = False
 
-    while True:
-        evtNum += 1
-        idx += 1
+    # the event dumps go to the dump file if one was given, otherwise to the screen
+    def dump(words, title):
+        if dumpFile is not None:
+            dumpFile.write("%s\n" % title)
+        dumpEventsNumpy(words, None, True, dumpLines if dumpLines > 0 else None, out=dumpFile, colors=dumpFile is None)
 
-        # read the next file if we got to the end, and exit the loop if we got to the last file already
-        if idx >= len(events):
-            fileIdx += 1
-            if fileIdx >= len(files):
-                print("DONE")
-                break
-            del events[:]
-            events = unpackFile(files[fileIdx], REMOVE_EMPTY_EVENTS, IGNORE_DMBS)
-            idx1 = 0
+    # the files are analyzed independently (in parallel if jobs > 1), and the results are merged here in file order
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(functools.partial(analyzeFile, chunkWords=chunkWords), files)
+    else:
+        results = (analyzeFile(fname, chunkWords) for fname in files)
 
-        if (evtNum % 1000 == 0):
-            print("Checking event %d" % evtNum)
+    for fileIdx in range(len(files)):
+        res = results.next()
+        print("Checked %d events in file %s" % (res.numEvents, files[fileIdx]))
 
-        evt = events[idx]
+        raw = None
+        if len(res.errors) > 0 or res.bigEvent is not None:
+            raw = mapRawFile(files[fileIdx])
 
-        # error checking
-        err = checkEventErrors(evt)
-        if len(err) > 0:
-            errors.append(["Global event #%d (file %d, local event #%d)" % (evtNum, fileIdx, idx)] + err)
-            printRed("Error in event #%d (file %d, local event #%d)" % (evtNum, fileIdx, idx))
+        for localEvtNum, start, end, err in res.errors:
+            errors.append(["Global event #%d (file %d, local event #%d)" % (evtNum + localEvtNum + 1, fileIdx, localEvtNum)] + err)
+            printRed("Error in event #%d (file %d, local event #%d)" % (evtNum + localEvtNum + 1, fileIdx, localEvtNum))
             for e in err:
                 printRed(e)
-            dumpEventsNumpy(evt.words, None)
+            dump(raw[start:end], "Event #%d (file %d, local event #%d):" % (evtNum + localEvtNum + 1, fileIdx, localEvtNum))
 
-        # statistics
-        totalWords += evt.words.size
-        if evt.words.size < minWords:
-            minWords = evt.words.size
-        if evt.words.size > maxWords:
-            maxWords = evt.words.size
-            maxWordsEvtNum = evtNum
-        if evt.words.size > 10000:
-            printRed("Size of this event is larger than 10000: %d" % evt.words.size)
-            if idx > 0:
+        if res.numEvents > 0:
+            if res.maxWords > maxWords:
+                maxWords = res.maxWords
+                maxWordsEvtNum = evtNum + res.maxWordsLocalEvtNum + 1
+        sizeStats.merge(res.sizeStats)
+
+        # only the first big event of the run is dumped, the rest are just counted
+        if res.bigEvent is not None and not bigEventDumped:
+            bigEventDumped = True
+            bigEvtNum, prevEvent, bigEvent = res.bigEvent
+            printRed("Size of event #%d is larger than %d: %d" % (evtNum + bigEvtNum + 1, BIG_EVENT_WORDS, bigEvent[1] - bigEvent[0]))
+            if prevEvent is not None:
                 printRed("Dumping previous event:")
-                dumpEventsNumpy(events[idx-1].words, None)
+                dump(raw[prevEvent[0]:prevEvent[1]], "Event before the big event:")
             else:
                 printRed("Previous event is not available")
             printRed("Dumping the big event:")
-            dumpEventsNumpy(evt.words, None)
-            printRed("Exiting due to the above error")
-            return
+            dump(raw[bigEvent[0]:bigEvent[1]], "Big event:")
 
-        for dmb in evt.dmbs:
-            id = getDmbIdStr(dmb)
-            if id not in totalDmbWords:
-                totalDmbWords[id] = [dmb.words.size, 1, dmb.words.size, dmb.words.size]
-            else:
-                totalDmbWords[id][0] += dmb.words.size
-                totalDmbWords[id][1] += 1
-                if dmb.words.size < totalDmbWords[id][2]:
-                    totalDmbWords[id][2] = dmb.words.size
-                if dmb.words.size > totalDmbWords[id][3]:
-                    totalDmbWords[id][3] = dmb.words.size
+        evtNum += res.numEvents
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if dumpFile is not None:
+        dumpFile.close()
+
+    print("DONE")
 
     print("===================================================================")
     print("Total number of events checked: %d" % evtNum)
@@ -125,15 +157,157 @@ def main():
     print("======================= STATISTICS ============================")
     print("===============================================================")
 
-    print("Average FED block size (in 64bit words): %f" % (float(totalWords) / float(evtNum)))
-    print("Minimum FED block size (in 64bit words): %d" % minWords)
+    fedSummary = histSummary(sizeStats.fedHist)
+    print("Average FED block size (in 64bit words): %f" % fedSummary['mean'])
+    print("Minimum FED block size (in 64bit words): %d" % fedSummary['min'])
     print("Maximum FED block size (in 64bit words): %d (event #%d)" % (maxWords, maxWordsEvtNum))
+    print("FED block size percentiles (in 64bit words): %s" % getPercentilesStr(fedSummary))
+    numBigEvents = countAbove(sizeStats.fedHist, BIG_EVENT_WORDS)
+    if numBigEvents > 0:
+        printRed("Number of events larger than %d words: %d" % (BIG_EVENT_WORDS, numBigEvents))
     print("DMB block sizes (in 64bit words):")
-    for id, stat in totalDmbWords.iteritems():
-        print("    %s: average = %f, min = %d, max = %d" % (id, (float(stat[0]) / float(stat[1])), stat[2], stat[3]))
+    dmbSummaries = {}
+    for id in sorted(sizeStats.dmbHists.keys()):
+        dmbSummaries[id] = histSummary(sizeStats.dmbHists[id])
+        stat = dmbSummaries[id]
+        print("    %s: average = %f, min = %d, max = %d, %s" % (getDmbIdStr(id[0], id[1]), stat['mean'], stat['min'], stat['max'], getPercentilesStr(stat)))
+
+    if statsOut is not None:
+        sizeStats.save(statsOut + ".npz")
+        summary = {'numEvents': evtNum,
+                   'numEventsWithErrors': len(errors),
+                   'bigEventWords': BIG_EVENT_WORDS,
+                   'numBigEvents': numBigEvents,
+                   'fed': dict(fedSummary, maxEventNum=maxWordsEvtNum, hist=getHistBins(sizeStats.fedHist)),
+                   'dmbs': [dict(dmbSummaries[id], crateId=id[0], dmbId=id[1], hist=getHistBins(sizeStats.dmbHists[id])) for id in sorted(dmbSummaries.keys())]}
+        with open(statsOut + ".json", 'w') as f:
+            json.dump(summary, f, indent=1)
+        print("Size statistics saved to %s.npz and %s.json" % (statsOut, statsOut))
+
+class FileAnalysis(object):
+
+    def __init__(self):
+        self.numEvents = 0
+        self.errors = [] # list of [local event number, start word, end word, list of error strings]
+        self.maxWords = 0
+        self.maxWordsLocalEvtNum = 0
+        self.sizeStats = SizeStats()
+        self.bigEvent = None # [local event number, previous event, big event] of the first event that is larger than BIG_EVENT_WORDS, where each event is given as [start word, end word] (previous event is None if not available)
+
+# checks all events of one local DAQ file and collects the statistics (this is run in a worker process when using multiple jobs)
+# the file is read one chunk of chunkWords 64bit words at a time, and all the events of a chunk are checked at once
+def analyzeFile(filename, chunkWords = STREAM_BLOCK_WORDS):
+    res = FileAnalysis()
+    prevEvent = None
+    for index in streamEventIndexes(filename, chunkWords):
+        if REMOVE_EMPTY_EVENTS:
+            index = index.removeDmbs(IGNORE_DMBS)
+        events = index.events
+        sizes = events['end'] - events['start']
+        numEvents = len(index)
+
+        # error checking
+        check = checkEvents(index)
+        for idx in check.getErrorEvents():
+            res.errors.append([res.numEvents + idx, index.offset + events['start'][idx], index.offset + events['end'][idx], check.formatEventErrors(idx)])
+
+        # statistics
+        if numEvents > 0:
+            if sizes.max() > res.maxWords:
+                res.maxWords = int(sizes.max())
+                res.maxWordsLocalEvtNum = res.numEvents + int(np.argmax(sizes))
+        res.sizeStats.addFedSizes(sizes)
+        res.sizeStats.addDmbSizes(index.dmbs)
+
+        bigEvents = np.flatnonzero(sizes > BIG_EVENT_WORDS)
+        if bigEvents.size > 0 and res.bigEvent is None:
+            idx = bigEvents[0]
+            if idx > 0:
+                prevEvent = [index.offset + events['start'][idx - 1], index.offset + events['end'][idx - 1]]
+            res.bigEvent = [res.numEvents + idx, prevEvent, [index.offset + events['start'][idx], index.offset + events['end'][idx]]]
+
+        res.numEvents += numEvents
+        if numEvents > 0:
+            prevEvent = [index.offset + events['start'][numEvents - 1], index.offset + events['end'][numEvents - 1]]
+
+    return res
+
+# size distributions of the FED blocks and of the DMB blocks of each (crate, DMB)
+# the histograms are sparse: a pair of arrays with the distinct sizes (in 64bit words, increasing) and the number of blocks of each size, so that a few
+# huge blocks or bogus crate/DMB IDs in a corrupted run don't blow up the memory; they are filled over the event and DMB tables of a whole chunk at once
+class SizeStats(object):
+
+    def __init__(self):
+        self.fedHist = emptyHist()
+        self.dmbHists = {} # (crate ID, DMB ID) -> histogram
+
+    def addFedSizes(self, sizes):
+        self.fedHist = addHists(self.fedHist, np.unique(sizes, return_counts=True))
+
+    # adds the DMB block sizes of a DMB_DTYPE table
+    def addDmbSizes(self, dmbs):
+        if dmbs.size == 0:
+            return
+        # one combined key per (crate, DMB, length), the distinct keys come out sorted by crate and DMB, and then by length
+        keys = (dmbs['crateId'].astype(np.int64) * 16 + dmbs['dmbId']) << 32 | dmbs['length'].astype(np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        ids = keys >> 32
+        lengths = keys & 0xffffffff
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        for first, last in zip(np.append(0, bounds), np.append(bounds, ids.size)):
+            id = (int(ids[first] >> 4), int(ids[first] & 0xf))
+            self.dmbHists[id] = addHists(self.dmbHists.get(id, emptyHist()), (lengths[first:last], counts[first:last]))
+
+    def merge(self, other):
+        self.fedHist = addHists(self.fedHist, other.fedHist)
+        for id, hist in other.dmbHists.items():
+            self.dmbHists[id] = addHists(self.dmbHists.get(id, emptyHist()), hist)
+
+    # saves the histograms to an npz file: fedHist (N x 2 array of size and count), and dmbHists (N x 4 array of crate ID, DMB ID, size and count), only the non-empty bins
+    def save(self, filename):
+        ids = sorted(self.dmbHists.keys())
+        dmbHists = [np.column_stack((np.full(self.dmbHists[id][0].size, id[0]), np.full(self.dmbHists[id][0].size, id[1]), self.dmbHists[id][0], self.dmbHists[id][1])) for id in ids]
+        dmbHists = np.concatenate([np.zeros((0, 4), dtype=np.int64)] + dmbHists).astype(np.int64)
+        np.savez(filename, fedHist=np.column_stack(self.fedHist).astype(np.int64), dmbHists=dmbHists)
+
+def emptyHist():
+    return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+# adds two sparse histograms
+def addHists(hist1, hist2):
+    sizes, idxs = np.unique(np.concatenate((hist1[0], hist2[0])).astype(np.int64), return_inverse=True)
+    counts = np.zeros(sizes.size, dtype=np.int64)
+    np.add.at(counts, idxs, np.concatenate((hist1[1], hist2[1])))
+    return sizes, counts
+
+# returns the number of entries of a sparse histogram above the given size
+def countAbove(hist, size):
+    return int(hist[1][hist[0] > size].sum())
+
+# returns a dictionary with the number of entries, mean, min, max and the SIZE_PERCENTILES of a sparse histogram
+# the percentiles are the smallest sizes that have at least the given percentage of the entries at or below them
+def histSummary(hist):
+    sizes, counts = hist
+    count = int(counts.sum())
+    if count == 0:
+        return {'count': 0, 'mean': 0.0, 'min': 0, 'max': 0, 'percentiles': dict((str(p), 0) for p in SIZE_PERCENTILES)}
+    cumCounts = np.cumsum(counts)
+    percentiles = sizes[np.searchsorted(cumCounts, np.array(SIZE_PERCENTILES) / 100.0 * count)]
+    return {'count': count,
+            'mean': float((sizes * counts).sum()) / count,
+            'min': int(sizes[0]),
+            'max': int(sizes[-1]),
+            'percentiles': dict((str(p), int(percentiles[i])) for i, p in enumerate(SIZE_PERCENTILES))}
+
+def getPercentilesStr(summary):
+    return ", ".join(["%s%% = %d" % (str(p), summary['percentiles'][str(p)]) for p in SIZE_PERCENTILES])
+
+# returns the bins of a sparse histogram as [size, count] pairs
+def getHistBins(hist):
+    return [[int(size), int(count)] for size, count in zip(hist[0], hist[1])]
 
-def getDmbIdStr(dmb):
-    return "Crate %d, DMB %d" % (dmb.crateId, dmb.dmbId)
+def getDmbIdStr(crateId, dmbId):
+    return "Crate %d, DMB %d" % (crateId, dmbId)
 
 if __name__ == '__main__':
     main()
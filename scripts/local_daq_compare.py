@@ -4,44 +4,87 @@ import signal
 import sys
 import os
 import struct
+import numpy as np
+import time
+
+RUN_COMPARE_CHUNK_WORDS = 4 * 1024 * 1024 # 32MB read buffer per run in the full run mode
+DEFAULT_DUMP_MISMATCHES = 10 # how many mismatching events are dumped in the full run mode
+MAX_LISTED_MISMATCHES = 100 # how many mismatching events are listed in the full run summary
+
+EVENT_MISMATCH_DTYPE = np.dtype([('eventNum', np.int64),       # event number counted from the start of the first file of the run
+                                 ('l1Id1', np.uint32),
+                                 ('l1Id2', np.uint32),
+                                 ('size1', np.int64),          # event size in 64bit words
+                                 ('size2', np.int64),
+                                 ('firstMismatch64', np.int64), # offset of the first mismatching 64bit word within the common size, -1 if none
+                                 ('numMismatches', np.int64)])  # number of mismatching 64bit words within the common size
 
 def main():
 
     ldaqFilename1 = ""
     ldaqFilename2 = ""
+    runMode = False
+    maxFiles = None
+    dumpMismatches = DEFAULT_DUMP_MISMATCHES
 
-    if len(sys.argv) < 3:
+    args = sys.argv[1:]
+    if '--run' in args:
+        runMode = True
+        args.remove('--run')
+    if '--dump' in args:
+        i = args.index('--dump')
+        dumpMismatches = int(args[i + 1])
+        del args[i:i + 2]
+
+    if len(args) < 2:
         print('Usage: local_daq_compare.py <local_daq_data_file_1> <local_daq_data_file_2>')
+        print('       local_daq_compare.py --run <local_daq_data_file_pattern_1> <local_daq_data_file_pattern_2> [max_num_files_match] [--dump N]')
+        print('CTP7 text dumps (written by csc_daq.py) can be used in place of the local DAQ raw files')
+        print('by default the comparison stops at the first mismatching event')
+        print('--run compares the whole runs (all the parts matching the file patterns, a * can be used for the part number), records every mismatching event, and prints a summary at the end')
+        print('--dump N dumps the first N mismatching events in the --run mode (default is %d)' % DEFAULT_DUMP_MISMATCHES)
         return
     else:
-        ldaqFilename1 = sys.argv[1]
-        ldaqFilename2 = sys.argv[2]
+        ldaqFilename1 = args[0]
+        ldaqFilename2 = args[1]
+
+    if len(args) > 2:
+        maxFiles = int(args[2])
+
+    if runMode:
+        heading('Welcome to Local DAQ run comparison tool')
+        compareRuns(getAllLocalDaqRawFiles(ldaqFilename1, maxFiles), getAllLocalDaqRawFiles(ldaqFilename2, maxFiles), dumpMismatches)
+        return
 
     heading('Welcome to Local DAQ raw file comparison tool')
 
-    ldaqFile1 = open(ldaqFilename1, 'rb')
-    ldaqFile2 = open(ldaqFilename2, 'rb')
+    ldaqFile1 = openRawFile(ldaqFilename1)
+    ldaqFile2 = openRawFile(ldaqFilename2)
+    ldaqReader1 = DduEventReader(ldaqFile1)
+    ldaqReader2 = DduEventReader(ldaqFile2)
 
     numEvents = 0
     while True:
-        dduWords1 = dduReadEventRaw(ldaqFile1, None)
-        dduWords2 = dduReadEventRaw(ldaqFile2, None)
+        dduWords1 = ldaqReader1.readEvent()
+        dduWords2 = ldaqReader2.readEvent()
+
+        # both files ended
+        if dduWords1.size == 0 and dduWords2.size == 0:
+            break
 
         # check event size first
         if (len(dduWords1) != len(dduWords2)):
             printRed("Length mismatch in event #%d (length1 = %d bytes, length2 = %d bytes)" % (numEvents, len(dduWords1) * 8, len(dduWords2) * 8))
-            dumpEvents(dduWords1, dduWords2)
+            dumpEventsNumpy(dduWords1, dduWords2, False)
+            ldaqFile1.close()
+            ldaqFile2.close()
+            return
+        elif not np.array_equal(dduWords1, dduWords2):
+            printRed("Mismatch in event #%d" % numEvents)
+            dumpEventsNumpy(dduWords1, dduWords2, False)
             ldaqFile1.close()
             ldaqFile2.close()
             return
-        else:
-            for i in range(0, len(dduWords1)):
-                if dduWords1[i] != dduWords2[i]:
-                    printRed("Mismatch in event #%d" % numEvents)
-                    dumpEvents(dduWords1, dduWords2)
-                    ldaqFile1.close()
-                    ldaqFile2.close()
-                    return
 
         printCyan("Event #%d matches (length = %d bytes)" % (numEvents, len(dduWords1) * 8))
 
@@ -50,5 +93,129 @@ def main():
     ldaqFile1.close()
     ldaqFile2.close()
 
+# the events of all the files of a run, read in chunks (see readEventChunks)
+# the chunk contents are only valid until the next chunk is fetched
+class RunEventStream(object):
+
+    def __init__(self, files, chunkWords = RUN_COMPARE_CHUNK_WORDS):
+        self.chunks = self.readChunks(files, chunkWords)
+        self.raw = None
+        self.starts = np.zeros(0, dtype=np.int64) # event start offsets in the current chunk
+        self.ends = self.starts                   # event end offsets in the current chunk
+        self.idx = 0                              # index of the next event in the current chunk
+        self.eventNum = 0                         # event number of the next event, counted from the start of the first file
+        self.numWords = 0                         # number of words in the events taken so far
+        self.numTruncated = 0                     # number of files with words after their last EOE (each such tail is an event of its own)
+        self.numTruncatedWords = 0
+
+    def readChunks(self, files, chunkWords):
+        for filename in files:
+            for pos, raw, eoes in readEventChunks(filename, chunkWords):
+                ends = np.minimum(eoes + 3, raw.size)
+                # only the last chunk of a file can have words after the last EOE (a truncated event or junk), they're compared as one more event
+                if ends.size == 0 or ends[-1] < raw.size:
+                    self.numTruncated += 1
+                    self.numTruncatedWords += raw.size - (ends[-1] if ends.size > 0 else 0)
+                    ends = np.append(ends, raw.size)
+                yield raw, np.concatenate(([0], ends[:-1])), ends
+
+    def remaining(self):
+        return self.starts.size - self.idx
+
+    # fetches the next chunk if there are no more events in the current one, returns False if the end of the run was reached
+    def fetch(self):
+        while self.remaining() == 0:
+            try:
+                self.raw, self.starts, self.ends = next(self.chunks)
+                self.idx = 0
+            except StopIteration:
+                return False
+        return True
+
+    # returns the start and end offsets of the next num events of the current chunk
+    def take(self, num):
+        starts = self.starts[self.idx:self.idx + num]
+        ends = self.ends[self.idx:self.idx + num]
+        self.idx += num
+        self.eventNum += num
+        self.numWords += int((ends - starts).sum())
+        return starts, ends
+
+# compares two runs event by event (the events are matched by their position in the runs)
+# the events of both runs are taken in batches as big as the current chunks allow: the whole batch is compared as a single buffer first, and only if it's different,
+# the events are compared with diffWordRanges, which gives the mismatching word count and the first mismatching word of each event at once
+def compareRuns(files1, files2, dumpMismatches):
+    printCyan("Run 1: %s" % ", ".join(files1))
+    printCyan("Run 2: %s" % ", ".join(files2))
+    t0 = time.time()
+
+    run1 = RunEventStream(files1)
+    run2 = RunEventStream(files2)
+    mismatches = [] # EVENT_MISMATCH_DTYPE tables
+    dumps = []      # [event number, words 1, words 2] of the first dumpMismatches mismatching events
+    while run1.fetch() and run2.fetch():
+        num = min(run1.remaining(), run2.remaining())
+        firstEventNum = run1.eventNum
+        starts1, ends1 = run1.take(num)
+        starts2, ends2 = run2.take(num)
+        sizes1 = ends1 - starts1
+        sizes2 = ends2 - starts2
+        if np.array_equal(sizes1, sizes2) and run1.raw[starts1[0]:ends1[-1]].tobytes() == run2.raw[starts2[0]:ends2[-1]].tobytes():
+            continue
+
+        diffs = diffWordRanges(run1.raw, starts1, sizes1, run2.raw, starts2, sizes2)
+        bad = np.flatnonzero((sizes1 != sizes2) | (diffs['numMismatches'] > 0))
+        batchMismatches = np.zeros(bad.size, dtype=EVENT_MISMATCH_DTYPE)
+        batchMismatches['eventNum'] = firstEventNum + bad
+        batchMismatches['l1Id1'] = (run1.raw[starts1[bad]] >> np.uint64(32)) & np.uint64(0xffffff)
+        batchMismatches['l1Id2'] = (run2.raw[starts2[bad]] >> np.uint64(32)) & np.uint64(0xffffff)
+        for field in ['size1', 'size2', 'firstMismatch64', 'numMismatches']:
+            batchMismatches[field] = diffs[field][bad]
+        mismatches.append(batchMismatches)
+
+        # the chunks get overwritten when the next ones are read, so copy the events that will be dumped
+        for i in bad[:max(dumpMismatches - len(dumps), 0)]:
+            dumps.append([firstEventNum + i, run1.raw[starts1[i]:ends1[i]].copy(), run2.raw[starts2[i]:ends2[i]].copy()])
+
+    numEvents = run1.eventNum
+    extraEvents1 = 0
+    extraEvents2 = 0
+    while run1.fetch():
+        extraEvents1 += run1.remaining()
+        run1.take(run1.remaining())
+    while run2.fetch():
+        extraEvents2 += run2.remaining()
+        run2.take(run2.remaining())
+    elapsed = time.time() - t0
+
+    mismatches = np.concatenate([np.zeros(0, dtype=EVENT_MISMATCH_DTYPE)] + mismatches)
+    lengthMismatches = mismatches[mismatches['size1'] != mismatches['size2']]
+
+    for eventNum, words1, words2 in dumps:
+        printRed("Mismatch in event #%d (length1 = %d bytes, length2 = %d bytes)" % (eventNum, words1.size * 8, words2.size * 8))
+        dumpEventsNumpy(words1, words2, False)
+
+    heading("Summary")
+    print("Events compared: %d" % numEvents)
+    print("Data read: run 1 = %d bytes, run 2 = %d bytes, in %.1fs (%.1f MB/s)" % (run1.numWords * 8, run2.numWords * 8, elapsed, (run1.numWords + run2.numWords) * 8 / 1024.0 / 1024.0 / max(elapsed, 1e-9)))
+    print("Matching events: %d" % (numEvents - mismatches.size))
+    print("Mismatching events: %d (%d with a length mismatch, %d with the same length but different contents)" % (mismatches.size, lengthMismatches.size, mismatches.size - lengthMismatches.size))
+    if extraEvents1 > 0 or extraEvents2 > 0:
+        printRed("Events without a counterpart: run 1 = %d, run 2 = %d" % (extraEvents1, extraEvents2))
+    if run1.numTruncated > 0 or run2.numTruncated > 0:
+        printRed("Truncated events (words after the last EOE of a file): run 1 = %d (%d words), run 2 = %d (%d words)" % (run1.numTruncated, run1.numTruncatedWords, run2.numTruncated, run2.numTruncatedWords))
+
+    if mismatches.size > 0:
+        printRed("Mismatching events:")
+        for m in mismatches[:MAX_LISTED_MISMATCHES]:
+            printRed("      Event #%d (L1A ID %d / %d): length1 = %d words, length2 = %d words, %d mismatching words, first one at word %d" % (m['eventNum'], m['l1Id1'], m['l1Id2'], m['size1'], m['size2'], m['numMismatches'], m['firstMismatch64']))
+        if mismatches.size > MAX_LISTED_MISMATCHES:
+            printRed("      ... and %d more" % (mismatches.size - MAX_LISTED_MISMATCHES))
+    elif extraEvents1 == 0 and extraEvents2 == 0:
+        if run1.numTruncated > 0:
+            printCyan("The runs match (including the truncated events)")
+        else:
+            printCyan("The runs match")
+
 if __name__ == '__main__':
     main()
@@ -5,28 +5,46 @@ import sys
 import os
 import struct
 import numpy as np
+import io
 from time import *
 
-def main():
+FIX_CHUNK_WORDS = 8 * 1024 * 1024 # 16MB read buffer (in 16bit words), the buffer is only grown if the header after a broken boundary can't be found in it
+FIX_TAIL_WORDS = 64 # trailers closer than this to the end of the buffer are checked with the next chunk, so that all the words needed for the checks and the dump are there
+DEFAULT_JUNK_OFFSET = 2 # the junk words end this many 16bit words before the found header, it's 3 for data taken with the v1.2.16 firmware (see local_daq_fix_fed_boundaries_v1_2_16.py)
+
+def main(junkOffset = DEFAULT_JUNK_OFFSET):
 
     ldaqFilename = ""
     maxFiles = None
-
-    if len(sys.argv) < 2:
+    chunkWords = FIX_CHUNK_WORDS
+
+    args = sys.argv[1:]
+    if '--junk-offset' in args:
+        i = args.index('--junk-offset')
+        junkOffset = int(args[i + 1])
+        del args[i:i + 2]
+    if '--chunk-mb' in args:
+        i = args.index('--chunk-mb')
+        chunkWords = int(args[i + 1]) * 1024 * 1024 // 2
+        del args[i:i + 2]
+
+    if len(args) < 1:
         print('This utility is meant to fix local daq raw files which contain junk in between consecutive FED blocks (any data between FED trailer and FED header)')
         print('It will output fixed data on a file that has the same name appended with _fixed')
         print('Early versions of the CSC FED upgrade firmware contained a bug in the spy driver, which in rare occasions resulted in a few junk words in between consecutive events')
         print('The bug has already been fixed, but this script was written to fix the data that had already been collected while the bug was there')
         print('')
-        print('Usage: local_fix_fed_block_boundaries.py <local_daq_data_file_pattern> [max_num_files_match]')
+        print('Usage: local_fix_fed_block_boundaries.py <local_daq_data_file_pattern> [max_num_files_match] [--junk-offset N] [--chunk-mb N]')
         print('file patterns can be exact filenames or have a * indicating a wildcard, but only for the part number (last number in the local daq filename)')
         print('if a wildcard is used, you can optionally provide a max number of files to match to (default is no limit)')
+        print('--junk-offset N: the junk words end N 16bit words before the FED header that is found after them (default is %d, use 3 for data taken with the v1.2.16 firmware)' % junkOffset)
+        print('--chunk-mb N: the files are read and written in chunks of N MB (default is %d)' % (FIX_CHUNK_WORDS * 2 // (1024 * 1024)))
         return
     else:
-        ldaqFilename = sys.argv[1]
+        ldaqFilename = args[0]
 
-    if len(sys.argv) > 2:
-        maxFiles = int(sys.argv[2])
+    if len(args) > 1:
+        maxFiles = int(args[1])
 
     heading('Welcome to Local DAQ raw file FED block boundary fixer')
 
@@ -35,85 +53,174 @@ def main():
     for fname in files:
         print("    %s" % fname)
 
-    errors = 0
-    wordsSkipped = 0
-    minWordsSkipped = 9999999
-    maxWordsSkipped = 0
-    trailersChecked = 0
-    wordsToDelete = []
+    stats = FixStats()
     for fname in files:
         print("Reading file %s" % fname)
-        f = open(fname, 'rb')
-        words = np.fromfile(f, dtype=np.dtype('u2'))
-        f.close()
-
-        print("Done reading %d words" % words.size)
-
-        ffffIdxs = np.where(words == 0xffff)[0]
-        print("Number of 0xffff occurances: %d" % ffffIdxs.size)
-        for i in ffffIdxs:
-            if words[i+1] == 0x8000 and words[i] == 0xffff and words[i-1] == 0x8000 and words[i-2] == 0x8000:
-                trailersChecked += 1
-                if trailersChecked % 100000 == 0:
-                    print("Checking trailer %d, word %d out of %d" % (trailersChecked, i, words.size))
-                # if this is not the last event, then check if the header of the next event is where it should be (also check if the trailer of the current event ends as it should)
-                if words.size > i + 21:
-                    # looks like a screwed up trailer, lets just abort here
-                    if words[i+9] & 0xf000 != 0xa000:
-                        printRed("Corrupted FED trailer! Found the 8000 ffff 8000 8000 word, but the last trailer word does not start with 0xa!")
-                        printRed("Index of the top 16 bit word in the 8000 ffff 8000 8000 marker: %d" % i)
-                        return
-                    # okay, this is our case of missing header from the next event
-                    if words[i+13] & 0xf000 != 0x5000 or words[i+15] != 0x8000 or words[i+16] != 0x0001 or words[i+17] != 0x8000:
-                        printRed("Error detected in event #%d, word #%d" % (trailersChecked, i))
-                        printRed("Below is a dump of this occurance, starting at the trailer:")
-                        printWords16(words[i-2:i+62])
-                        errors += 1
-
-                        # search for the header
-                        printRed("Searching for the header")
-                        for j in xrange(i, words.size):
-                            if words[j] & 0xf000 == 0x5000 and words[j+2] == 0x8000 and words[j+3] == 0x0001 and words[j+4] == 0x8000:
-                                numJunkWords = j - (i + 13)
-                                if numJunkWords < 0:
-                                    printRed("ERROR: number of junk words is negative: %d" % numJunkWords)
-                                    return
-                                printRed("Found the header after %d junk words:" % numJunkWords)
-                                s = ""
-                                for jj in range(j-2-numJunkWords,j-2):
-                                    s += hexPadded(words[jj], 2) + " "
-                                    wordsToDelete.append(jj)
-                                    if jj != j-2-numJunkWords and words[jj] != 0xffff:
-                                        printRed("ERROR: The found junk word does not equal to 0xffff, which is expected: %s. Aborting." % hexPadded(words[jj], 2))
-                                        return
-                                printRed(s)
-                                wordsSkipped += numJunkWords
-                                if numJunkWords < minWordsSkipped:
-                                    minWordsSkipped = numJunkWords
-                                if numJunkWords > maxWordsSkipped:
-                                    maxWordsSkipped = numJunkWords
-                                break
-
-        #remove the junk words and write out the fixed file
-        fixedWords = np.delete(words, wordsToDelete)
         ofname = fname + "_fixed"
+        if not fixFile(fname, ofname, junkOffset, stats, chunkWords):
+            # don't leave a half fixed file behind
+            os.remove(ofname)
+            return
         print("Writing results to file %s" % ofname)
-        of = open(ofname, 'wb')
-        fixedWords.tofile(of)
-        of.close()
-
-        # for i in range(0, 10):
-        #     s = ""
-        #     for j in range(0, 4):
-        #         s += hexPadded(raw[i*4+j], 2) + " "
-        #     print s
-
-    print("Number of FED trailers checked: %d" % trailersChecked)
-    print("Total number of errors found: %d" % errors)
-    print("Total number of 16bit words skipped in the fixed file: %d" % wordsSkipped)
-    print("Minimum number of 16bit words skipped per error: %d" % minWordsSkipped)
-    print("Maximum number of 16bit words skipped per error: %d" % maxWordsSkipped)
 
+    print("Number of FED trailers checked: %d" % stats.trailersChecked)
+    print("Total number of errors found: %d" % stats.errors)
+    print("Total number of 16bit words skipped in the fixed file: %d" % stats.wordsSkipped)
+    print("Minimum number of 16bit words skipped per error: %d" % stats.minWordsSkipped)
+    print("Maximum number of 16bit words skipped per error: %d" % stats.maxWordsSkipped)
+
+class FixStats(object):
+
+    def __init__(self):
+        self.errors = 0
+        self.wordsSkipped = 0
+        self.minWordsSkipped = 9999999
+        self.maxWordsSkipped = 0
+        self.trailersChecked = 0
+
+# reads the file in chunks, and writes it out to ofname without the junk words between the FED trailers and the next FED headers
+# the checks of a chunk are done with numpy over the whole chunk (see checkChunk), and the end of a chunk that can't be checked yet is carried over to the next one
+# returns False if the file is too broken to be fixed
+def fixFile(fname, ofname, junkOffset, stats, chunkWords = FIX_CHUNK_WORDS):
+    totalWords = os.path.getsize(fname) // 2
+    buf = np.empty(chunkWords, dtype=np.dtype('u2'))
+    filled = 0      # number of words in the buffer
+    base = 0        # file offset of the first buffer word (in 16bit words)
+    start = 0       # buffer index of the first word that hasn't been checked yet
+    written = 0     # file offset up to which the fixed file has been written
+    deletions = []  # [first, last + 1] file offsets of the junk word ranges that haven't been completely skipped in the output yet
+    # the file totals are printed before the trailer checks, like when the whole file was read at once, so the 0xffff words are counted in a separate pass
+    print("Done reading %d words" % totalWords)
+    print("Number of 0xffff occurances: %d" % countFfffWords(fname, buf))
+    with io.open(fname, 'rb') as f, io.open(ofname, 'wb') as of:
+        while True:
+            filled, eof = readWords(f, buf, filled)
+            words = buf[:filled]
+            end = filled if eof else max(filled - FIX_TAIL_WORDS, start)
+            end = checkChunk(words, base, start, end, eof, totalWords, junkOffset, stats, deletions)
+            if end is None:
+                return False
+
+            # the trailers after end are checked later, and their junk words can only start after end, so everything before it can be written out
+            keep = np.ones(base + end - written, dtype=np.bool_)
+            for first, last in deletions:
+                keep[max(first - written, 0):max(min(last, base + end) - written, 0)] = False
+            words[written - base:end][keep].tofile(of)
+            written = base + end
+            deletions = [d for d in deletions if d[1] > written]
+
+            if eof:
+                break
+
+            # keep the two words before end, because they're part of the trailer marker that might be at end
+            keepFrom = max(end - 2, 0)
+            if keepFrom == 0 and filled == buf.size:
+                bigBuf = np.empty(buf.size * 2, dtype=buf.dtype)
+                bigBuf[:filled] = buf[:filled]
+                buf = bigBuf
+            buf[:filled - keepFrom] = buf[keepFrom:filled]
+            filled -= keepFrom
+            base += keepFrom
+            start = end - keepFrom
+
+    return True
+
+# returns the number of 0xffff words in the file, reading it into the given buffer
+def countFfffWords(fname, buf):
+    numFfff = 0
+    with io.open(fname, 'rb') as f:
+        eof = False
+        while not eof:
+            filled, eof = readWords(f, buf, 0)
+            numFfff += np.count_nonzero(buf[:filled] == 0xffff)
+    return numFfff
+
+# checks the FED trailers that start (the 0xffff word of the trailer marker) in words[start:end], words are the buffer contents, starting at file offset base
+# the junk word ranges that are found are added to deletions (as file offsets)
+# returns the buffer index up to which the words have been checked (this is less than end if the header after a broken boundary isn't in the buffer yet), or None if the file can't be fixed
+def checkChunk(words, base, start, end, eof, totalWords, junkOffset, stats, deletions):
+    # indexes of the 0xffff words of all the 8000 8000 ffff 8000 trailer markers, and of all the FED headers (5xxx xxxx 8000 0001 8000)
+    trailers = findFedTrailerMarkers(words)
+    trailers = trailers[(trailers >= start) & (trailers < end)]
+    headers = findFedHeaders(words)
+    isHeader = np.zeros(words.size, dtype=np.bool_)
+    isHeader[headers] = True
+
+    # if this is not the last event, then check if the header of the next event is where it should be (also check if the trailer of the current event ends as it should)
+    checked = trailers[totalWords > base + trailers + 21]
+    corrupted = checked[words[checked + 9] & 0xf000 != 0xa000]
+    # okay, this is our case of missing header from the next event
+    missingHeaders = checked[~isHeader[checked + 13]]
+    # the next header after each of the missing ones, -1 if there's none
+    nextHeaderIdxs = np.searchsorted(headers, missingHeaders)
+    nextHeaders = np.append(headers, -1)[nextHeaderIdxs]
+
+    # only the problematic trailers (and the progress report) need to be looked at one by one
+    progressIdxs = np.arange(100000 - stats.trailersChecked % 100000 - 1, trailers.size, 100000)
+    for i in np.union1d(np.union1d(corrupted, missingHeaders), trailers[progressIdxs]):
+        missingIdx = np.searchsorted(missingHeaders, i)
+        isMissing = missingIdx < missingHeaders.size and missingHeaders[missingIdx] == i
+        # the next header isn't in the buffer yet, so check this trailer again with the next chunk
+        if isMissing and nextHeaders[missingIdx] < 0 and not eof:
+            end = i
+            break
+
+        trailerNum = stats.trailersChecked + np.searchsorted(trailers, i) + 1
+        if trailerNum % 100000 == 0:
+            print("Checking trailer %d, word %d out of %d" % (trailerNum, base + i, totalWords))
+        # looks like a screwed up trailer, lets just abort here
+        if corrupted.size > 0 and i == corrupted[0]:
+            printRed("Corrupted FED trailer! Found the 8000 ffff 8000 8000 word, but the last trailer word does not start with 0xa!")
+            printRed("Index of the top 16 bit word in the 8000 ffff 8000 8000 marker: %d" % (base + i))
+            return None
+        if not isMissing:
+            continue
+
+        printRed("Error detected in event #%d, word #%d" % (trailerNum, base + i))
+        printRed("Below is a dump of this occurance, starting at the trailer:")
+        printWords16(words[i-2:i+62])
+        stats.errors += 1
+
+        # search for the header
+        printRed("Searching for the header")
+        j = nextHeaders[missingIdx]
+        if j < 0:
+            continue
+        numJunkWords = j - (i + 13)
+        if numJunkWords < 0:
+            printRed("ERROR: number of junk words is negative: %d" % numJunkWords)
+            return None
+        printRed("Found the header after %d junk words:" % numJunkWords)
+        junk = words[j-junkOffset-numJunkWords:j-junkOffset]
+        # the first junk word is taking the place of the last trailer word, the others are expected to be 0xffff
+        badJunk = np.flatnonzero(junk[1:] != 0xffff)
+        if badJunk.size > 0:
+            printRed("ERROR: The found junk word does not equal to 0xffff, which is expected: %s. Aborting." % hexPadded(junk[badJunk[0] + 1], 2))
+            return None
+        printRed("".join([hexPadded(w, 2) + " " for w in junk]))
+        deletions.append([base + j - junkOffset - numJunkWords, base + j - junkOffset])
+        stats.wordsSkipped += numJunkWords
+        if numJunkWords < stats.minWordsSkipped:
+            stats.minWordsSkipped = numJunkWords
+        if numJunkWords > stats.maxWordsSkipped:
+            stats.maxWordsSkipped = numJunkWords
+
+    stats.trailersChecked += np.count_nonzero(trailers < end)
+    return end
+
+# returns the indexes of the 0xffff words in all the 8000 8000 ffff 8000 sequences (the FED trailer marker in 16bit words)
+def findFedTrailerMarkers(words):
+    n = words.size
+    if n < 4:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero((words[2:n-1] == 0xffff) & (words[3:n] == 0x8000) & (words[1:n-2] == 0x8000) & (words[0:n-3] == 0x8000)) + 2
+
+# returns the indexes of the first words of all the 5xxx xxxx 8000 0001 8000 sequences (FED header 1 and the start of FED header 2 in 16bit words)
+def findFedHeaders(words):
+    n = words.size
+    if n < 5:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero((words[0:n-4] & 0xf000 == 0x5000) & (words[2:n-2] == 0x8000) & (words[3:n-1] == 0x0001) & (words[4:n] == 0x8000))
 
 def printWords16(words):
     for i in range(0, words.size / 4):
@@ -0,0 +1,144 @@
+from utils import *
+from data_processing_utils import *
+import sys
+import os
+import numpy as np
+
+# generates synthetic local DAQ raw files: DDU header, DMB blocks (with optional ALCT and TMB blocks and a number of CFEB blocks), the EOE word and the DDU trailer with the correct event length and CRC
+# the generated events pass all the unpacker checks, and the CFEB, ALCT and TMB data words are random (with the DDU codes masked out, so that they can't be mistaken for headers or trailers)
+
+DEFAULT_MIN_DMBS = 0
+DEFAULT_MAX_DMBS = 4
+DEFAULT_MAX_CFEBS = 5
+DEFAULT_TRIG_PROBABILITY = 0.7 # probability of a DMB having an ALCT block (and independently a TMB block)
+MAX_TRIG_HIT_WORDS = 6
+GENERATE_BATCH_EVENTS = 1000 # generateFile writes the events in batches of this many
+DDU_SOURCE_ID = 0x370
+DATA_MASK = np.uint64(0x0fff0fff0fff0fff) # random data words never have a DDU code in the top 4 bits of the 16bit words
+
+def main():
+
+    filename = ""
+    sizeMb = 0
+    seed = 1
+    minDmbs = DEFAULT_MIN_DMBS
+    maxDmbs = DEFAULT_MAX_DMBS
+    maxCfebs = DEFAULT_MAX_CFEBS
+    trigProbability = DEFAULT_TRIG_PROBABILITY
+
+    args = sys.argv[1:]
+    if '--seed' in args:
+        i = args.index('--seed')
+        seed = int(args[i + 1])
+        del args[i:i + 2]
+    if '--dmbs' in args:
+        i = args.index('--dmbs')
+        minDmbs, maxDmbs = [int(n) for n in args[i + 1].split(':')]
+        del args[i:i + 2]
+    if '--cfebs' in args:
+        i = args.index('--cfebs')
+        maxCfebs = int(args[i + 1])
+        del args[i:i + 2]
+    if '--trig-prob' in args:
+        i = args.index('--trig-prob')
+        trigProbability = float(args[i + 1])
+        del args[i:i + 2]
+
+    if len(args) < 2:
+        print('Usage: local_daq_generate.py <output_file> <size_mb> [--seed N] [--dmbs MIN:MAX] [--cfebs MAX] [--trig-prob P]')
+        print('writes synthetic events to the output file until it is at least size_mb MB large')
+        print('--seed N seeds the random generator (default is 1), the same seed and options always give the same file')
+        print('--dmbs MIN:MAX number of DMBs per event is drawn uniformly from MIN to MAX (default is %d:%d)' % (DEFAULT_MIN_DMBS, DEFAULT_MAX_DMBS))
+        print('--cfebs MAX number of CFEBs per DMB is drawn uniformly from 0 to MAX (default is %d)' % DEFAULT_MAX_CFEBS)
+        print('--trig-prob P probability of a DMB having an ALCT block, and independently a TMB block (default is %.1f)' % DEFAULT_TRIG_PROBABILITY)
+        return
+    else:
+        filename = args[0]
+        sizeMb = float(args[1])
+
+    heading('Generating a synthetic local DAQ file')
+
+    numEvents = generateFile(filename, sizeMb, seed, minDmbs, maxDmbs, maxCfebs, trigProbability)
+    printCyan("Wrote %d events (%d bytes) to %s" % (numEvents, os.path.getsize(filename), filename))
+
+# returns random data words with the DDU codes masked out
+def randomDataWords(rnd, num):
+    return rnd.randint(0, np.iinfo(np.int64).max, size=num, dtype=np.int64).astype(np.uint64) & DATA_MASK
+
+# returns an ALCT or TMB block (header word, random hit words, trailer word)
+def generateTrigBlock(rnd, headerMarker, trailerMarker, l1Id, bxId):
+    words = np.empty(rnd.randint(1, MAX_TRIG_HIT_WORDS + 1) + 2, dtype=np.uint64)
+    words[0] = 0xd000d000d000d000 | ((l1Id & 0xfff) << 32) | ((bxId & 0xfff) << 16) | headerMarker
+    words[1:-1] = randomDataWords(rnd, words.size - 2)
+    words[-1] = 0xd000d000d000d000 | trailerMarker
+    return words
+
+# returns a DMB block: 2 DMB header words, optional ALCT and TMB blocks, numCfebs CFEB blocks and 2 DMB trailer words
+def generateDmbBlock(rnd, l1Id, bxId, crateId, dmbId, numCfebs, alct, tmb):
+    parts = [np.array([(0x9 << 60) | ((bxId & 0xfff) << 48) | (0x9 << 44) | (0x9 << 28) | (((l1Id >> 12) & 0xfff) << 16) | (0x9 << 12) | (l1Id & 0xfff),
+                       0xa000a000a000a000 | (crateId << 20) | (dmbId << 16)], dtype=np.uint64)]
+    if alct:
+        parts.append(generateTrigBlock(rnd, ALCT_HEADER_MARKER, ALCT_TRAILER_MARKER, l1Id, bxId))
+    if tmb:
+        parts.append(generateTrigBlock(rnd, TMB_HEADER_MARKER, TMB_TRAILER_MARKER, l1Id, bxId))
+    if numCfebs > 0:
+        # one row per time sample, the last word of each sample is the trailer: 0x7fff, sample number and L1A ID, CRC, 0x7fff (from the lowest 16bit word up)
+        cfebs = randomDataWords(rnd, numCfebs * CFEB_BLOCK_WORDS).reshape(numCfebs * CFEB_NUM_SAMPLES, CFEB_SAMPLE_WORDS16 // 4)
+        sampleNums = np.tile(np.arange(CFEB_NUM_SAMPLES, dtype=np.uint64), numCfebs)
+        crcs = rnd.randint(0, 0x10000, size=cfebs.shape[0]).astype(np.uint64)
+        cfebs[:, -1] = np.uint64(0x7fff000000007fff) | (np.uint64(l1Id & 0x3f) << np.uint64(38)) | (sampleNums << np.uint64(32)) | (crcs << np.uint64(16))
+        parts.append(cfebs.ravel())
+    parts.append(np.array([0xf000f000f000f000 | (l1Id & 0xfff), 0xe000e000e000e000], dtype=np.uint64))
+    return np.concatenate(parts)
+
+# generates numEvents events starting with the given L1A ID, returns the raw u8 array and the end offsets of the events (in 64bit words)
+# the number of DMBs of each event is uniform from minDmbs to maxDmbs, and the number of CFEBs of each DMB is uniform from 0 to maxCfebs
+def generateEvents(rnd, numEvents, firstL1Id = 1, minDmbs = DEFAULT_MIN_DMBS, maxDmbs = DEFAULT_MAX_DMBS, maxCfebs = DEFAULT_MAX_CFEBS, trigProbability = DEFAULT_TRIG_PROBABILITY):
+    parts = []
+    ends = np.zeros(numEvents, dtype=np.int64)
+    size = 0
+    for i in range(numEvents):
+        l1Id = (firstL1Id + i) & 0xffffff
+        bxId = rnd.randint(0, 3564)
+        numDmbs = rnd.randint(minDmbs, maxDmbs + 1)
+        davInputs = 0
+        eventParts = [None]
+        for d in range(numDmbs):
+            dmbId = rnd.randint(1, 11)
+            davInputs |= 1 << (dmbId - 1)
+            eventParts.append(generateDmbBlock(rnd, l1Id, bxId, rnd.randint(1, 13), dmbId, rnd.randint(0, maxCfebs + 1), rnd.random_sample() < trigProbability, rnd.random_sample() < trigProbability))
+        eventSize = 3 + sum([p.size for p in eventParts[1:]]) + 3
+        eventParts[0] = np.array([(0x50 << 56) | (l1Id << 32) | (bxId << 20) | (DDU_SOURCE_ID << 8),
+                                  0x8000000180000000 | rnd.randint(0, 0x8000),
+                                  (davInputs << 48) | (davInputs << 16) | min(numDmbs, 0xf)], dtype=np.uint64)
+        # the CRC is filled in below, once the whole batch is in one array
+        eventParts.append(np.array([EOE_MARKER, 0, (0xa << 60) | (eventSize << 32)], dtype=np.uint64))
+        parts.extend(eventParts)
+        size += eventSize
+        ends[i] = size
+
+    raw = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=np.uint64)
+    events = np.zeros(numEvents, dtype=FED_EVENT_DTYPE)
+    events['end'] = ends
+    events['start'][1:] = ends[:-1]
+    raw[ends - 1] |= computeFedCrcs(raw, events).astype(np.uint64) << np.uint64(16)
+    return raw, ends
+
+# writes synthetic events to filename until the file is at least sizeMb MB large, the same seed always gives the same file
+# returns the number of events written
+def generateFile(filename, sizeMb, seed = 1, minDmbs = DEFAULT_MIN_DMBS, maxDmbs = DEFAULT_MAX_DMBS, maxCfebs = DEFAULT_MAX_CFEBS, trigProbability = DEFAULT_TRIG_PROBABILITY):
+    rnd = np.random.RandomState(seed)
+    numEvents = 0
+    size = 0
+    with open(filename, 'wb') as f:
+        while size < sizeMb * 1024 * 1024:
+            raw, ends = generateEvents(rnd, GENERATE_BATCH_EVENTS, numEvents + 1, minDmbs, maxDmbs, maxCfebs, trigProbability)
+            # only write as many events as needed to reach the requested size
+            num = min(int(np.searchsorted(ends * 8, sizeMb * 1024 * 1024 - size)) + 1, ends.size)
+            raw[:ends[num - 1]].tofile(f)
+            size += ends[num - 1] * 8
+            numEvents += num
+    return numEvents
+
+if __name__ == '__main__':
+    main()
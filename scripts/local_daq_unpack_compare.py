@@ -10,94 +10,67 @@ from time import *
 IGNORE_DMBS = [[1, 1], [12, 1]]  # these DMBs will get ignored
 MAX_LOOKAHEAD = 150000 # how many future events should be searched for a match
 EXIT_ON_FIRST_ERROR = False
+DIFF_BATCH_DMBS = 20000 # how many matched DMB block pairs are compared in one go
+DEFAULT_DUMP_SAMPLES = 10 # how many mismatching DMB block pairs are dumped
 
 def main():
 
     ldaqFilename1 = ""
     ldaqFilename2 = ""
     maxFiles = None
+    dumpSamples = DEFAULT_DUMP_SAMPLES
 
-    if len(sys.argv) < 3:
-        print('Usage: local_daq_unpack_compare.py <local_daq_data_file_pattern_1> <local_daq_data_file_pattern_2> [max_num_files_match]')
+    args = sys.argv[1:]
+    if '--dump-samples' in args:
+        i = args.index('--dump-samples')
+        dumpSamples = int(args[i + 1])
+        del args[i:i + 2]
+
+    if len(args) < 2:
+        print('Usage: local_daq_unpack_compare.py <local_daq_data_file_pattern_1> <local_daq_data_file_pattern_2> [max_num_files_match] [--dump-samples N]')
         print('file patterns can be exact filenames or have a * indicating a wildcard, but only for the part number (last number in the local daq filename)')
         print('if a wildcard is used, you can optionally provide a max number of files to match to (default is no limit)')
+        print('--dump-samples N dumps the first N mismatching DMB block pairs (default is %d), all of them are still listed in the errors' % DEFAULT_DUMP_SAMPLES)
         return
     else:
-        ldaqFilename1 = sys.argv[1]
-        ldaqFilename2 = sys.argv[2]
+        ldaqFilename1 = args[0]
+        ldaqFilename2 = args[1]
 
-    if len(sys.argv) > 3:
-        maxFiles = int(sys.argv[3])
+    if len(args) > 2:
+        maxFiles = int(args[2])
 
     heading('Welcome to Local DAQ raw file unpacking and comparison tool')
 
     files1 = getAllLocalDaqRawFiles(ldaqFilename1, maxFiles)
     files2 = getAllLocalDaqRawFiles(ldaqFilename2, maxFiles)
 
-    events1 = []
-    events2 = []
-    fileIdx1 = -1
-    fileIdx2 = -1
-    idx1 = -1
-    idx2 = -1
-    ids1 = []
-    ids2 = []
-    id1 = -1
-    id2 = -1
-    lastFile1 = False
-    lastFile2 = False
-
-    skippedEvents1 = 0
-    skippedEvents2 = 0
+    stream1 = EventStream(files1)
+    stream2 = EventStream(files2)
+
     mismatchedDmbBlocks = 0
     errors = []
     dmbNumberMismatches = 0
     eventsChecked = 0
+    pendingDmbs = [] # matched DMB block pairs waiting to be compared: [event number, DMB 1, DMB 2]
 
     while True:
-        idx1 += 1
-        idx2 += 1
+        stream1.pos += 1
+        stream2.pos += 1
 
         # if we're at the end of the last file, then quit
-        if (lastFile1 and idx1 >= len(events1)) or (lastFile2 and idx2 >= len(events2)):
+        if stream1.isDone() or stream2.isDone():
             print("DONE")
             break
 
         # read the next file if we're getting close to the end
-        if not lastFile1 and (idx1 + MAX_LOOKAHEAD >= len(events1)):
-            fileIdx1 += 1
-            if fileIdx1 + 1 >= len(files1):
-                lastFile1 = True
-            del events1[:idx1]
-            del ids1[:idx1]
-            newEvents = unpackFile(files1[fileIdx1], True, IGNORE_DMBS)
-            events1 += newEvents
-            newIds = getIds(newEvents)
-            ids1 += newIds
-            idx1 = 0
-
-        if not lastFile2 and (idx2 + MAX_LOOKAHEAD >= len(events2)):
-            fileIdx2 += 1
-            if fileIdx2 + 1 >= len(files2):
-                lastFile2 = True
-            del events2[:idx2]
-            del ids2[:idx2]
-            newEvents = unpackFile(files2[fileIdx2], True, IGNORE_DMBS)
-            events2 += newEvents
-            newIds = getIds(newEvents)
-            ids2 += newIds
-            idx2 = 0
-
-
-        # zz = len(ids1)
-        # if zz > len(ids2):
-        #     zz = len(ids2)
-        # for i in range(0, zz):
-        #     print("L1A IDS: %d %d ||| BX IDs: %d %d" % (ids1[i] >> 12, ids2[i] >> 12, ids1[i] & 0xfff, ids2[i] & 0xfff))
-        # return
-
-        evt1 = events1[idx1]
-        evt2 = events2[idx2]
+        if stream1.needsMoreEvents():
+            stream1.loadNextFile()
+
+        if stream2.needsMoreEvents():
+            stream2.loadNextFile()
+
+        evt1 = stream1.getEvent()
+        evt2 = stream2.getEvent()
 
         id1 = (evt1.l1Id << 12) + evt1.bxId
         id2 = (evt2.l1Id << 12) + evt2.bxId
@@ -105,81 +78,71 @@ def main():
         matchingIdFound = True
         # if L1 IDs don't match, it means that local DAQ has skipped some events on one of the RUIs, so look ahead in both files to see where we can find the match
         if id1 != id2:
-            matchIdx1 = None
-            matchIdx2 = None
-            if id1 in ids2[idx2:]:
-                matchIdx2 = ids2[idx2:].index(id1)
-            if id2 in ids1[idx1:]:
-                matchIdx1 = ids1[idx1:].index(id2)
-
-            if matchIdx1 is not None and matchIdx2 is not None:
-                if matchIdx1 - idx1 < matchIdx2 - idx2:
-                    idx1 += matchIdx1
-                    skippedEvents1 += matchIdx1
+            matchPos1 = stream1.find(id2)
+            matchPos2 = stream2.find(id1)
+
+            if matchPos1 is not None and matchPos2 is not None:
+                # the match offsets are compared relative to the current positions within the loaded events (like the original list based version did), so that the results don't change
+                if (matchPos1 - stream1.pos) - stream1.getLoadedIdx() < (matchPos2 - stream2.pos) - stream2.getLoadedIdx():
+                    stream1.skipTo(matchPos1)
                 else:
-                    idx2 += matchIdx2
-                    skippedEvents2 += matchIdx2
-            elif matchIdx1 is not None:
-                idx1 += matchIdx1
-                skippedEvents1 += matchIdx1
-            elif matchIdx2 is not None:
-                idx2 += matchIdx2
-                skippedEvents2 += matchIdx2
+                    stream2.skipTo(matchPos2)
+            elif matchPos1 is not None:
+                stream1.skipTo(matchPos1)
+            elif matchPos2 is not None:
+                stream2.skipTo(matchPos2)
             else:
                 matchingIdFound = False
-                skippedEvents1 += 1
-                skippedEvents2 += 1
+                stream1.markSkipped(stream1.pos, 1)
+                stream2.markSkipped(stream2.pos, 1)
 
         if matchingIdFound:
             eventsChecked += 1
-            evt1 = events1[idx1]
-            evt2 = events2[idx2]
+            evt1 = stream1.getEvent()
+            evt2 = stream2.getEvent()
             if (evt1.l1Id != evt2.l1Id or evt1.bxId != evt2.bxId):
                 printRed("Script error: after matching IDs were found, they still seem to be different hmmm. L1ID1 = %d, L1ID2 = %d, BXID1 = %d, BXID2 = %d" % (evt1.l1Id, evt2.l1Id, evt1.bxId, evt2.bxId))
                 return
 
-            print("Checking event %d, L1 ID = %d, BX ID = %d. Num skipped events in file1 = %d, file2 = %d" % (eventsChecked, evt1.l1Id, evt1.bxId, skippedEvents1, skippedEvents2))
+            print("Checking event %d, L1 ID = %d, BX ID = %d. Num skipped events in file1 = %d, file2 = %d" % (eventsChecked, evt1.l1Id, evt1.bxId, stream1.skippedEvents, stream2.skippedEvents))
 
             if len(evt1.dmbs) != len(evt2.dmbs):
                 err = "Event #%d: The number of DMBs don't match. Expected %d, but found %d in file 2" % (eventsChecked, len(evt1.dmbs), len(evt2.dmbs))
                 printRed(err)
-                errors.append(err)
+                errors.append([eventsChecked, err])
                 dmbNumberMismatches += 1
                 if EXIT_ON_FIRST_ERROR:
                     return
             else:
                 for i in range(0, len(evt1.dmbs)):
-                    smallerSize = evt1.dmbs[i].words.size
-                    if evt2.dmbs[i].words.size < smallerSize:
-                        smallerSize = evt2.dmbs[i].words.size
-                    mismatches = (evt1.dmbs[i].words[0:smallerSize] != evt2.dmbs[i].words[0:smallerSize])
-                    if ((evt1.dmbs[i].words.size != evt2.dmbs[i].words.size) or mismatches.any()):
-                        printRed("DMB words don't match")
-                        dumpEventsNumpy(evt1.dmbs[i].words, evt2.dmbs[i].words)
-                        if EXIT_ON_FIRST_ERROR:
-                            return
-                        mismatchedDmbBlocks += 1
-                        firstMismatchStr = "none"
-                        if mismatches.any():
-                            firstMismatch64Idx = np.where(mismatches == True)[0][0]
-                            firstMismatch64_1 = int(evt1.dmbs[i].words[firstMismatch64Idx])
-                            firstMismatch64_2 = int(evt2.dmbs[i].words[firstMismatch64Idx])
-                            for j in range(0, 4):
-                                word16_1 = (firstMismatch64_1 >> (16 * j)) & 0xffff
-                                word16_2 = (firstMismatch64_2 >> (16 * j)) & 0xffff
-                                if word16_1 != word16_2:
-                                    firstMismatchStr = hexPadded(word16_1, 2, True) + " ---- " + hexPadded(word16_2, 2, True)
-                                    break
-                        errors.append("Event #%d: Crate %d DMB %d, first mismatched word = %s" % (eventsChecked, evt1.dmbs[i].crateId, evt1.dmbs[i].dmbId, firstMismatchStr))
+                    pendingDmbs.append([eventsChecked, evt1.dmbs[i], evt2.dmbs[i]])
+
+            # the DMB blocks are compared in batches (always right away if we exit on the first error)
+            if len(pendingDmbs) >= DIFF_BATCH_DMBS or (EXIT_ON_FIRST_ERROR and len(pendingDmbs) > 0):
+                numMismatched = diffPendingDmbs(pendingDmbs, errors, dumpSamples)
+                pendingDmbs = []
+                mismatchedDmbBlocks += numMismatched
+                dumpSamples -= min(numMismatched, dumpSamples)
+                if EXIT_ON_FIRST_ERROR and numMismatched > 0:
+                    return
+
+    mismatchedDmbBlocks += diffPendingDmbs(pendingDmbs, errors, dumpSamples)
+    # DMB number mismatches are reported right away, but the DMB block mismatches only when their batch is compared, so sort them by event number
+    errors.sort(key=lambda error: error[0])
 
     print("Total number of events checked: %d" % eventsChecked)
-    print("Total number of events skipped due to syncing on file1 = %d, file2 = %d" % (skippedEvents1, skippedEvents2))
+    print("Total number of events skipped due to syncing on file1 = %d, file2 = %d" % (stream1.skippedEvents, stream2.skippedEvents))
+    for name, stream in [["file1", stream1], ["file2", stream2]]:
+        if len(stream.skippedRanges) > 0:
+            print("Skipped event ranges on %s (event numbers counted from the start of the first file):" % name)
+            for first, last in stream.skippedRanges:
+                print("      #%d - #%d (%d events)" % (first, last, last - first + 1))
     print("Total number of events where the number of DMBs didn't match: %d" % dmbNumberMismatches)
     print("Total number of DMB blocks with size or data mismatches: %d" % mismatchedDmbBlocks)
     if (len(errors) > 0):
         printRed("Errors found:")
         for error in errors:
-            printRed("      %s" % error)
+            printRed("      %s" % error[1])
 
 
 
@@ -287,14 +250,99 @@ def main():
     print("Comparing the data took %f" % (t2 - t1))
     print("Total time spent = %f" % (tt2 - tt1))
 
-# this function returns a list of event IDs where the lowest 12 bits are BX, and the top bits are L1A ID
+# compares the given DMB block pairs ([event number, DMB 1, DMB 2]) with diffDmbBlocks, adds an error for each mismatching pair, and dumps the first maxDumps of them
+# returns the number of mismatching pairs
+def diffPendingDmbs(pendingDmbs, errors, maxDumps):
+    diffs = diffDmbBlocks([p[1].words for p in pendingDmbs], [p[2].words for p in pendingDmbs])
+    mismatched = np.nonzero((diffs['size1'] != diffs['size2']) | (diffs['numMismatches'] > 0))[0]
+    for i in mismatched:
+        eventNum, dmb1, dmb2 = pendingDmbs[i]
+        diff = diffs[i]
+        firstMismatchStr = "none"
+        if diff['numMismatches'] > 0:
+            firstMismatchStr = "%s ---- %s (64bit word %d, 16bit word %d, %d mismatched 64bit words)" % (hexPadded(int(diff['value1']), 2, True), hexPadded(int(diff['value2']), 2, True), diff['firstMismatch64'], diff['firstMismatch16'], diff['numMismatches'])
+        if diff['size1'] != diff['size2']:
+            firstMismatchStr += ", sizes = %d and %d" % (diff['size1'], diff['size2'])
+        errors.append([eventNum, "Event #%d: Crate %d DMB %d, first mismatched word = %s" % (eventNum, dmb1.crateId, dmb1.dmbId, firstMismatchStr)])
+        if maxDumps > 0:
+            printRed("DMB words don't match (event #%d, crate %d, DMB %d)" % (eventNum, dmb1.crateId, dmb1.dmbId))
+            dumpEventsNumpy(dmb1.words, dmb2.words)
+            maxDumps -= 1
+
+    return mismatched.size
+
+# this function returns an array of event IDs where the lowest 12 bits are BX, and the top bits are L1A ID
 def getIds(events):
-    ret = []
-    for event in events:
-        id = event.l1Id << 12
-        id += event.bxId
-        ret.append(id)
+    ret = np.zeros(len(events), dtype=np.int64)
+    for i in range(len(events)):
+        ret[i] = (events[i].l1Id << 12) + events[i].bxId
     return ret
 
+# one side of the comparison: the events of a list of local DAQ files, which are loaded one file at a time when the lookahead gets close to the end of the loaded events
+# event positions are global event numbers counted from the start of the first file, and a sorted index of the event IDs is kept for the loaded events,
+# so that finding the next event with a given ID is a binary search instead of a scan over the whole lookahead
+class EventStream(object):
+
+    def __init__(self, files):
+        self.files = files
+        self.fileIdx = -1
+        self.lastFile = False
+        self.events = []     # loaded events, the first one is at position self.base
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.sortedIds = self.ids
+        self.idOrder = self.ids # indexes into self.events that sort the IDs (stable, so events with the same ID stay in order)
+        self.base = 0
+        self.pos = -1        # position of the current event
+        self.skippedEvents = 0
+        self.skippedRanges = [] # [first, last] positions of the skipped event ranges
+
+    def isDone(self):
+        return self.lastFile and self.pos >= self.base + len(self.events)
+
+    def needsMoreEvents(self):
+        return not self.lastFile and self.pos + MAX_LOOKAHEAD >= self.base + len(self.events)
+
+    # drops the events before the current one, and loads the next file
+    def loadNextFile(self):
+        self.fileIdx += 1
+        if self.fileIdx + 1 >= len(self.files):
+            self.lastFile = True
+        del self.events[:self.pos - self.base]
+        self.ids = self.ids[self.pos - self.base:]
+        self.base = self.pos
+        newEvents = unpackFile(self.files[self.fileIdx], True, IGNORE_DMBS)
+        self.events += newEvents
+        self.ids = np.concatenate((self.ids, getIds(newEvents)))
+        self.idOrder = np.argsort(self.ids, kind='mergesort')
+        self.sortedIds = self.ids[self.idOrder]
+
+    # index of the current event within the loaded events
+    def getLoadedIdx(self):
+        return self.pos - self.base
+
+    def getEvent(self):
+        return self.events[self.pos - self.base]
+
+    # returns the position of the first loaded event at or after the current one with the given ID, or None if there's no such event
+    def find(self, id):
+        lo = np.searchsorted(self.sortedIds, id, side='left')
+        hi = np.searchsorted(self.sortedIds, id, side='right')
+        idx = np.searchsorted(self.idOrder[lo:hi], self.pos - self.base)
+        if lo + idx >= hi:
+            return None
+        return self.base + int(self.idOrder[lo + idx])
+
+    def markSkipped(self, first, num):
+        self.skippedEvents += num
+        if len(self.skippedRanges) > 0 and self.skippedRanges[-1][1] + 1 >= first:
+            self.skippedRanges[-1][1] = max(self.skippedRanges[-1][1], first + num - 1)
+        else:
+            self.skippedRanges.append([first, first + num - 1])
+
+    # skips the events up to the given position
+    def skipTo(self, pos):
+        self.markSkipped(self.pos, pos - self.pos)
+        self.pos = pos
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,220 @@
+from utils import *
+from data_processing_utils import *
+from local_daq_generate import *
+import local_daq_compare
+import local_daq_unpack_compare
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import platform
+import resource
+import subprocess
+import multiprocessing
+import numpy as np
+
+# times the unpacker, the error checkers, the compare tools and the event dump on synthetic local DAQ files of several sizes (see local_daq_generate.py)
+# and reports events/s, MB/s and the peak RSS of each, the results are saved as JSON, so that they can be compared between commits with --baseline
+# each benchmark runs in a fresh worker process, so that the peak RSS of one doesn't include the memory of the previous ones
+
+BENCHMARK_SIZES_MB = [10, 50, 200]
+BENCHMARKS = ['unpackFile', 'checkEventErrors', 'checkEvents', 'local_daq_compare', 'local_daq_unpack_compare', 'dumpEventsNumpy']
+DUMP_BENCHMARK_EVENTS = 200 # how many event pairs are dumped in the dumpEventsNumpy benchmark
+CORRUPT_WORDS_PER_MB = 10 # number of data words changed per MB in the second file of the compare benchmarks
+BASELINE_TOLERANCE = 0.1 # results more than this fraction slower than the baseline are shown in red
+
+def main():
+
+    sizesMb = BENCHMARK_SIZES_MB
+    benchmarks = BENCHMARKS
+    outFilename = None
+    baselineFilename = None
+    workDir = None
+    seed = 1
+
+    args = sys.argv[1:]
+    if '--sizes' in args:
+        i = args.index('--sizes')
+        sizesMb = [float(s) for s in args[i + 1].split(',')]
+        del args[i:i + 2]
+    if '--only' in args:
+        i = args.index('--only')
+        benchmarks = args[i + 1].split(',')
+        del args[i:i + 2]
+    if '--out' in args:
+        i = args.index('--out')
+        outFilename = args[i + 1]
+        del args[i:i + 2]
+    if '--baseline' in args:
+        i = args.index('--baseline')
+        baselineFilename = args[i + 1]
+        del args[i:i + 2]
+    if '--workdir' in args:
+        i = args.index('--workdir')
+        workDir = args[i + 1]
+        del args[i:i + 2]
+    if '--seed' in args:
+        i = args.index('--seed')
+        seed = int(args[i + 1])
+        del args[i:i + 2]
+
+    if len(args) > 0 or len([b for b in benchmarks if b not in BENCHMARKS]) > 0:
+        print('Usage: unpacker_benchmark.py [--sizes MB1,MB2,...] [--only NAME1,NAME2,...] [--out FILE] [--baseline FILE] [--workdir DIR] [--seed N]')
+        print('--sizes sets the synthetic file sizes in MB (default is %s)' % ",".join([str(s) for s in BENCHMARK_SIZES_MB]))
+        print('--only runs only the given benchmarks, available benchmarks: %s' % ", ".join(BENCHMARKS))
+        print('--out FILE saves the results to FILE (default is unpacker_benchmark_<date>_<time>.json)')
+        print('--baseline FILE compares the results to the ones saved in FILE by a previous run')
+        print('--workdir DIR generates the files in DIR and keeps them (by default they are generated in a temporary directory, which is removed at the end)')
+        print('--seed N seeds the synthetic file generator (default is 1)')
+        return
+
+    if outFilename is None:
+        outFilename = time.strftime("unpacker_benchmark_%Y%m%d_%H%M%S.json")
+
+    heading('Welcome to the unpacker benchmark')
+
+    keepFiles = workDir is not None
+    if workDir is None:
+        workDir = tempfile.mkdtemp(prefix="unpacker_benchmark_")
+    elif not os.path.isdir(workDir):
+        os.makedirs(workDir)
+
+    results = []
+    try:
+        for sizeMb in sizesMb:
+            filename1 = os.path.join(workDir, "synthetic_%gmb_1.raw" % sizeMb)
+            filename2 = os.path.join(workDir, "synthetic_%gmb_2.raw" % sizeMb)
+            subheading("Generating %g MB synthetic files" % sizeMb)
+            numEvents = generateFile(filename1, sizeMb, seed)
+            writeCorruptedCopy(filename1, filename2, int(CORRUPT_WORDS_PER_MB * sizeMb) + 1, seed)
+            fileBytes = os.path.getsize(filename1)
+            print("%d events, %d bytes" % (numEvents, fileBytes))
+
+            for name in benchmarks:
+                # each benchmark gets its own worker process
+                pool = multiprocessing.Pool(1)
+                res = pool.apply(runBenchmark, (name, filename1, filename2))
+                pool.close()
+                pool.join()
+                res['name'] = name
+                res['sizeMb'] = sizeMb
+                res['eventsPerSec'] = res['numEvents'] / res['seconds'] if res['seconds'] > 0 else 0.0
+                res['mbPerSec'] = res['bytes'] / 1024.0 / 1024.0 / res['seconds'] if res['seconds'] > 0 else 0.0
+                results.append(res)
+                printCyan("    %-25s %8.3f s  %12.1f events/s  %8.2f MB/s  peak RSS %8.1f MB" % (name, res['seconds'], res['eventsPerSec'], res['mbPerSec'], res['peakRssMb']))
+    finally:
+        if not keepFiles:
+            shutil.rmtree(workDir)
+
+    summary = {'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+               'commit': getGitCommit(),
+               'host': platform.node(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'seed': seed,
+               'results': results}
+    with open(outFilename, 'w') as f:
+        json.dump(summary, f, indent=1, sort_keys=True)
+    printCyan("Results saved to %s" % outFilename)
+
+    if baselineFilename is not None:
+        compareToBaseline(results, baselineFilename)
+
+# copies filename1 to filename2, changing the low bit of numWords random CFEB/ALCT/TMB data words (words without any DDU code), so that the event structure stays the same
+def writeCorruptedCopy(filename1, filename2, numWords, seed):
+    raw = np.fromfile(filename1, dtype=np.uint64)
+    dataWords = np.flatnonzero(raw & np.uint64(0xf000f000f000f000) == 0)
+    if dataWords.size > 0:
+        rnd = np.random.RandomState(seed)
+        raw[dataWords[rnd.randint(0, dataWords.size, size=numWords)]] ^= np.uint64(1)
+    raw.tofile(filename2)
+
+# runs one benchmark in the current process, returns a dictionary with the number of events and bytes processed, the time, and the peak RSS
+# everything printed by the benchmarked code is discarded
+def runBenchmark(name, filename1, filename2):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        numEvents = 0
+        numBytes = os.path.getsize(filename1)
+        if name == 'unpackFile':
+            t0 = time.time()
+            events = unpackFile(filename1)
+            t1 = time.time()
+            numEvents = len(events)
+        elif name == 'checkEventErrors':
+            events = unpackFile(filename1)
+            t0 = time.time()
+            for event in events:
+                checkEventErrors(event)
+            t1 = time.time()
+            numEvents = len(events)
+        elif name == 'checkEvents':
+            t0 = time.time()
+            for index in streamEventIndexes(filename1):
+                checkEvents(index).getErrorEvents()
+                numEvents += len(index)
+            t1 = time.time()
+        elif name == 'local_daq_compare':
+            t0 = time.time()
+            local_daq_compare.compareRuns([filename1], [filename2], 0)
+            t1 = time.time()
+            numEvents = len(indexFile(filename1))
+        elif name == 'local_daq_unpack_compare':
+            argv = sys.argv
+            sys.argv = ['local_daq_unpack_compare.py', filename1, filename2, '--dump-samples', '0']
+            t0 = time.time()
+            local_daq_unpack_compare.main()
+            t1 = time.time()
+            sys.argv = argv
+            numEvents = len(indexFile(filename1))
+        elif name == 'dumpEventsNumpy':
+            index1 = indexFile(filename1)
+            index2 = indexFile(filename2)
+            numEvents = min(len(index1), len(index2), DUMP_BENCHMARK_EVENTS)
+            events1 = index1.events[:numEvents]
+            events2 = index2.events[:numEvents]
+            numBytes = int((events1['end'] - events1['start']).sum()) * 8
+            out = open(os.devnull, 'w')
+            t0 = time.time()
+            for i in range(numEvents):
+                dumpEventsNumpy(index1.raw[events1['start'][i]:events1['end'][i]], index2.raw[events2['start'][i]:events2['end'][i]], out=out)
+            t1 = time.time()
+            out.close()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    # ru_maxrss is in kB on Linux
+    return {'numEvents': numEvents, 'bytes': numBytes, 'seconds': t1 - t0, 'peakRssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+def getGitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+# prints the MB/s and peak RSS of each result next to the same benchmark and file size in the baseline results file
+def compareToBaseline(results, baselineFilename):
+    with open(baselineFilename) as f:
+        baseline = json.load(f)
+    baselineResults = dict([((res['name'], res['sizeMb']), res) for res in baseline['results']])
+
+    subheading("Comparison to %s (commit %s)" % (baselineFilename, baseline.get('commit')))
+    for res in results:
+        key = (res['name'], res['sizeMb'])
+        if key not in baselineResults:
+            print("    %-25s %6g MB: not in the baseline" % key)
+            continue
+        base = baselineResults[key]
+        speedup = res['mbPerSec'] / base['mbPerSec'] if base['mbPerSec'] > 0 else 0.0
+        line = "    %-25s %6g MB: %8.2f MB/s vs %8.2f MB/s (x%.2f), peak RSS %8.1f MB vs %8.1f MB" % (res['name'], res['sizeMb'], res['mbPerSec'], base['mbPerSec'], speedup, res['peakRssMb'], base['peakRssMb'])
+        if speedup < 1.0 - BASELINE_TOLERANCE:
+            printRed(line)
+        else:
+            print(line)
+
+if __name__ == '__main__':
+    main()
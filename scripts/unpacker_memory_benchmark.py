@@ -0,0 +1,130 @@
+from utils import *
+from data_processing_utils import *
+import sys
+import os
+import imp
+import tempfile
+import subprocess
+import numpy as np
+
+# measures the memory used by the unpacker objects (FedEvent, DmbEvent, CfebEvent, CfebTimeSample) per event at different unpacking stages
+# the raw data itself is shared by all events, so it's not counted (numpy views only count their object header)
+# with --baseline the same file is also unpacked with an older data_processing_utils.py (e.g. the per instance __dict__ classes before the __slots__ change), to show the bytes per event before and after
+
+MEMORY_STAGES = ['after unpackFile', 'after checkEventErrors', 'with all CFEBs and time samples materialized']
+
+def main():
+
+    ldaqFilename = ""
+    maxEvents = None
+    baseline = None
+
+    args = sys.argv[1:]
+    if '--baseline' in args:
+        i = args.index('--baseline')
+        baseline = args[i + 1]
+        del args[i:i + 2]
+
+    if len(args) < 1:
+        print('Usage: unpacker_memory_benchmark.py <local_daq_data_file> [max_num_events] [--baseline GIT_REV_OR_FILE]')
+        print('Prints the average number of bytes used by the unpacker objects per event: after unpackFile, after checkEventErrors, and after accessing all CFEBs and their time samples')
+        print('--baseline also measures the same events with another version of data_processing_utils.py (a file, or a git revision of this one, e.g. HEAD~10) and prints both')
+        return
+    else:
+        ldaqFilename = args[0]
+
+    if len(args) > 1:
+        maxEvents = int(args[1])
+
+    heading('Welcome to the unpacker memory benchmark')
+
+    current = measureBytesPerEvent(sys.modules['data_processing_utils'], ldaqFilename, maxEvents)
+    if current is None:
+        printRed("No events found")
+        return
+
+    if baseline is None:
+        for stage, numBytes in zip(MEMORY_STAGES, current):
+            printCyan("Bytes per event %s: %.1f" % (stage, numBytes))
+        return
+
+    baselineModule = loadBaselineModule(baseline)
+    before = measureBytesPerEvent(baselineModule, ldaqFilename, maxEvents)
+    subheading("Bytes per event, baseline (%s) -> current" % baseline)
+    for stage, numBytesBefore, numBytes in zip(MEMORY_STAGES, before, current):
+        printCyan("%-50s %10.1f -> %10.1f (x%.2f)" % (stage, numBytesBefore, numBytes, numBytesBefore / numBytes))
+
+# returns the average number of bytes used by the unpacker objects of the given data_processing_utils module per event at each of the MEMORY_STAGES, or None if there are no events
+# the raw data itself is shared by all events, so it's not counted
+def measureBytesPerEvent(module, ldaqFilename, maxEvents):
+    events = module.unpackFile(ldaqFilename)
+    if maxEvents is not None:
+        events = events[:maxEvents]
+    if len(events) == 0:
+        return None
+
+    exclude = set()
+    if isinstance(events[0].words, np.ndarray) and events[0].words.base is not None:
+        exclude.add(id(events[0].words.base))
+
+    print("Number of events: %d" % len(events))
+    result = [float(deepSizeOf(events, exclude)) / len(events)]
+
+    for event in events:
+        module.checkEventErrors(event)
+    result.append(float(deepSizeOf(events, exclude)) / len(events))
+
+    for event in events:
+        for dmb in event.dmbs:
+            for cfeb in dmb.cfebs:
+                cfeb.timeSamples
+    result.append(float(deepSizeOf(events, exclude)) / len(events))
+    return result
+
+# loads another version of data_processing_utils.py as a separate module: baseline is a filename, or a git revision to take scripts/data_processing_utils.py from
+def loadBaselineModule(baseline):
+    if os.path.isfile(baseline):
+        return imp.load_source('data_processing_utils_baseline', baseline)
+    scriptsDir = os.path.dirname(os.path.abspath(__file__))
+    source = subprocess.check_output(['git', 'show', '%s:./data_processing_utils.py' % baseline], cwd=scriptsDir)
+    tmpFile = tempfile.NamedTemporaryFile(suffix='.py', delete=False)
+    try:
+        tmpFile.write(source)
+        tmpFile.close()
+        return imp.load_source('data_processing_utils_baseline', tmpFile.name)
+    finally:
+        os.remove(tmpFile.name)
+
+# returns the total size of the given object and everything that it references (each object is only counted once)
+# objects in the exclude set (ids) are not counted (e.g. the raw data array)
+def deepSizeOf(obj, exclude):
+    seen = set(exclude)
+    total = 0
+    stack = [obj]
+    while len(stack) > 0:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, np.ndarray):
+            # views don't own their data, so getsizeof only counts the array object itself, but the base is included if it's not excluded
+            if o.base is not None:
+                stack.append(o.base)
+        elif isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set)):
+            stack.extend(o)
+        else:
+            if hasattr(o, '__dict__'):
+                stack.append(o.__dict__)
+            for cls in type(o).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(o, slot):
+                        stack.append(getattr(o, slot))
+
+    return total
+
+if __name__ == '__main__':
+    main()